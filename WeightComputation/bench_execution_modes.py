@@ -0,0 +1,55 @@
+#!/usr/bin/python
+"""This file contains the benchmark of the process and thread execution modes
+of the backend weight calculation"""
+
+import sys
+import time
+import numpy as np
+from libpd import detector as dt
+from libpd import source_construction as sc
+import libpd.weight_calc as wc
+
+# the number of wall divisions of the benchmark sources
+BENCH_WALL_DIVS = 4
+
+
+def main(nai_pos_path, core_count, num_dets):
+    """Times the backend weight calculation of the first detectors of a
+    position file in each execution mode and checks that they agree
+
+    Parameters
+    ----------
+    nai_pos_path : str
+        path to the list of AD1 patches, normals, and sizes
+    core_count : int
+        number of cores to use for the calculation
+    num_dets : int
+        number of detector positions from the file to use
+    """
+    sc.WALL_DIVS = BENCH_WALL_DIVS
+    detectors = dt.make_nai_list(dt.read_positions(nai_pos_path)[:num_dets])
+    sources = sc.set_up_source_tables()
+    timings = {}
+    weights = {}
+    for mode in wc.EXECUTION_MODES:
+        start = time.time()
+        weights[mode] = wc.calculate_weights(detectors, sources, core_count,
+                                             as_tensor=True, execution=mode)[0]
+        timings[mode] = time.time() - start
+    diff = np.nanmax(np.abs(weights["thread"] - weights["process"]))
+    print "Benchmark of {0:d} detectors on {1:d} cores".format(num_dets,
+                                                              core_count)
+    for mode in wc.EXECUTION_MODES:
+        print "    {0:s} mode: {1:.3f} s".format(mode, timings[mode])
+    print "    Largest weight difference between the modes: {0:e}".format(diff)
+
+
+USAGE = """Usage:
+    {0:s} <Path To NaI Center Points File> <Number of Cores> <Number of Detectors>
+"""
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print USAGE.format(sys.argv[0])
+        sys.exit()
+    main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
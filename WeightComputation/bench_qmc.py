@@ -0,0 +1,163 @@
+#!/usr/bin/python
+"""This file contains the benchmark of the sampling integrators (Monte Carlo
+and the quasi-Monte Carlo sequences) against the backend on each class of
+source"""
+
+import sys
+import time
+import numpy as np
+from libpd import detector as dt
+from libpd import source_construction as sc
+from libpd import flat_sources as fs
+from libpd import geom_base as gb
+import libpd.weight_calc as wc
+import libpd.monte_carlo as mc
+import libpd.quasi_monte_carlo as qmc
+import libpd.source_table as st
+
+# the relative standard error the sampling integrators are run to
+BENCH_RTOL = 1.0e-3
+# the number of standard errors within which a sampled weight is counted as
+# agreeing with the backend
+AGREE_SIGMAS = 3.0
+
+
+def make_circles():
+    """Makes a copy of the EF4 hot patch as every class of circle
+
+    Returns
+    -------
+    circle_list : list
+        list of circle sources
+    """
+    patch = sc.make_hot_patches()[0]
+    rotation = gb.Rotation()
+    rotation.add_y_rot(90.0)
+    return [patch,
+            fs.Circle("EF4_Circle", patch.center, patch.rad, rotation),
+            fs.CircleXY("EF4_XY", patch.center, patch.rad),
+            fs.CircleXZ("EF4_XZ", patch.center, patch.rad)]
+
+
+def make_pairs(detectors, sources):
+    """Makes the detecting surface source pairs of every source that is not
+    entirely behind the surface
+
+    Parameters
+    ----------
+    detectors : list of libpd.detector.Detector classes
+        The detectors
+    sources : list of libpd.geom_base.Shape
+        The sources
+
+    Returns
+    -------
+    input_list : list of tuples
+        The pairs and their associated data, as built by calculate_weights
+    """
+    input_list = []
+    for det in detectors:
+        rdat = det.get_run_data()
+        for i, det_surf in enumerate(det.get_detecting_surfaces()):
+            for table in st.as_tables(sources):
+                vis = wc.plane_visibility(det_surf, table.bounding_boxes())
+                for j in np.flatnonzero(vis != wc.VIS_HIDDEN):
+                    input_list.append(((rdat[0], rdat[1], i, table.names[j]),
+                                       det_surf, table.row(j), vis[j]))
+    return input_list
+
+
+def backend_weights(input_list):
+    """Integrates every pair with the backend, one batched call per kind of
+    source and a call per pair for the sources the batch call has no shape
+    for, without the analytic kernels calculate_weights would use
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The pairs and their associated data, see make_pairs
+
+    Returns
+    -------
+    weights : numpy array
+        The backend weight of every pair
+    """
+    weights = np.full(len(input_list), np.nan)
+    kinds = {}
+    for i, data in enumerate(input_list):
+        kinds.setdefault(data[2].get_batch_params()[0], []).append(i)
+    with wc.BackendSession() as session:
+        for kind, inds in kinds.items():
+            out_params = session.calc_integral_batch(
+                [input_list[i][1] for i in inds], kind,
+                [input_list[i][2] for i in inds])
+            for i, params in zip(inds, out_params):
+                if np.isnan(params[0]):
+                    params = session.calc_integral(input_list[i][1],
+                                                   input_list[i][2])
+                weights[i] = params[0]
+    return weights
+
+
+def main(nai_pos_path, num_dets):
+    """Times the backend and the sampling integrators on the Square, Circle,
+    VertCylinder, and RotXaxisCylinder sources seen by the first detectors of
+    a position file and compares the weights
+
+    Parameters
+    ----------
+    nai_pos_path : str
+        path to the list of AD1 patches, normals, and sizes
+    num_dets : int
+        number of detector positions from the file to use
+    """
+    detectors = dt.make_nai_list(dt.read_positions(nai_pos_path)[:num_dets])
+    groups = [("Square", sc.make_whole_cube_wall_sources()),
+              ("Circle", make_circles()),
+              ("VertCylinder", sc.make_vertical_cylinders()),
+              ("RotXaxisCylinder", sc.make_beamlines())]
+    samplers = [("montecarlo", None)] + [("qmc-" + x, x) for x in
+                                         qmc.SEQUENCES]
+    lines = []
+    for name, sources in groups:
+        input_list = make_pairs(detectors, sources)
+        start = time.time()
+        ref = backend_weights(input_list)
+        lines.append("{0:s}: {1:d} pairs, backend {2:.3f} s".format(
+            name, len(input_list), time.time() - start))
+        for integrator, sequence in samplers:
+            start = time.time()
+            if sequence is None:
+                weights, errors, _ = mc.calc_weights_mc(input_list,
+                                                        BENCH_RTOL)
+            else:
+                weights, errors, _ = qmc.calc_weights_qmc(input_list,
+                                                          sequence, BENCH_RTOL)
+            elapsed = time.time() - start
+            weights = np.array([x[1] for x in weights])
+            errors = np.array([x[1] for x in errors])
+            rel_diff = np.abs(weights - ref)/np.maximum(np.abs(ref), 1.0e-300)
+            agree = np.abs(weights - ref) <= (AGREE_SIGMAS*errors +
+                                              mc.DEFAULT_ATOL)
+            temp = "    {0:s}: {1:.3f} s, largest relative difference "\
+                "{2:.2e}, median relative error {3:.2e}, {4:.1f}% within "\
+                "{5:.0f} sigma"
+            lines.append(temp.format(
+                integrator, elapsed, np.max(rel_diff),
+                np.median(errors/np.maximum(np.abs(weights), 1.0e-300)),
+                100.0*np.mean(agree), AGREE_SIGMAS))
+    print "Benchmark of {0:d} detectors at a relative error of {1:.1e}".format(
+        num_dets, BENCH_RTOL)
+    for line in lines:
+        print line
+
+
+USAGE = """Usage:
+    {0:s} <Path To NaI Center Points File> <Number of Detectors>
+"""
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print USAGE.format(sys.argv[0])
+        sys.exit()
+    main(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,101 @@
+#!/usr/bin/python
+"""This file contains the benchmark suite of the weight calculation, the
+per source class microbenchmarks and the scaling benchmark of libpd.benchmark,
+run on a synthetic detector layout and written to a JSON file"""
+
+import sys
+import libpd.benchmark as bench
+import libpd.monte_carlo as mc
+import libpd.weight_calc as wc
+
+
+def main(out_name, max_cores, integrators, parts, wall_divs, num_runs,
+         execution, mc_rtol, baseline_path=None):
+    """Runs the benchmarks, writes the results, and compares them to a
+    baseline
+
+    Parameters
+    ----------
+    out_name : str
+        name of the output JSON file
+    max_cores : int
+        the scaling benchmark runs on 1 to this many cores
+    integrators : list of str
+        the integrators to benchmark, from weight_calc.INTEGRATORS
+    parts : list of str
+        which benchmarks to run, "micro" and/or "scaling"
+    wall_divs : list of ints
+        the numbers of wall divisions of the scaling benchmark
+    num_runs : int
+        the number of scan runs of the synthetic detector layout
+    execution : str
+        one of weight_calc.EXECUTION_MODES
+    mc_rtol : float
+        the relative standard error the sampling integrators stop at
+    baseline_path : str
+        if not None, a results file of an earlier run to compare against
+    """
+    results = {"environment": bench.environment_metadata(integrators,
+                                                         mc_rtol),
+               "micro": [], "scaling": []}
+    if "micro" in parts:
+        results["micro"] = bench.run_micro(integrators, mc_rtol)
+    if "scaling" in parts:
+        results["scaling"] = bench.run_scaling(integrators, max_cores,
+                                               wall_divs, num_runs,
+                                               execution, mc_rtol)
+        for record in results["scaling"]:
+            print "{0:>10s} wall divs {1:2d} on {2:d} cores: {3:.3f} s".format(
+                record["integrator"], record["wall_divs"], record["cores"],
+                record["seconds"])
+    bench.write_results(out_name, results)
+    if baseline_path is not None:
+        print "Compared to", baseline_path
+        for line in bench.compare_results(results,
+                                          bench.read_results(baseline_path)):
+            print "    " + line
+
+
+USAGE = """Usage:
+    {0:s} <Output JSON File> <Max Number of Cores> [Options]
+Options:
+    --integrators=A,B   Integrators to benchmark (default backend), from
+                        {1:s}
+    --micro             Only run the per source class microbenchmarks
+    --scaling           Only run the scaling benchmark
+    --wall-divs=A,B     Wall divisions of the scaling benchmark (default
+                        {2:s})
+    --runs=N            Scan runs of the synthetic detector layout (default
+                        {3:d})
+    --thread            Run the scaling benchmark with a thread pool
+    --rtol=R            Relative standard error of the sampling integrators
+    --baseline=FILE     Compare the results to an earlier results file
+"""
+
+if __name__ == "__main__":
+    ARGS = [x for x in sys.argv[1:] if not x.startswith("--")]
+    FLAGS = dict([(x.split("=", 1) + [None])[:2] for x in sys.argv[1:]
+                  if x.startswith("--")])
+    if (len(ARGS) != 2 or
+            any([x not in ["--integrators", "--micro", "--scaling",
+                           "--wall-divs", "--runs", "--thread", "--rtol",
+                           "--baseline"] for x in FLAGS])):
+        print USAGE.format(sys.argv[0], ", ".join(wc.INTEGRATORS),
+                           ",".join([str(x) for x in
+                                     bench.SCALING_WALL_DIVS]),
+                           bench.SCALING_RUNS)
+        sys.exit()
+    INTEGRATORS = (FLAGS["--integrators"].split(",")
+                   if FLAGS.get("--integrators") else ["backend"])
+    if any([x not in wc.INTEGRATORS for x in INTEGRATORS]):
+        print "Unknown integrator in:", ", ".join(INTEGRATORS)
+        sys.exit()
+    PARTS = [x for x in ["micro", "scaling"] if "--" + x in FLAGS]
+    WALL_DIVS = ([int(x) for x in FLAGS["--wall-divs"].split(",")]
+                 if FLAGS.get("--wall-divs") else bench.SCALING_WALL_DIVS)
+    main(ARGS[0], int(ARGS[1]), INTEGRATORS,
+         (PARTS if PARTS else ["micro", "scaling"]), WALL_DIVS,
+         int(FLAGS.get("--runs") or bench.SCALING_RUNS),
+         ("thread" if "--thread" in FLAGS else "process"),
+         float(FLAGS.get("--rtol") or mc.DEFAULT_RTOL),
+         FLAGS.get("--baseline"))
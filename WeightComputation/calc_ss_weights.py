@@ -3,12 +3,21 @@
 calculations, i.e. it uses the infrastructure from position decomposition
 to calculate the weight of each source on the AD1 'patches' """
 
+import os
 import sys
 from libpd import detector as dt
 from libpd import source_construction as sc
 import libpd.weight_calc as wc
+import libpd.multi_res as mr
+import libpd.weight_io as wio
 
-def main(patch_info_path, core_count, out_name):
+# the extension added to the output file name to make the checkpoint file name
+CHECKPOINT_EXT = ".ckpt"
+
+
+def main(patch_info_path, core_count, out_name, cache_path=None,
+         multi_res_bases=None, checkpoint=False, resume=False, text=False,
+         cost_model_path=None):
     """Primary entrypoint for the weight calculation code
 
     Parameters
@@ -19,24 +28,101 @@ def main(patch_info_path, core_count, out_name):
         number of cores to use for the calculation
     out_name : str
         name of the output file
+    cache_path : str
+        path to the weight cache file, or None to not use a cache
+    multi_res_bases : tuple of ints
+        if not None, the finest wall patches are replaced by every wall level
+        that is a power of one of these bases (see libpd.multi_res)
+    checkpoint : bool
+        if True, the weights are written to a checkpoint file (the output file
+        name with CHECKPOINT_EXT appended) as they are finished, so an
+        interrupted run can be resumed, the file is removed once the output
+        is written
+    resume : bool
+        if True, continue an interrupted run from its checkpoint file, implies
+        checkpoint
+    text : bool
+        if True, write the weights as lines of text instead of a binary
+        response matrix file (see libpd.weight_io)
+    cost_model_path : str
+        if not None, the file the backend cost model (see libpd.scheduler) is
+        loaded from and saved to between runs
     """
+    if multi_res_bases is not None:
+        # fail on bases that add no level before the integration, not after
+        mr.level_divisions(sc.WALL_DIVS, multi_res_bases)
     detectors = dt.read_patches(patch_info_path)
-    sources = sc.set_up_all_sources()
-    print "There are {0:d} sources in this run".format(len(sources))
-    weights = wc.calculate_weights(detectors, sources, core_count)
-    out_file = open(out_name, 'w')
-    fmt_str = "{0:d}, {1:d}, {2:s}, {3:10.8e}\n"
-    for elem in weights:
-        out_file.write(fmt_str.format(*elem))
-    out_file.close()
+    sources = sc.set_up_source_tables()
+    num_sources = sum([len(x) for x in sources])
+    print "There are {0:d} sources in this run".format(num_sources)
+    check_path = (out_name + CHECKPOINT_EXT if checkpoint or resume else
+                  None)
+    provenance = {}
+    weights = wc.calculate_weights(detectors, sources, core_count,
+                                   cache_path=cache_path,
+                                   checkpoint_path=check_path,
+                                   resume=resume,
+                                   cost_model_path=cost_model_path,
+                                   provenance=provenance)
+    if multi_res_bases is not None:
+        weights = mr.build_multi_res_weights(weights, bases=multi_res_bases)
+    if not text:
+        metadata = {"wall_divs": sc.WALL_DIVS,
+                    "multi_res_bases": multi_res_bases,
+                    "num_sources": num_sources}
+        metadata.update(provenance)
+        wio.write_weights(out_name, weights, metadata)
+    else:
+        out_file = open(out_name, 'w')
+        fmt_str = "{0:d}, {1:d}, {2:s}, {3:10.8e}\n"
+        for elem in weights:
+            out_file.write(fmt_str.format(*elem))
+        out_file.close()
+    # the weights are safe in the output, the checkpoint is not needed
+    if check_path is not None:
+        os.remove(check_path)
 
 
 USAGE = """Usage:
-    {0:s} <Path To Patch Info File> <Number of Cores> <Ouput File Name>
+    {0:s} <Path To Patch Info File> <Number of Cores> <Ouput File Name> [Weight Cache File] [Options]
+Options:
+    --multi-res       Write every 2^k level of the wall patches
+    --multi-res-3     Also write the 3^k levels of the wall patches, needs
+                      a WALL_DIVS (libpd/source_construction.py) that is a
+                      multiple of 3
+    --checkpoint      Write the weights to a checkpoint file as they are
+                      finished, removed once the output is written
+    --resume          Continue an interrupted --checkpoint run from its
+                      checkpoint file
+    --text            Write a text file instead of a binary .npz file
+    --cost-model=FILE Keep the backend cost model, which orders the
+                      integrals longest first, in FILE between runs
 """
 
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
+    ARGS = [x for x in sys.argv[1:] if not x.startswith("--")]
+    FLAGS = [x for x in sys.argv[1:] if x.startswith("--")]
+    if (len(ARGS) not in [3, 4] or
+            any([x not in ["--multi-res", "--multi-res-3", "--checkpoint",
+                           "--resume", "--text"] and
+                 not x.startswith("--cost-model=") for x in FLAGS])):
         print USAGE.format(sys.argv[0])
         sys.exit()
-    main(sys.argv[1], int(sys.argv[2]), sys.argv[3])
+    BASES = None
+    if "--multi-res-3" in FLAGS:
+        if sc.WALL_DIVS % 3 != 0:
+            print USAGE.format(sys.argv[0])
+            print "--multi-res-3 needs a WALL_DIVS that is a multiple of 3, "\
+                "it is {0:d}".format(sc.WALL_DIVS)
+            sys.exit()
+        BASES = (2, 3)
+    elif "--multi-res" in FLAGS:
+        BASES = (2,)
+    COST_MODEL = None
+    for FLAG in FLAGS:
+        if FLAG.startswith("--cost-model="):
+            COST_MODEL = FLAG.split("=", 1)[1]
+    main(ARGS[0], int(ARGS[1]), ARGS[2], (ARGS[3] if len(ARGS) == 4 else None),
+         multi_res_bases=BASES, checkpoint=("--checkpoint" in FLAGS),
+         resume=("--resume" in FLAGS), text=("--text" in FLAGS),
+         cost_model_path=COST_MODEL)
@@ -5,3 +5,21 @@ import libpd.shell_sources as shell_sources
 import libpd.weight_calc as weight_calc
 import libpd.low_dim_sources as low_dim_sources
 import libpd.source_construction as source_construction
+import libpd.cubature as cubature
+import libpd.weight_cache as weight_cache
+import libpd.analytic as analytic
+import libpd.multipole as multipole
+import libpd.multi_res as multi_res
+import libpd.checkpoint as checkpoint
+import libpd.scheduler as scheduler
+import libpd.weight_io as weight_io
+import libpd.source_table as source_table
+import libpd.shared_geometry as shared_geometry
+import libpd.sharding as sharding
+import libpd.monte_carlo as monte_carlo
+import libpd.quasi_monte_carlo as quasi_monte_carlo
+import libpd.error_budget as error_budget
+import libpd.telemetry as telemetry
+import libpd.benchmark as benchmark
+import libpd.tracing as tracing
+import libpd.surrogate as surrogate
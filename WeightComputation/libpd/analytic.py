@@ -0,0 +1,490 @@
+"""This file contains the analytic (closed form up to a smooth low dimensional
+quadrature) integration kernels for the detecting surface and source pairs
+whose geometry allows it. Like libpd.cubature everything works on the stacked
+batch parameters (see Shape.get_batch_params) so the kernels are evaluated for
+many pairs at once"""
+
+import numpy as np
+import libpd.geom_base as gb
+
+INV_FOUR_PI = (1.0/(4.0*np.pi))
+# the number of Gauss-Legendre nodes used for the remaining smooth integral of
+# the point to rectangle kernel, this gives a relative error below 1e-10 for
+# heights down to 1e-3 of the rectangle size
+POINT_RECT_ORDER = 32
+# the number of Gauss-Legendre nodes per axis on each smooth piece of the
+# remaining integrals of the rectangle to rectangle kernels
+RECT_ORDER = 16
+# the relative size of the dot product of two vectors below which they are
+# treated as perpendicular
+ORTHO_TOL = 1.0e-9
+# the smallest gap between a source rectangle and a surface, relative to the
+# size of the surface, for which the rectangle kernels are used, closer pairs
+# have a near singular remaining integrand and are left to the integrators
+RECT_GAP_TOL = 0.05
+# the kernels that can be used for a pair, see pair_kernel
+KERNEL_POINT_RECT = 0
+KERNEL_RECT_PARALLEL = 1
+KERNEL_RECT_PERPENDICULAR = 2
+KERNEL_NAMES = ["Point-Rectangle", "Parallel Rectangles",
+                "Perpendicular Rectangles"]
+
+
+def unit_rule(order):
+    """Returns the Gauss-Legendre rule mapped onto [0, 1]
+
+    Parameters
+    ----------
+    order : int
+        The number of nodes
+
+    Returns
+    -------
+    nodes : numpy array
+        The node positions
+    wts : numpy array
+        The node weights
+    """
+    nodes, wts = np.polynomial.legendre.leggauss(order)
+    return (0.5*(nodes + 1.0), 0.5*wts)
+
+
+def corner_integral(width, length, height, order=POINT_RECT_ORDER):
+    """Integrates 1/r^2 over the rectangle spanning from the foot of the
+    perpendicular from a point to the corner (width, length), the inner
+    integral is done analytically and the substitution x = h*sinh(t) leaves
+    the smooth integral of atan(l/(h*cosh(t))) from 0 to asinh(w/h)
+
+    Parameters
+    ----------
+    width : numpy array
+        The signed extent of the rectangles along the first axis
+    length : numpy array
+        The signed extent of the rectangles along the second axis
+    height : numpy array
+        The (positive) distances of the points from the plane
+    order : int
+        The number of Gauss-Legendre nodes for the remaining integral
+
+    Returns
+    -------
+    integral : numpy array
+        The signed integrals, odd in both width and length
+    """
+    nodes, wts = unit_rule(order)
+    tmax = np.arcsinh(np.abs(width)/height)
+    targ = tmax[:, np.newaxis]*nodes[np.newaxis, :]
+    vals = np.arctan(np.abs(length)[:, np.newaxis] /
+                     (height[:, np.newaxis]*np.cosh(targ)))
+    return np.sign(width)*np.sign(length)*tmax*vals.dot(wts)
+
+
+def point_rect_weights(surf_params, points):
+    """Calculates the weights of point sources for rectangular detecting
+    surfaces, points on or behind the surface (by the line of sight test of
+    the numerical integrators, along the surface normal from the center) get
+    zero weight
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters (center, the two half edge
+        vectors and the normal)
+    points : numpy array
+        (N, 3) array of point source positions
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the weights
+    """
+    rel = points - surf_params[:, 0, :]
+    half1 = np.sqrt(np.sum(np.square(surf_params[:, 1, :]), axis=1))
+    half2 = np.sqrt(np.sum(np.square(surf_params[:, 2, :]), axis=1))
+    # the distance from the plane is measured along the normal of the plane
+    # spanned by the edges, which is not always the surface normal used for
+    # the line of sight test
+    plane_norm = np.cross(surf_params[:, 1, :], surf_params[:, 2, :])
+    xpos = np.sum(rel*surf_params[:, 1, :], axis=1)/half1
+    ypos = np.sum(rel*surf_params[:, 2, :], axis=1)/half2
+    height = np.abs(np.sum(rel*plane_norm, axis=1))/(half1*half2)
+    weights = np.zeros(points.shape[0], dtype=np.float64)
+    vis = (np.sum(rel*surf_params[:, 3, :], axis=1) > 0.0) & (height > 0.0)
+    if not np.any(vis):
+        return weights
+    xpos, ypos, height = xpos[vis], ypos[vis], height[vis]
+    half1, half2 = half1[vis], half2[vis]
+    # split the rectangle at the foot of the perpendicular into four
+    # rectangles that each have a corner there
+    total = np.zeros(height.size, dtype=np.float64)
+    for sgn1 in [1.0, -1.0]:
+        for sgn2 in [1.0, -1.0]:
+            total += (sgn1*sgn2*corner_integral(sgn1*half1 - xpos,
+                                                sgn2*half2 - ypos, height))
+    weights[vis] = INV_FOUR_PI*total
+    return weights
+
+
+def plane_height(params, point):
+    """Returns the distance of a point from the plane of a rectangle relative
+    to the size of the rectangle
+
+    Parameters
+    ----------
+    params : numpy array
+        4x3 array of rectangle batch parameters
+    point : numpy array
+        The position of the point
+
+    Returns
+    -------
+    height : float
+        The distance from the plane divided by the sum of the half edges
+    """
+    mag1 = np.linalg.norm(params[1])
+    mag2 = np.linalg.norm(params[2])
+    plane_norm = np.cross(params[1], params[2])/(mag1*mag2)
+    return abs((point - params[0]).dot(plane_norm))/(mag1 + mag2)
+
+
+def second_antiderivative(dist, offset):
+    """Evaluates the second antiderivative in dist of 1/(dist^2 + offset^2)
+
+    Parameters
+    ----------
+    dist : numpy array
+        The separation along the axis
+    offset : numpy array
+        The (positive) distance perpendicular to the axis
+
+    Returns
+    -------
+    value : numpy array
+        dist*atan(dist/offset)/offset - log(dist^2 + offset^2)/2
+    """
+    return (dist*np.arctan(dist/offset)/offset -
+            0.5*np.log(np.square(dist) + np.square(offset)))
+
+
+def interval_pair_integral(lo1, hi1, lo2, hi2, offset):
+    """Integrates 1/((x2 - x1)^2 + offset^2) over x1 in [lo1, hi1] and x2 in
+    [lo2, hi2] analytically
+
+    Parameters
+    ----------
+    lo1, hi1 : numpy array
+        The bounds of the first interval
+    lo2, hi2 : numpy array
+        The bounds of the second interval
+    offset : numpy array
+        The (positive) distance perpendicular to the intervals
+
+    Returns
+    -------
+    integral : numpy array
+        The value of the double integral
+    """
+    return (second_antiderivative(hi2 - lo1, offset) -
+            second_antiderivative(lo2 - lo1, offset) -
+            second_antiderivative(hi2 - hi1, offset) +
+            second_antiderivative(lo2 - hi1, offset))
+
+
+def parallel_rect_weights(layout, order=RECT_ORDER):
+    """Calculates the weights of source rectangles parallel to rectangular
+    detecting surfaces with aligned edges. The integral along the second edge
+    direction is done analytically, the remaining integral over the
+    separation along the first edge direction is weighted by the overlap
+    length of the two intervals, which is linear between its break points,
+    so it is done piece by piece with Gauss-Legendre rules
+
+    Parameters
+    ----------
+    layout : numpy array
+        (N, 7) array of the half lengths of the surface along its two edges,
+        the lower and upper bounds of the visible part of the source along the
+        two edges, and the height of the source above the surface, see
+        rect_layout
+    order : int
+        The number of Gauss-Legendre nodes per piece
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the weights
+    """
+    half1, half2, ulo, uhi, vlo, vhi, height = [layout[:, i, np.newaxis]
+                                                for i in range(7)]
+    breaks = np.sort(np.concatenate((ulo - half1, ulo + half1, uhi - half1,
+                                     uhi + half1), axis=1), axis=1)
+    # the remaining integrand peaks where the separation is zero
+    peak = np.clip(0.0, breaks[:, :1], breaks[:, -1:])
+    breaks = np.sort(np.concatenate((breaks, peak), axis=1), axis=1)
+    nodes, wts = unit_rule(order)
+    total = np.zeros(layout.shape[0], dtype=np.float64)
+    for piece in range(breaks.shape[1] - 1):
+        low = breaks[:, piece, np.newaxis]
+        width = breaks[:, piece+1, np.newaxis] - low
+        sep = low + width*nodes[np.newaxis, :]
+        overlap = np.maximum(0.0, np.minimum(half1, uhi - sep) -
+                             np.maximum(-half1, ulo - sep))
+        offset = np.sqrt(np.square(sep) + np.square(height))
+        vals = overlap*interval_pair_integral(-half2, half2, vlo, vhi, offset)
+        total += width[:, 0]*vals.dot(wts)
+    return INV_FOUR_PI*total
+
+
+def perpendicular_rect_weights(layout, order=RECT_ORDER):
+    """Calculates the weights of source rectangles perpendicular to
+    rectangular detecting surfaces that share an edge direction with them.
+    The integral along the shared direction is done analytically, the
+    remaining integral over the surface's other edge and the source's height
+    is done with tensor Gauss-Legendre rules split where the integrand peaks
+
+    Parameters
+    ----------
+    layout : numpy array
+        (N, 7) array of the half lengths of the surface across and along the
+        shared direction, the position of the source plane across the shared
+        direction, the lower and upper bounds of the source along the shared
+        direction, and the lower and upper bounds of the visible part of the
+        source along the surface normal, see rect_layout
+    order : int
+        The number of Gauss-Legendre nodes per axis per piece
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the weights
+    """
+    half1, half2, plane, vlo, vhi, wlo, whi = [layout[:, i, np.newaxis]
+                                               for i in range(7)]
+    ubreaks = np.concatenate((-half1, np.clip(plane, -half1, half1), half1),
+                             axis=1)
+    wbreaks = np.concatenate((wlo, np.clip(0.0, wlo, whi), whi), axis=1)
+    nodes, wts = unit_rule(order)
+    total = np.zeros(layout.shape[0], dtype=np.float64)
+    for upiece in range(2):
+        ulow = ubreaks[:, upiece, np.newaxis]
+        uwidth = ubreaks[:, upiece+1, np.newaxis] - ulow
+        upos = (ulow + uwidth*nodes[np.newaxis, :])[:, :, np.newaxis]
+        for wpiece in range(2):
+            wlow = wbreaks[:, wpiece, np.newaxis]
+            wwidth = wbreaks[:, wpiece+1, np.newaxis] - wlow
+            wpos = (wlow + wwidth*nodes[np.newaxis, :])[:, np.newaxis, :]
+            offset = np.sqrt(np.square(plane[:, :, np.newaxis] - upos) +
+                             np.square(wpos))
+            vals = interval_pair_integral(-half2[:, :, np.newaxis],
+                                          half2[:, :, np.newaxis],
+                                          vlo[:, :, np.newaxis],
+                                          vhi[:, :, np.newaxis], offset)
+            total += (uwidth[:, 0]*wwidth[:, 0] *
+                      np.einsum("nij,i,j->n", vals, wts, wts))
+    return INV_FOUR_PI*total
+
+
+def is_rectangle(params):
+    """Checks if parallelogram batch parameters describe a rectangle
+
+    Parameters
+    ----------
+    params : numpy array
+        4x3 array of batch parameters
+
+    Returns
+    -------
+    is_rect : bool
+        True if the two edge vectors are non zero and perpendicular
+    """
+    mag1 = np.linalg.norm(params[1])
+    mag2 = np.linalg.norm(params[2])
+    if mag1 == 0.0 or mag2 == 0.0:
+        return False
+    return abs(params[1].dot(params[2])) <= ORTHO_TOL*mag1*mag2
+
+
+def aligned_axis(vec, frame):
+    """Finds the axis of a frame that a vector is parallel to
+
+    Parameters
+    ----------
+    vec : numpy array
+        The vector
+    frame : numpy array
+        3x3 array of orthonormal axes
+
+    Returns
+    -------
+    axis : int
+        The index of the axis or None if the vector is not parallel to any
+    """
+    proj = frame.dot(vec)
+    axis = int(np.argmax(np.abs(proj)))
+    others = np.delete(np.abs(proj), axis)
+    if np.all(others <= ORTHO_TOL*np.linalg.norm(vec)):
+        return axis
+    return None
+
+
+def rect_layout(surf_params, src_params):
+    """Works out if a rectangular source and surface are parallel or
+    perpendicular with aligned edges and, if so, the layout of the source in
+    the frame of the surface (edge 1, edge 2, plane normal) after clipping it
+    to the part that passes the line of sight test
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        4x3 array of surface batch parameters
+    src_params : numpy array
+        4x3 array of source batch parameters
+
+    Returns
+    -------
+    kernel : int
+        KERNEL_RECT_PARALLEL, KERNEL_RECT_PERPENDICULAR, or None if neither
+        applies (or the pair is too close, or the source is hidden)
+    layout : numpy array
+        The 7 layout values of the kernel, see parallel_rect_weights and
+        perpendicular_rect_weights
+    """
+    half = np.array([np.linalg.norm(surf_params[1]),
+                     np.linalg.norm(surf_params[2])])
+    frame = np.zeros((3, 3), dtype=np.float64)
+    frame[0] = surf_params[1]/half[0]
+    frame[1] = surf_params[2]/half[1]
+    frame[2] = np.cross(frame[0], frame[1])
+    low = frame.dot(src_params[0] - surf_params[0])
+    high = low.copy()
+    for vec in src_params[1:3]:
+        axis = aligned_axis(vec, frame)
+        if axis is None:
+            return (None, None)
+        low[axis] -= np.linalg.norm(vec)
+        high[axis] += np.linalg.norm(vec)
+    flat = np.nonzero(high - low == 0.0)[0]
+    # clip the source with the line of sight test of the integrators
+    axis = aligned_axis(surf_params[3], frame)
+    if len(flat) != 1 or axis is None:
+        return (None, None)
+    if frame[axis].dot(surf_params[3]) > 0.0:
+        low[axis] = max(low[axis], 0.0)
+    else:
+        high[axis] = min(high[axis], 0.0)
+    if high[axis] < low[axis] or (high[axis] == low[axis] and axis != flat[0]):
+        return (None, None)
+    if high[axis] == low[axis] and low[axis] == 0.0:
+        return (None, None)
+    size = RECT_GAP_TOL*np.sum(half)
+    if flat[0] == 2:
+        if abs(low[2]) <= size:
+            return (None, None)
+        layout = np.array([half[0], half[1], low[0], high[0], low[1], high[1],
+                           low[2]])
+        return (KERNEL_RECT_PARALLEL, layout)
+    cross = flat[0]
+    common = 1 - cross
+    gap1 = max(abs(low[cross]) - half[cross], 0.0)
+    gap2 = max(low[2], -high[2], 0.0)
+    if np.hypot(gap1, gap2) <= size:
+        return (None, None)
+    layout = np.array([half[cross], half[common], low[cross], low[common],
+                       high[common], low[2], high[2]])
+    return (KERNEL_RECT_PERPENDICULAR, layout)
+
+
+def pair_kernel(surface, source):
+    """Finds the analytic kernel that can integrate a surface source pair
+
+    Parameters
+    ----------
+    surface : libpd.detector.DetectingSurface
+        The detector's detection surface
+    source : libpd.geom_base.Shape
+        The source geometry
+
+    Returns
+    -------
+    kernel : int
+        One of the KERNEL_* constants or None if no kernel applies
+    """
+    surf_params = surface.get_batch_params()[1]
+    if not is_rectangle(surf_params):
+        return None
+    kind, src_params = source.get_batch_params()
+    if kind == gb.KIND_POINT:
+        # points in the plane of the surface are left to the integrators
+        if plane_height(surf_params, src_params[0]) > ORTHO_TOL:
+            return KERNEL_POINT_RECT
+    elif kind == gb.KIND_PARALLELOGRAM and is_rectangle(src_params):
+        return rect_layout(surf_params, src_params)[0]
+    return None
+
+
+def split_analytic(input_list):
+    """Splits the list of surface source pairs into the ones that can be
+    integrated with an analytic kernel and the rest
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+
+    Returns
+    -------
+    analytic_list : list of tuples
+        The entries of input_list that have an analytic kernel
+    numeric_list : list of tuples
+        The entries of input_list that need numerical integration
+    """
+    analytic_list = []
+    numeric_list = []
+    for data in input_list:
+        if pair_kernel(data[1], data[2]) is None:
+            numeric_list.append(data)
+        else:
+            analytic_list.append(data)
+    return (analytic_list, numeric_list)
+
+
+def calc_weights_analytic(input_list, verbose=True):
+    """Calculates the weights of surface source pairs that all have an
+    analytic kernel, pairs with the same kernel are evaluated together
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    verbose : bool
+        If True, print the number of pairs evaluated with each kernel
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry in input_list, in the same order
+    """
+    groups = {}
+    for i, data in enumerate(input_list):
+        groups.setdefault(pair_kernel(data[1], data[2]), []).append(i)
+    weights = np.zeros(len(input_list), dtype=np.float64)
+    for kernel, inds in groups.items():
+        surf_params = np.array([input_list[i][1].get_batch_params()[1]
+                                for i in inds])
+        src_params = np.array([input_list[i][2].get_batch_params()[1]
+                               for i in inds])
+        if kernel == KERNEL_POINT_RECT:
+            weights[inds] = point_rect_weights(surf_params, src_params[:, 0])
+        elif kernel == KERNEL_RECT_PARALLEL:
+            layout = np.array([rect_layout(x, y)[1] for x, y in
+                               zip(surf_params, src_params)])
+            weights[inds] = parallel_rect_weights(layout)
+        elif kernel == KERNEL_RECT_PERPENDICULAR:
+            layout = np.array([rect_layout(x, y)[1] for x, y in
+                               zip(surf_params, src_params)])
+            weights[inds] = perpendicular_rect_weights(layout)
+        else:
+            raise ValueError("Pair without an analytic kernel")
+        if verbose:
+            temp = "Evaluated {0:d} pairs with the {1:s} kernel"
+            print temp.format(len(inds), KERNEL_NAMES[kernel])
+    return [(data[0], weights[i]) for i, data in enumerate(input_list)]
@@ -24,13 +24,21 @@ def initialize_interface():
     lib.makeDetector.argtypes = [ct.POINTER(ct.c_double),
                                  ct.POINTER(ct.c_double),
                                  ct.POINTER(ct.c_double)]
+    lib.freeDetector.argtypes = [ct.c_void_p]
     # set up the calculator building and freeing functions
     lib.makeCalculator.restype = ct.c_void_p
     lib.makeCalculator.argtypes = [ct.c_void_p, ct.c_void_p]
+    lib.makeSharedDetCalculator.restype = ct.c_void_p
+    lib.makeSharedDetCalculator.argtypes = [ct.c_void_p, ct.c_void_p]
     lib.freeCalculator.argtypes = [ct.c_void_p]
     # set up the function that does the calculation of the full integral
     lib.calcIntegral.restype = ct.POINTER(ct.c_double)
     lib.calcIntegral.argtypes = [ct.c_void_p, ct.POINTER(ct.c_double)]
+    # set up the function that calculates a batch of pairs in one call
+    lib.calcIntegralBatch.restype = ct.c_int
+    lib.calcIntegralBatch.argtypes = [ct.c_int, ct.POINTER(ct.c_double),
+                                      ct.c_int, ct.POINTER(ct.c_double),
+                                      ct.POINTER(ct.c_double)]
     # now call the functions that add all the shape creation functions
     initialize_flat_shape_funcs(lib)
     initialize_shell_shape_funcs(lib)
@@ -0,0 +1,507 @@
+"""This file contains the benchmark suite of the weight calculation. The
+microbenchmarks integrate one detecting surface against one instance of every
+source class at several distances with each integrator, the scaling benchmark
+times calculate_weights over a synthetic detector layout for several wall
+divisions and core counts, and the results are kept as JSON together with a
+description of the machine and code they were measured with so runs can be
+compared against each other"""
+
+import os
+import sys
+import time
+import json
+import socket
+import hashlib
+import inspect
+import platform
+import subprocess
+import multiprocessing
+import numpy as np
+import scipy
+import libpd.detector as dt
+import libpd.geom_base as gb
+import libpd.flat_sources as fs
+import libpd.shell_sources as ss
+import libpd.low_dim_sources as lds
+import libpd.source_construction as sc
+import libpd.backend_interface as bi
+import libpd.cubature as cub
+import libpd.monte_carlo as mc
+import libpd.quasi_monte_carlo as qmc
+import libpd.weight_calc as wc
+
+# the modules whose Shape classes the microbenchmarks must cover
+SHAPE_MODULES = [fs, ss, lds]
+# the distances (in cm) of the microbenchmark sources from the detecting
+# surface, along its normal
+MICRO_DISTANCES = [("near", 50.0), ("mid", 200.0), ("far", 1000.0)]
+# the half size (in cm) of the microbenchmark sources
+MICRO_HALF_SIZE = 20.0
+# the radius (in cm) of the microbenchmark cylinders
+MICRO_CYL_RADIUS = 10.0
+# the angle (in degrees) of the microbenchmark's rotated cylinder, the backend
+# only places rotated cylinders correctly when the angle is zero (it takes the
+# angle as radians and also rotates the center), at other angles it integrates
+# a different cylinder, sometimes for several minutes
+MICRO_CYL_ANGLE = 0.0
+# a microbenchmark is repeated until it has run for this many seconds or
+# MICRO_MAX_REPEATS times, the first run always counts
+MICRO_MIN_SECONDS = 0.5
+MICRO_MAX_REPEATS = 5
+# the wall divisions and number of runs of the scaling benchmark
+SCALING_WALL_DIVS = [4, 8, 16, 32]
+SCALING_RUNS = 1
+# the detector numbers of the synthetic layout and the position (in inches)
+# of each relative to the corner of the detector rack, modeled on the rack of
+# the Rx position scans
+SYNTH_DET_NUMS = [8, 9, 11, 12, 13, 14, 15]
+SYNTH_RACK = [(0.0, 57.0, 70.0), (0.0, 0.0, 70.0), (0.0, 0.0, 44.0),
+              (0.0, 57.0, 22.0), (0.0, 0.0, 22.0), (0.0, 57.0, 0.0),
+              (0.0, 0.0, 0.0)]
+# the corner of the rack (in inches) in the first run, the rack moves by
+# SYNTH_STEP[1] between the runs of a row and SYNTH_STEP[0] between rows of
+# SYNTH_ROW_LENGTH runs
+SYNTH_ORIGIN = (106.0, 11.0, 11.0)
+SYNTH_STEP = (18.0, 59.0)
+SYNTH_ROW_LENGTH = 2
+# a benchmark that takes this many times as long as in the baseline, or a
+# weight that differs from the baseline by more than this relative amount, is
+# reported as a regression
+REGRESSION_RATIO = 1.2
+REGRESSION_RTOL = 1.0e-9
+
+
+def make_synthetic_positions(num_runs):
+    """Makes detector positions like those of a position file (see
+    libpd.detector.read_positions) without needing one, the detector rack
+    steps across the room from run to run
+
+    Parameters
+    ----------
+    num_runs : int
+        The number of scan runs
+
+    Returns
+    -------
+    pos_list : list of tuples
+        Each tuple in the list contains the detector number, scan run number,
+        and x,y,z center position of the relevant NaI detector
+    """
+    pos_list = []
+    for run in range(num_runs):
+        corner = np.array([SYNTH_ORIGIN[0] + SYNTH_STEP[0]*(run //
+                                                           SYNTH_ROW_LENGTH),
+                           SYNTH_ORIGIN[1] + SYNTH_STEP[1]*(run %
+                                                           SYNTH_ROW_LENGTH),
+                           SYNTH_ORIGIN[2]], dtype=np.float64)
+        for detn, offset in zip(SYNTH_DET_NUMS, SYNTH_RACK):
+            pos_list.append((detn, run,
+                             2.54*(corner + np.array(offset,
+                                                     dtype=np.float64))))
+    return pos_list
+
+
+def make_micro_sources(center):
+    """Makes one source of every class, each centered on center
+
+    Parameters
+    ----------
+    center : numpy array
+        The center of the sources
+
+    Returns
+    -------
+    src_list : list of libpd.geom_base.Shape
+        The sources, each named after its class
+    """
+    half = MICRO_HALF_SIZE
+    yvec = np.array([0.0, half, 0.0], dtype=np.float64)
+    zvec = np.array([0.0, 0.0, half], dtype=np.float64)
+    rotation = gb.Rotation()
+    rotation.add_y_rot(90.0)
+    return [fs.Square("Square", center, (yvec, zvec), gb.Rotation()),
+            fs.Circle("Circle", center, half, rotation),
+            fs.CircleXY("CircleXY", center, half),
+            fs.CircleXZ("CircleXZ", center, half),
+            fs.CircleYZ("CircleYZ", center, half),
+            ss.VertCylinder("VertCylinder", center,
+                            (MICRO_CYL_RADIUS, 2.0*half)),
+            ss.RotXaxisCylinder("RotXaxisCylinder", center,
+                                (MICRO_CYL_RADIUS, 2.0*half),
+                                MICRO_CYL_ANGLE),
+            lds.PointSource("PointSource", center),
+            lds.LineSource("LineSource", center - yvec, center + yvec)]
+
+
+def missing_shape_classes(sources):
+    """Returns the Shape classes of SHAPE_MODULES that none of the sources
+    are instances of
+
+    Parameters
+    ----------
+    sources : list of libpd.geom_base.Shape
+        The sources
+
+    Returns
+    -------
+    missing : list of str
+        The names of the classes without a source
+    """
+    covered = set([type(x) for x in sources])
+    missing = []
+    for module in SHAPE_MODULES:
+        for name, obj in inspect.getmembers(module, inspect.isclass):
+            if (issubclass(obj, gb.Shape) and obj is not gb.Shape and
+                    obj.__module__ == module.__name__ and
+                    obj not in covered):
+                missing.append(name)
+    return missing
+
+
+def integrate_pairs(input_list, integrator, mc_rtol=mc.DEFAULT_RTOL):
+    """Integrates surface source pairs with one integrator in this process,
+    without the culling, caching and scheduling of calculate_weights
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The detecting surface source pairs and their associated data
+    integrator : str
+        One of weight_calc.INTEGRATORS
+    mc_rtol : float
+        The relative standard error the sampling integrators stop at
+
+    Returns
+    -------
+    weights : numpy array
+        The weight of every pair
+    errors : numpy array
+        The standard error of every weight, NaN if the integrator does not
+        estimate it
+    evals : numpy array
+        The number of integrand evaluations (or sample points) of every pair,
+        NaN if the integrator does not count them
+    """
+    nan_list = np.full(len(input_list), np.nan)
+    if integrator == "backend":
+        results = wc.calc_chunk_counted(input_list)
+        return (np.array([x[1] for x in results]), nan_list,
+                np.array([x[2][wc.EVALS_STAT] for x in results]))
+    if integrator == "cubature":
+        return (np.array([x[1] for x in
+                          cub.calc_weights_batched(input_list)]),
+                nan_list, nan_list)
+    sequence = wc.SAMPLING_INTEGRATORS[integrator]
+    if sequence is None:
+        weights, errors, counts = mc.calc_weights_mc(input_list, mc_rtol)
+    else:
+        weights, errors, counts = qmc.calc_weights_qmc(input_list, sequence,
+                                                       mc_rtol)
+    return (np.array([x[1] for x in weights]),
+            np.array([x[1] for x in errors]),
+            np.array([x[1] for x in counts], dtype=np.float64))
+
+
+def time_call(func, *args):
+    """Times repeated calls of a function, see MICRO_MIN_SECONDS
+
+    Parameters
+    ----------
+    func : function
+        The function to time
+    args : tuple
+        The arguments to call it with
+
+    Returns
+    -------
+    result : object
+        What the first call returned
+    times : list of floats
+        The wall time of every call
+    """
+    times = []
+    result = None
+    while (len(times) < MICRO_MAX_REPEATS and
+           (len(times) == 0 or sum(times) < MICRO_MIN_SECONDS)):
+        start = time.time()
+        out = func(*args)
+        times.append(time.time() - start)
+        if result is None:
+            result = out
+    return result, times
+
+
+def run_micro(integrators, mc_rtol=mc.DEFAULT_RTOL):
+    """Runs the microbenchmarks, every source class at every distance of
+    MICRO_DISTANCES in front of the front surface of a detector, with every
+    integrator
+
+    Parameters
+    ----------
+    integrators : list of str
+        The integrators, from weight_calc.INTEGRATORS
+    mc_rtol : float
+        The relative standard error the sampling integrators stop at
+
+    Returns
+    -------
+    records : list of dicts
+        One record per source class, distance, and integrator
+    """
+    det = dt.Detector(SYNTH_DET_NUMS[0], 0, np.zeros(3, dtype=np.float64))
+    surface = det.get_detecting_surfaces()[0]
+    normal = dt.SURF_NORMALS[0]
+    face = surface.get_batch_params()[1][0]
+    records = []
+    for label, dist in MICRO_DISTANCES:
+        sources = make_micro_sources(face + dist*normal)
+        missing = missing_shape_classes(sources)
+        if missing:
+            raise ValueError("No microbenchmark for: " + ", ".join(missing))
+        for source in sources:
+            kind, params = source.get_batch_params()
+            vis = wc.plane_visibility(
+                surface, gb.batch_bounding_boxes(kind,
+                                                 params[np.newaxis]))[0]
+            input_list = [((det.dnum, det.rnum, 0, source.name), surface,
+                           source, vis)]
+            for integrator in integrators:
+                wc.init_backend_session()
+                try:
+                    out, times = time_call(integrate_pairs, input_list,
+                                           integrator, mc_rtol)
+                finally:
+                    wc.close_backend_session()
+                record = {"shape": source.get_class_name(),
+                          "distance": label, "distance_cm": dist,
+                          "integrator": integrator,
+                          "visibility": int(vis),
+                          "weight": float(out[0][0]),
+                          "error": json_float(out[1][0]),
+                          "evals": json_float(out[2][0]),
+                          "repeats": len(times),
+                          "best_seconds": min(times),
+                          "median_seconds": float(np.median(times))}
+                print "{0:>16s} {1:>5s} {2:>10s}: {3:.6e} in {4:.4f} s".format(
+                    record["shape"], label, integrator, record["weight"],
+                    record["best_seconds"])
+                records.append(record)
+    return records
+
+
+def run_scaling(integrators, max_cores, wall_divs=SCALING_WALL_DIVS,
+                num_runs=SCALING_RUNS, execution="process",
+                mc_rtol=mc.DEFAULT_RTOL):
+    """Runs the scaling benchmark, calculate_weights over the synthetic
+    layout for every number of wall divisions and from one to max_cores
+    cores, without a cache or cost model so every run does all the work
+
+    Parameters
+    ----------
+    integrators : list of str
+        The integrators, from weight_calc.INTEGRATORS
+    max_cores : int
+        The largest number of cores to run on
+    wall_divs : list of ints
+        The numbers of wall divisions (see source_construction.WALL_DIVS)
+    num_runs : int
+        The number of scan runs of the synthetic layout
+    execution : str
+        One of weight_calc.EXECUTION_MODES
+    mc_rtol : float
+        The relative standard error the sampling integrators stop at
+
+    Returns
+    -------
+    records : list of dicts
+        One record per integrator, number of wall divisions, and core count
+    """
+    detectors = dt.make_nai_list(make_synthetic_positions(num_runs))
+    old_divs = sc.WALL_DIVS
+    records = []
+    try:
+        for divs in wall_divs:
+            sc.WALL_DIVS = divs
+            sources = sc.set_up_source_tables()
+            num_sources = sum([len(x) for x in sources])
+            for integrator in integrators:
+                for cores in range(1, max_cores + 1):
+                    start = time.time()
+                    tensor = wc.calculate_weights(
+                        detectors, sources, cores, integrator=integrator,
+                        as_tensor=True, execution=execution,
+                        mc_rtol=mc_rtol)[0]
+                    elapsed = time.time() - start
+                    records.append({"wall_divs": divs, "cores": cores,
+                                    "integrator": integrator,
+                                    "execution": execution,
+                                    "num_detectors": len(detectors),
+                                    "num_sources": num_sources,
+                                    "seconds": elapsed,
+                                    "weight_sum": float(np.nansum(tensor))})
+    finally:
+        sc.WALL_DIVS = old_divs
+    return records
+
+
+def json_float(value):
+    """Returns a value as a float that JSON can hold, None for NaN
+
+    Parameters
+    ----------
+    value : float
+        The value
+
+    Returns
+    -------
+    value : float
+        The value, or None if it was NaN
+    """
+    if np.isnan(value):
+        return None
+    return float(value)
+
+
+def file_digest(path):
+    """Returns the SHA-1 digest of a file, or None if it does not exist
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    digest : str
+        The hex digest
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as in_file:
+        return hashlib.sha1(in_file.read()).hexdigest()
+
+
+def git_commit():
+    """Returns the commit the library is checked out at, or None if it is not
+    in a git repository
+
+    Returns
+    -------
+    commit : str
+        The commit hash, with "+dirty" appended if there are local changes
+    """
+    mod_dir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"],
+                                         cwd=mod_dir,
+                                         stderr=subprocess.STDOUT).strip()
+        status = subprocess.check_output(["git", "status", "--porcelain",
+                                          "--untracked-files=no"],
+                                         cwd=mod_dir,
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ("+dirty" if status.strip() else "")
+
+
+def environment_metadata(integrators, mc_rtol=mc.DEFAULT_RTOL):
+    """Describes the machine and code the benchmarks are run with
+
+    Parameters
+    ----------
+    integrators : list of str
+        The integrators the benchmarks are run with
+    mc_rtol : float
+        The relative standard error the sampling integrators stop at
+
+    Returns
+    -------
+    metadata : dict
+        The description
+    """
+    return {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "hostname": socket.gethostname(),
+            "platform": platform.platform(),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "cpu_count": multiprocessing.cpu_count(),
+            "git_commit": git_commit(),
+            "backend_library": file_digest(bi.LIB_LOCATION),
+            "integrator_settings": dict([(x, wc.integrator_settings(x,
+                                                                    mc_rtol))
+                                         for x in integrators])}
+
+
+def write_results(path, results):
+    """Writes benchmark results to a JSON file
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+    results : dict
+        The "environment", "micro", and "scaling" results
+    """
+    with open(path, "w") as out_file:
+        json.dump(results, out_file, indent=1, sort_keys=True)
+
+
+def read_results(path):
+    """Reads benchmark results written by write_results
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    results : dict
+        The "environment", "micro", and "scaling" results
+    """
+    with open(path) as in_file:
+        return json.load(in_file)
+
+
+def compare_results(results, baseline):
+    """Compares the benchmarks of two sets of results that were run in both
+
+    Parameters
+    ----------
+    results : dict
+        The new results
+    baseline : dict
+        The results to compare against
+
+    Returns
+    -------
+    lines : list of str
+        The comparison of every benchmark, with the regressions (see
+        REGRESSION_RATIO and REGRESSION_RTOL) marked
+    """
+    lines = []
+    for part, fields, time_field, value_field in [
+            ("micro", ("shape", "distance", "integrator"), "best_seconds",
+             "weight"),
+            ("scaling", ("wall_divs", "cores", "integrator", "execution"),
+             "seconds", "weight_sum")]:
+        old = dict([(tuple(x[y] for y in fields), x)
+                    for x in baseline.get(part, [])])
+        for record in results.get(part, []):
+            key = tuple(record[x] for x in fields)
+            if key not in old:
+                continue
+            ratio = record[time_field]/max(old[key][time_field], 1.0e-9)
+            diff = (abs(record[value_field] - old[key][value_field]) /
+                    max(abs(old[key][value_field]), 1.0e-300))
+            flags = []
+            if ratio > REGRESSION_RATIO:
+                flags.append("SLOWER")
+            if diff > REGRESSION_RTOL:
+                flags.append("CHANGED")
+            lines.append("{0:s} {1:s}: {2:.2f}x time, relative difference "
+                         "{3:.2e} {4:s}".format(
+                             part, "|".join([str(x) for x in key]), ratio,
+                             diff, " ".join(flags)).rstrip())
+    return lines
@@ -0,0 +1,140 @@
+"""This file contains the checkpoint file of a weight calculation. Weights are
+appended to it as soon as they are calculated so an interrupted run can be
+resumed, and the final output is assembled from it. The first line of the
+file is a header describing the job that wrote it, so a run is not resumed
+from the checkpoint of a different job"""
+
+import os
+import json
+
+# the format of a line of the checkpoint, the source name comes last so it
+# can contain any character but a newline
+LINE_FMT = "{0:d}, {1:d}, {2:d}, {3:.17e}, {4:s}\n"
+# the number of lines written between forcing the file to disk
+SYNC_LINES = 1000
+# the start of the header line, which holds a JSON description of the job
+HEADER_PREFIX = "# "
+
+
+def read_header(path):
+    """Reads the header of a checkpoint file
+
+    Parameters
+    ----------
+    path : str
+        The path to the checkpoint file
+
+    Returns
+    -------
+    header : dict
+        The description of the job that wrote the file, None if the file
+        does not exist or has no header
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as in_file:
+        line = in_file.readline()
+    if not line.startswith(HEADER_PREFIX) or not line.endswith("\n"):
+        return None
+    return json.loads(line[len(HEADER_PREFIX):])
+
+
+def read_checkpoint(path):
+    """Reads the complete lines of a checkpoint file
+
+    Parameters
+    ----------
+    path : str
+        The path to the checkpoint file
+
+    Returns
+    -------
+    weights : dict
+        Maps the pos_info (det, run, side, source name) of every pair in the
+        file to its weight
+    """
+    weights = {}
+    if not os.path.exists(path):
+        return weights
+    with open(path) as in_file:
+        for line in in_file:
+            # a line without a newline was cut off when the run was killed
+            if not line.endswith("\n"):
+                break
+            if line.startswith(HEADER_PREFIX):
+                continue
+            vals = line[:-1].split(", ", 4)
+            pos_info = (int(vals[0]), int(vals[1]), int(vals[2]), vals[4])
+            weights[pos_info] = float(vals[3])
+    return weights
+
+
+class Checkpoint(object):
+    """This class appends the weights of a calculation to the checkpoint file
+    as they are finished"""
+    def __init__(self, path, resume=False, header=None):
+        """Opens the checkpoint file
+
+        Parameters
+        ----------
+        path : str
+            The path to the checkpoint file
+        resume : bool
+            If True the weights already in the file are kept (see done),
+            otherwise the file is started over
+        header : dict
+            If not None, the description of the job, written as the first
+            line of a new file, a file being resumed must have the same
+            "digest"
+        """
+        self.path = path
+        self.done = {}
+        self.unsynced = 0
+        if resume and os.path.exists(path):
+            old = read_header(path)
+            if header is not None and (old is None or
+                                       old.get("digest") !=
+                                       header["digest"]):
+                temp = "The checkpoint {0:s} was written by a different job "\
+                    "({1:s}) than this one ({2:s}), remove it or run "\
+                    "without resuming"
+                raise ValueError(temp.format(
+                    path, json.dumps(old, sort_keys=True),
+                    json.dumps(header, sort_keys=True)))
+            self.done = read_checkpoint(path)
+            # drop any partially written last line before appending
+            with open(path, "rb") as in_file:
+                data = in_file.read()
+            with open(path, "r+b") as out_file:
+                out_file.truncate(data.rfind("\n") + 1)
+            self.out_file = open(path, "a")
+        else:
+            self.out_file = open(path, "w")
+            if header is not None:
+                self.out_file.write(HEADER_PREFIX +
+                                    json.dumps(header, sort_keys=True) + "\n")
+                self.out_file.flush()
+
+    def write(self, weight_list):
+        """Appends weights to the checkpoint file
+
+        Parameters
+        ----------
+        weight_list : list of tuples
+            (pos_info, weight) for the finished pairs
+        """
+        for pos_info, weight in weight_list:
+            self.out_file.write(LINE_FMT.format(pos_info[0], pos_info[1],
+                                                pos_info[2], weight,
+                                                pos_info[3]))
+        self.out_file.flush()
+        self.unsynced += len(weight_list)
+        if self.unsynced >= SYNC_LINES:
+            os.fsync(self.out_file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        """Forces the remaining weights to disk and closes the file"""
+        self.out_file.flush()
+        os.fsync(self.out_file.fileno())
+        self.out_file.close()
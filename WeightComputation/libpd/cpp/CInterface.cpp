@@ -4,6 +4,17 @@
 #include"Geometry/FlatShapes.h"
 #include"Geometry/ShellShapes.h"
 #include"Calculation/Calculator.h"
+#include<cmath>
+#include<cstring>
+#include<limits>
+
+// the kinds of source parameterization, these must match the KIND_* constants
+// in libpd/geom_base.py
+enum BatchKind {KindPoint=0, KindLine=1, KindParallelogram=2, KindDisk=3,
+                KindCylinder=4};
+static const int NumBatchDetParams = 9;
+static const int NumBatchSrcParams = 12;
+static const int NumOutParams = 5;
 
 void* makeDetector(double* vec1, double* vec2, double* norm)
 {
@@ -11,6 +22,12 @@ void* makeDetector(double* vec1, double* vec2, double* norm)
     return (void*)temp;
 }
 
+void freeDetector(void* detector)
+{
+    Detector* temp = (Detector*)detector;
+    delete temp;
+}
+
 //Make Point source
 void* makePoint(double* cent)
 {
@@ -76,6 +93,12 @@ void* makeCalculator(void* detector, void* source)
     return (void*)temp;
 }
 
+void* makeSharedDetCalculator(void* detector, void* source)
+{
+    Calculator* temp = new Calculator((Detector*)detector, (Shape*)source, false);
+    return (void*)temp;
+}
+
 void freeCalculator(void* calcObject)
 {
     Calculator* temp = (Calculator*)calcObject;
@@ -92,3 +115,98 @@ void calcIntegral(void* calcObject, double* outParams)
         outParams[i] = temp[i];
     }
 }
+
+
+// Builds the source shape for one set of batch parameters (center, vec1,
+// vec2, vec3), returns nullptr if there is no shape for them
+static Shape* makeBatchShape(int kind, double* params)
+{
+    double* cent = params;
+    double* vec1 = params+3;
+    double* vec2 = params+6;
+    double* vec3 = params+9;
+    double mag1 = std::sqrt(vec1[0]*vec1[0] + vec1[1]*vec1[1] + vec1[2]*vec1[2]);
+    switch(kind)
+    {
+    case KindPoint:
+        return new PointSource(cent);
+    case KindLine:
+    {
+        //the batch parameters are the midpoint and half the line vector
+        double start[3];
+        double full[3];
+        for(int i=0; i<3; ++i)
+        {
+            start[i] = cent[i] - vec1[i];
+            full[i] = 2.0*vec1[i];
+        }
+        return new LineSource(start, full);
+    }
+    case KindParallelogram:
+        return new Square(cent, vec1, vec2);
+    case KindDisk:
+    {
+        //the columns of the rotation are the unit radius vectors and the normal
+        double rot[9];
+        for(int i=0; i<3; ++i)
+        {
+            rot[3*i] = vec1[i]/mag1;
+            rot[3*i+1] = vec2[i]/mag1;
+        }
+        rot[2] = (vec1[1]*vec2[2] - vec1[2]*vec2[1])/(mag1*mag1);
+        rot[5] = (vec1[2]*vec2[0] - vec1[0]*vec2[2])/(mag1*mag1);
+        rot[8] = (vec1[0]*vec2[1] - vec1[1]*vec2[0])/(mag1*mag1);
+        return new Circle(cent, mag1, rot);
+    }
+    case KindCylinder:
+        //only cylinders along the z axis have a backend shape
+        if(vec3[0] == 0.0 && vec3[1] == 0.0)
+        {
+            return new CylinderZaxis(cent, mag1, std::abs(vec3[2]));
+        }
+        return nullptr;
+    default:
+        return nullptr;
+    }
+}
+
+// Function to perform the calculations of a batch of pairs
+int calcIntegralBatch(int numPairs, double* detParams, int srcKind,
+                      double* srcParams, double* outParams)
+{
+    int numCalculated = 0;
+    Detector* det = nullptr;
+    double* lastDet = nullptr;
+    for(int i=0; i<numPairs; ++i)
+    {
+        double* pairDet = detParams + NumBatchDetParams*i;
+        double* pairOut = outParams + NumOutParams*i;
+        Shape* src = makeBatchShape(srcKind, srcParams + NumBatchSrcParams*i);
+        if(src == nullptr)
+        {
+            for(int j=0; j<NumOutParams; ++j)
+            {
+                pairOut[j] = std::numeric_limits<double>::quiet_NaN();
+            }
+            continue;
+        }
+        //consecutive pairs on the same detector share the detector object
+        if(lastDet == nullptr ||
+           std::memcmp(lastDet, pairDet, NumBatchDetParams*sizeof(double)) != 0)
+        {
+            delete det;
+            det = new Detector(pairDet, pairDet+3, pairDet+6);
+            lastDet = pairDet;
+        }
+        //the calculator takes ownership of the source but not the detector
+        Calculator calc(det, src, false);
+        double* temp = calc.calcIntegral();
+        for(int j=0; j<NumOutParams; ++j)
+        {
+            pairOut[j] = temp[j];
+        }
+        ++numCalculated;
+    }
+    delete det;
+    return numCalculated;
+}
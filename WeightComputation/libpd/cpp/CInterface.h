@@ -1,8 +1,9 @@
 #ifndef POSITION_DECOMP_LIBPD_CPP_CINTERFACE_H
 #define POSITION_DECOMP_LIBPD_CPP_CINTERFACE_H
 
-// Make detector shape
+// Make and free detector shape
 extern "C" void* makeDetector(double* vec1, double* vec2, double* norm);
+extern "C" void freeDetector(void* detector);
 
 //Make Low Dimensional source shapes
 extern "C" void* makePoint(double* cent);
@@ -22,9 +23,24 @@ extern "C" void* makeRotXaxisCylinder(double* cent, double radius, double len, d
 // Function to create and destroy the calculator object
 // the calculator object destroys the source and detector objects that it owns
 extern "C" void* makeCalculator(void* detector, void* source);
+// Function to create a calculator object that only owns the source, the
+// detector object can be shared between calculators and must be freed with
+// freeDetector after the last of them is freed
+extern "C" void* makeSharedDetCalculator(void* detector, void* source);
 extern "C" void freeCalculator(void* calcObject);
 
 // Function to perform the integral calculation
 extern "C" void calcIntegral(void* calcObject, double* outParams);
 
+// Function to perform the integral calculations of a batch of detector source
+// pairs whose sources share a kind of parameterization (the KIND_* constants
+// of libpd/geom_base.py), detParams holds 9 doubles per pair (vec1, vec2, and
+// norm of the detector), srcParams holds 12 doubles per pair (the source
+// center relative to the detector center and the three parameterization
+// vectors) and outParams receives the 5 outputs of calcIntegral per pair.
+// Pairs whose source cannot be built get NaN outputs, the number of pairs
+// that were calculated is returned
+extern "C" int calcIntegralBatch(int numPairs, double* detParams, int srcKind,
+                                 double* srcParams, double* outParams);
+
 #endif //POSITION_DECOMP_LIBPD_CPP_CINTERFACE_H
@@ -4,8 +4,8 @@
 
 inline double calculateDiff(const double& guess, const double& val) {return std::abs(1.0-(val/guess));}
 
-Calculator::Calculator(Detector* d, Shape* s) :
-    src(s), det(d), detParams(0), numParams(0), numSegs(0),
+Calculator::Calculator(Detector* d, Shape* s, bool ownDet) :
+    src(s), det(d), ownsDet(ownDet), detParams(0), numParams(0), numSegs(0),
     singleAxisRecurCount(0), fullRecurCount(0), calls(0),
     outVec{0.0, 0.0, 0.0, 0.0}, valCache(), bounds()
 {}
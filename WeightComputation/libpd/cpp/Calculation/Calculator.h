@@ -8,8 +8,8 @@
 class Calculator
 {
 public:
-    Calculator(Detector* d, Shape* s);
-    ~Calculator(){delete src; delete det;}
+    Calculator(Detector* d, Shape* s, bool ownDet=true);
+    ~Calculator(){delete src; if(ownsDet) delete det;}
 
     //returns a pointer to outVec the elements of the vector are as follows:
     //First: The calculation result
@@ -26,7 +26,8 @@ private:
     void obtainBounds();
     
     Shape* src;       ///< Owned pointer of the source object
-    Detector* det;    ///< Owned pointer of the detector object
+    Detector* det;    ///< Pointer of the detector object, owned if ownsDet is true
+    bool ownsDet;     ///< If false the detector is shared and freed by the caller
     int detParams;    ///< The number of parameters to integrate across for the detector object
     int numParams;    ///< The total number of parameters to integrate across for both objections
     int numSegs;      ///< The number of 1/2 subdivisions across all possible axes
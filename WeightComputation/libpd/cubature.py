@@ -0,0 +1,348 @@
+"""This file contains the batched, vectorized, integration engine. Instead of
+integrating a single detecting surface and source pair per call it takes the
+stacked parameters (see Shape.get_batch_params) of many pairs whose sources
+share a kind of parameterization and evaluates tensor product Gauss-Legendre
+rules for all of them at once with numpy broadcasting. It does not need the
+compiled backend"""
+
+import numpy as np
+import libpd.geom_base as gb
+
+INV_FOUR_PI = (1.0/(4.0*np.pi))
+# the number of Gauss-Legendre nodes per axis per panel
+DEFAULT_ORDER = 4
+# the relative difference between successive refinements for convergence
+# (the same as the backend's convergence limit)
+DEFAULT_RTOL = 1.0e-4
+# the absolute value below which an integral is not refined further (the same
+# as the backend's value limit)
+DEFAULT_ATOL = 1.0e-14
+# the maximum number of panel doublings per axis in the adaptive rule
+DEFAULT_MAX_LEVEL = 3
+# the maximum number of (pair, detector point, source point) triplets that
+# are evaluated in one numpy operation, this bounds the memory use
+MAX_BLOCK_POINTS = 2**22
+
+
+def gauss_legendre_rule(bounds, order, panels):
+    """Builds a tensor product composite Gauss-Legendre rule over the given
+    bounds
+
+    Parameters
+    ----------
+    bounds : list of tuples
+        The lower and upper bound of each parameter
+    order : int
+        The number of nodes per panel per axis
+    panels : int
+        The number of equal width panels each axis is split into
+
+    Returns
+    -------
+    args : list of numpy arrays
+        One flattened array of node values per parameter
+    weights : numpy array
+        The flattened array of the products of the node weights
+    """
+    if len(bounds) == 0:
+        return ([], np.ones(1, dtype=np.float64))
+    nodes, wts = np.polynomial.legendre.leggauss(order)
+    axis_nodes = []
+    axis_wts = []
+    for low, high in bounds:
+        width = (high - low)/float(panels)
+        starts = low + width*np.arange(panels, dtype=np.float64)
+        mids = starts + width/2.0
+        axis_nodes.append((mids[:, np.newaxis] +
+                           (width/2.0)*nodes[np.newaxis, :]).ravel())
+        axis_wts.append(np.tile((width/2.0)*wts, panels))
+    grids = np.meshgrid(*axis_nodes, indexing="ij")
+    wgrids = np.meshgrid(*axis_wts, indexing="ij")
+    weights = np.ones(grids[0].size, dtype=np.float64)
+    for wgrid in wgrids:
+        weights *= wgrid.ravel()
+    return ([grid.ravel() for grid in grids], weights)
+
+
+def stack_pairs(pairs):
+    """Stacks the batch parameters of a list of detecting surface and source
+    pairs whose sources share a kind of parameterization
+
+    Parameters
+    ----------
+    pairs : list of tuples
+        Each tuple holds a DetectingSurface and a source
+
+    Returns
+    -------
+    surf_params : numpy array
+        (N, 4, 3) array of surface center, vec1, vec2, and normal
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+    """
+    surf_params = np.array([surf.get_batch_params()[1] for surf, _ in pairs],
+                           dtype=np.float64)
+    src_params = np.array([src.get_batch_params()[1] for _, src in pairs],
+                          dtype=np.float64)
+    return (surf_params, src_params)
+
+
+def make_relative(surf_params, src_params):
+    """Moves the origin of every pair to the center of its detecting surface,
+    the same thing that make_backend_object does for the backend
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+
+    Returns
+    -------
+    rel_surf : numpy array
+        copy of surf_params with the centers set to zero
+    rel_src : numpy array
+        copy of src_params with the surface centers subtracted
+    """
+    rel_surf = np.array(surf_params, dtype=np.float64)
+    rel_src = np.array(src_params, dtype=np.float64)
+    rel_src[:, 0, :] -= rel_surf[:, 0, :]
+    rel_surf[:, 0, :] = 0.0
+    return (rel_surf, rel_src)
+
+
+def source_bounds(kind, rel_surf, rel_src):
+    """Builds the integration bounds of every source in a batch, where the
+    line of sight boundary (the plane of the surface) cuts the parameter box
+    of a line or parallelogram along one of its axes the bounds are clipped to
+    the visible part so the rule never straddles the discontinuity
+
+    Parameters
+    ----------
+    kind : int
+        The kind of parameterization of the sources
+    rel_surf : numpy array
+        (N, 4, 3) array of relative surface batch parameters
+    rel_src : numpy array
+        (N, 4, 3) array of relative source batch parameters
+
+    Returns
+    -------
+    bounds : numpy array
+        (N, D, 2) array of lower and upper bounds of the D source parameters,
+        fully hidden sources have an upper bound equal to the lower bound
+    """
+    num = rel_surf.shape[0]
+    base = np.array(gb.KIND_BOUNDS[kind], dtype=np.float64).reshape(-1, 2)
+    bounds = np.tile(base, (num, 1, 1))
+    if kind not in (gb.KIND_LINE, gb.KIND_PARALLELOGRAM):
+        return bounds
+    norm = rel_surf[:, 3, :]
+    offset = np.sum(norm*rel_src[:, 0, :], axis=1)
+    slopes = np.einsum("nk,nvk->nv", norm, rel_src[:, 1:bounds.shape[1]+1, :])
+    mags = np.sqrt(np.sum(np.square(rel_src[:, 1:bounds.shape[1]+1, :]),
+                          axis=2))
+    flat = np.abs(slopes) <= 1.0e-12*mags
+    for axis in range(bounds.shape[1]):
+        # the visibility only depends on this axis if the others are parallel
+        # to the plane of the surface
+        others = np.ones(num, dtype=bool)
+        for oth in range(bounds.shape[1]):
+            if oth != axis:
+                others &= flat[:, oth]
+        clip = others & np.logical_not(flat[:, axis])
+        cut = np.zeros(num, dtype=np.float64)
+        cut[clip] = -offset[clip]/slopes[clip, axis]
+        upward = clip & (slopes[:, axis] > 0.0)
+        downward = clip & (slopes[:, axis] < 0.0)
+        bounds[upward, axis, 0] = np.maximum(bounds[upward, axis, 0],
+                                             cut[upward])
+        bounds[downward, axis, 1] = np.minimum(bounds[downward, axis, 1],
+                                               cut[downward])
+    # sources entirely in the plane of the surface or behind it
+    hidden = np.all(flat, axis=1) & (offset <= 0.0)
+    bounds[hidden, :, 1] = bounds[hidden, :, 0]
+    bounds[:, :, 1] = np.maximum(bounds[:, :, 0], bounds[:, :, 1])
+    return bounds
+
+
+def evaluate_rule(rel_surf, kind, rel_src, src_bnds, det_rule, src_rule):
+    """Applies a detector and a source quadrature rule to a batch of pairs
+    that have already been made relative to their surface centers
+
+    Parameters
+    ----------
+    rel_surf : numpy array
+        (N, 4, 3) array of relative surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    rel_src : numpy array
+        (N, 4, 3) array of relative source batch parameters
+    src_bnds : numpy array
+        (N, D, 2) array of the source bounds from source_bounds
+    det_rule : tuple
+        The (args, weights) rule for the detecting surfaces
+    src_rule : tuple
+        The (args, weights) rule for the sources on the reference box
+        [-1, 1]^D
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the integrals
+    """
+    det_pos = gb.batch_positions(gb.KIND_PARALLELOGRAM, rel_surf, det_rule[0])
+    det_wts = (gb.batch_area_elements(gb.KIND_PARALLELOGRAM, rel_surf,
+                                      det_rule[0]) * det_rule[1])
+    # map the reference rule onto the bounds of each source
+    half = (src_bnds[:, :, 1] - src_bnds[:, :, 0])/2.0
+    src_args = [src_bnds[:, i, 0, np.newaxis] +
+                half[:, i, np.newaxis]*(arg[np.newaxis, :] + 1.0)
+                for i, arg in enumerate(src_rule[0])]
+    src_pos = gb.batch_positions(kind, rel_src, src_args)
+    src_wts = (gb.batch_area_elements(kind, rel_src, src_args) * src_rule[1] *
+               np.prod(half, axis=1)[:, np.newaxis])
+    # line of sight test, the source point must be in front of the surface
+    visible = np.einsum("nmk,nk->nm", src_pos, rel_surf[:, 3, :]) > 0.0
+    src_wts = src_wts * visible
+    dist_sq = (np.sum(np.square(det_pos), axis=2)[:, :, np.newaxis] +
+               np.sum(np.square(src_pos), axis=2)[:, np.newaxis, :] -
+               2.0*np.matmul(det_pos, np.swapaxes(src_pos, 1, 2)))
+    inner = np.matmul(1.0/dist_sq, src_wts[:, :, np.newaxis])[:, :, 0]
+    return INV_FOUR_PI*np.sum(det_wts*inner, axis=1)
+
+
+def integrate_fixed(surf_params, kind, src_params, order=DEFAULT_ORDER,
+                    panels=1):
+    """Integrates a batch of pairs with a fixed tensor product rule
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+    order : int
+        The number of Gauss-Legendre nodes per panel per axis
+    panels : int
+        The number of panels per axis
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the integrals
+    """
+    rel_surf, rel_src = make_relative(surf_params, src_params)
+    src_bnds = source_bounds(kind, rel_surf, rel_src)
+    det_rule = gauss_legendre_rule(gb.KIND_BOUNDS[gb.KIND_PARALLELOGRAM],
+                                   order, panels)
+    src_rule = gauss_legendre_rule([(-1.0, 1.0)]*src_bnds.shape[1], order,
+                                   panels)
+    # split the batch (and if needed the detector points) so the distance
+    # matrices stay a reasonable size
+    num_det = det_rule[1].size
+    det_step = max(1, min(num_det, MAX_BLOCK_POINTS // src_rule[1].size))
+    chunk = max(1, MAX_BLOCK_POINTS // (det_step*src_rule[1].size))
+    out = np.zeros(rel_surf.shape[0], dtype=np.float64)
+    for start in range(0, rel_surf.shape[0], chunk):
+        stop = start + chunk
+        for dstart in range(0, num_det, det_step):
+            dstop = dstart + det_step
+            det_part = ([arg[dstart:dstop] for arg in det_rule[0]],
+                        det_rule[1][dstart:dstop])
+            out[start:stop] += evaluate_rule(rel_surf[start:stop], kind,
+                                             rel_src[start:stop],
+                                             src_bnds[start:stop], det_part,
+                                             src_rule)
+    return out
+
+
+def integrate_adaptive(surf_params, kind, src_params, order=DEFAULT_ORDER,
+                       rtol=DEFAULT_RTOL, max_level=DEFAULT_MAX_LEVEL):
+    """Integrates a batch of pairs, doubling the number of panels per axis for
+    the pairs that have not yet converged
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+    order : int
+        The number of Gauss-Legendre nodes per panel per axis
+    rtol : float
+        The relative difference between successive levels for convergence
+    max_level : int
+        The maximum number of panel doublings
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the integrals
+    levels : numpy array
+        (N,) array of the refinement level each pair stopped at
+    """
+    weights = integrate_fixed(surf_params, kind, src_params, order, 1)
+    levels = np.zeros(weights.size, dtype=np.int32)
+    active = np.arange(weights.size)
+    for level in range(1, max_level+1):
+        if active.size == 0:
+            break
+        refined = integrate_fixed(surf_params[active], kind,
+                                  src_params[active], order, 2**level)
+        diff = np.abs(refined - weights[active])
+        done = diff <= (rtol*np.abs(refined) + DEFAULT_ATOL)
+        weights[active] = refined
+        levels[active] = level
+        active = active[np.logical_not(done)]
+    if active.size != 0:
+        print "{0:d} pairs reached the maximum refinement level".format(
+            active.size)
+    return (weights, levels)
+
+
+def calc_weights_batched(input_list, order=DEFAULT_ORDER, rtol=DEFAULT_RTOL,
+                         max_level=DEFAULT_MAX_LEVEL, adaptive=True):
+    """Calculates the weights for a list of detecting surface source pairs by
+    grouping them by source kind and integrating each group as a batch
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data,
+        as built by weight_calc.calculate_weights
+    order : int
+        The number of Gauss-Legendre nodes per panel per axis
+    rtol : float
+        The convergence tolerance of the adaptive rule
+    max_level : int
+        The maximum number of panel doublings of the adaptive rule
+    adaptive : bool
+        If False a single fixed rule with one panel per axis is used
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry in input_list, in the same order
+    """
+    groups = {}
+    for i, data in enumerate(input_list):
+        groups.setdefault(data[2].get_batch_params()[0], []).append(i)
+    weights = np.zeros(len(input_list), dtype=np.float64)
+    for kind, inds in groups.items():
+        surf_params, src_params = stack_pairs([input_list[i][1:3]
+                                               for i in inds])
+        if adaptive:
+            temp = integrate_adaptive(surf_params, kind, src_params, order,
+                                      rtol, max_level)[0]
+        else:
+            temp = integrate_fixed(surf_params, kind, src_params, order)
+        weights[inds] = temp
+        print "Integrated {0:d} {1:s} pairs".format(len(inds),
+                                                    gb.KIND_NAMES[kind])
+    return [(data[0], weights[i]) for i, data in enumerate(input_list)]
@@ -4,7 +4,7 @@ surface of one of the patches on the outer surface of AD1"""
 
 import ctypes as ct
 import numpy as np
-from libpd.geom_base import Shape
+from libpd.geom_base import Shape, make_batch_params, KIND_PARALLELOGRAM
 
 SURF_OFFSETS = [2.54*np.array([1.125, 0.0, 0.0], dtype=np.float64),   # front
                 2.54*np.array([-1.125, 0.0, 0.0], dtype=np.float64),  # back
@@ -134,6 +134,21 @@ class SimpleDetectingSurface(Shape):
                                 self.vec2.ctypes.data_as(ct.POINTER(ct.c_double)),
                                 self.norm.ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_PARALLELOGRAM
+        params : numpy array
+            4x3 array of zero center, vec1, vec2, and the surface normal
+        """
+        zero = np.zeros(3, dtype=np.float64)
+        return (KIND_PARALLELOGRAM, make_batch_params(zero, self.vec1,
+                                                     self.vec2, self.norm))
+
 
 class DetectingSurface(Shape):
     """This class is used as the surface of a detector which we need to
@@ -243,6 +258,20 @@ class DetectingSurface(Shape):
                                 self.vec2.ctypes.data_as(ct.POINTER(ct.c_double)),
                                 self.norm.ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_PARALLELOGRAM
+        params : numpy array
+            4x3 array of center, vec1, vec2, and the surface normal
+        """
+        return (KIND_PARALLELOGRAM, make_batch_params(self.center, self.vec1,
+                                                     self.vec2, self.norm))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -0,0 +1,176 @@
+"""This file contains the global error budget allocator of the two pass
+weight calculation. A cheap, low order fixed cubature pass estimates the
+magnitude of every pair, then the relative error budget of each (detector,
+run) row of the response matrix is split across the pairs of that row so the
+pairs that contribute little to the row total are integrated to a looser
+tolerance than the dominant ones. The convergence limit of the backend is not
+a usable knob for this (its refinement is not monotone in the limit, a looser
+limit can cost hundreds of times more evaluations), so the pairs that need
+the backend's tolerance are integrated by it and the rest are sampled by the
+quasi-Monte Carlo engine, whose cost falls with the tolerance"""
+
+import numpy as np
+import libpd.cubature as cub
+import libpd.geom_base as gb
+import libpd.source_table as st
+
+# the tolerances a pair can be given, the first is the convergence limit of
+# the backend (the tolerance every pair gets without a budget) and the rest are
+# relative standard errors of the quasi-Monte Carlo engine, the allocated
+# tolerances are snapped down to one of these so the pairs can be integrated
+# in a few batches
+TOLERANCE_LADDER = [1.0e-4, 1.0e-3, 1.0e-2, 1.0e-1]
+# the Gauss-Legendre order of the magnitude estimation pass
+ESTIMATE_ORDER = 2
+# the kinds of source the backend and the quasi-Monte Carlo engine disagree
+# on (the backend's line source weights are too high), their pairs stay on
+# the backend so a row never mixes the two engines' answers for them
+BACKEND_ONLY_KINDS = [gb.KIND_LINE]
+
+
+def estimate_magnitudes(input_list, order=ESTIMATE_ORDER):
+    """Estimates the weight of every pair with a single fixed, low order
+    cubature rule
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    order : int
+        The number of Gauss-Legendre nodes per axis
+
+    Returns
+    -------
+    estimate_list : list of tuples
+        (pos_info, estimated weight) for every entry in input_list
+    """
+    if len(input_list) == 0:
+        return []
+    return cub.calc_weights_batched(input_list, order=order, adaptive=False)
+
+
+def allocate_tolerances(weight_list, budget, ladder=TOLERANCE_LADDER):
+    """Splits the relative error budget of every (detector, run) row across
+    the pairs of the row. The tolerance of a pair is proportional to one over
+    the square root of its weight, which minimizes the total cost of the row
+    if the cost of a pair goes as one over its tolerance, scaled so the sum of
+    tolerance times weight is the budget times the row total, then clipped
+    to the ladder and snapped down to a rung of it
+
+    Parameters
+    ----------
+    weight_list : list of tuples
+        (pos_info, estimated weight) of every pair that will be integrated
+        and (pos_info, weight) of the pairs of the other paths, the other
+        paths count as exact but add to the row totals
+    budget : float
+        The relative error allowed in the total of every row
+    ladder : list of floats
+        The allowed tolerances, in increasing order
+
+    Returns
+    -------
+    tolerances : dict
+        Maps the pos_info of every pair to its tolerance
+    """
+    rows = {}
+    for pos_info, weight in weight_list:
+        rows.setdefault(pos_info[:2], []).append((pos_info, abs(weight)))
+    ladder = np.array(ladder, dtype=np.float64)
+    tolerances = {}
+    for entries in rows.values():
+        weights = np.array([x[1] for x in entries])
+        roots = np.sqrt(weights)
+        total = np.sum(weights)
+        scale = budget*total/np.sum(roots) if total > 0.0 else ladder[-1]
+        with np.errstate(divide="ignore"):
+            tols = np.clip(scale/roots, ladder[0], ladder[-1])
+        snapped = ladder[np.searchsorted(ladder, tols, side="right") - 1]
+        for (pos_info, _), tol in zip(entries, snapped):
+            tolerances[pos_info] = float(tol)
+    return tolerances
+
+
+def needs_backend(source):
+    """Returns True if the pairs of a source have to be integrated by the
+    backend whatever their tolerance, which is the sources of
+    BACKEND_ONLY_KINDS and the cylinders the backend places differently from
+    the other engines (those whose axis is not the z axis, see
+    source_table.has_backend_shape)
+
+    Parameters
+    ----------
+    source : geom_base.Shape
+        The source of the pairs
+
+    Returns
+    -------
+    pinned : bool
+        True if the pairs of the source are kept on the backend
+    """
+    kind, params = source.get_batch_params()
+    return kind in BACKEND_ONLY_KINDS or not st.has_backend_shape(kind,
+                                                                  params)
+
+
+def group_tolerances(tolerances, groups, ladder=TOLERANCE_LADDER,
+                     pinned=()):
+    """Gives every representative pair of a group of deduplicated pairs the
+    tightest tolerance of the pairs of its group and groups the
+    representatives by tolerance, the pinned representatives always get the
+    first tolerance of the ladder
+
+    Parameters
+    ----------
+    tolerances : dict
+        Maps the pos_info of every pair to its tolerance
+    groups : dict
+        The groups returned by weight_calc.dedup_input
+    ladder : list of floats
+        The allowed tolerances
+    pinned : set
+        The pos_info of the representatives that are kept on the first
+        tolerance of the ladder
+
+    Returns
+    -------
+    classes : dict
+        Maps each tolerance of the ladder that is used to the list of the
+        pos_info of the representatives with that tolerance
+    """
+    classes = {}
+    for rep_info, members in groups.items():
+        if rep_info in pinned:
+            classes.setdefault(ladder[0], []).append(rep_info)
+            continue
+        tol = min([tolerances.get(x, ladder[0]) for x in members])
+        classes.setdefault(tol, []).append(rep_info)
+    return classes
+
+
+def row_error_bounds(weight_list, abs_errors):
+    """Calculates the error bound of every (detector, run) row, the sum of
+    the absolute errors of the pairs of the row over the row total
+
+    Parameters
+    ----------
+    weight_list : list of tuples
+        (pos_info, weight) of every pair
+    abs_errors : dict
+        Maps the pos_info of every pair with an error to its absolute error,
+        the other pairs count as exact
+
+    Returns
+    -------
+    bounds : dict
+        Maps (det num, run num) to the relative error bound of the row, zero
+        for rows whose total is zero
+    """
+    totals = {}
+    errors = {}
+    for pos_info, weight in weight_list:
+        row = pos_info[:2]
+        totals[row] = totals.get(row, 0.0) + abs(weight)
+        errors[row] = errors.get(row, 0.0) + abs_errors.get(pos_info, 0.0)
+    return dict((row, (errors[row]/totals[row] if totals[row] > 0.0 else 0.0))
+                for row in totals)
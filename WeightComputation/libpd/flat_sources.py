@@ -3,7 +3,12 @@ squares to be made"""
 
 import ctypes as ct
 import numpy as np
-from libpd.geom_base import Shape
+from libpd.geom_base import Shape, make_batch_params, KIND_PARALLELOGRAM, \
+    KIND_DISK
+
+X_AXIS = np.array([1.0, 0.0, 0.0], dtype=np.float64)
+Y_AXIS = np.array([0.0, 1.0, 0.0], dtype=np.float64)
+Z_AXIS = np.array([0.0, 0.0, 1.0], dtype=np.float64)
 
 
 class Square(Shape):
@@ -114,6 +119,20 @@ class Square(Shape):
                               self.vec1.ctypes.data_as(ct.POINTER(ct.c_double)),
                               self.vec2.ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_PARALLELOGRAM
+        params : numpy array
+            4x3 array of center, vec1, vec2, and an unused zero row
+        """
+        return (KIND_PARALLELOGRAM, make_batch_params(self.center, self.vec1,
+                                                     self.vec2))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -245,6 +264,22 @@ class Circle(Shape):
                               self.rad,
                               self.rmat.ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_DISK
+        params : numpy array
+            4x3 array of center, the two rotated radius vectors, and an
+            unused zero row
+        """
+        return (KIND_DISK, make_batch_params(self.center,
+                                             self.rad*self.rmat[:, 0],
+                                             self.rad*self.rmat[:, 1]))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -368,6 +403,20 @@ class CircleXY(Shape):
         return lib.makeCircleXY((self.center-offset).ctypes.data_as(ct.POINTER(ct.c_double)),
                                 self.rad)
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_DISK
+        params : numpy array
+            4x3 array of center, the two radius vectors, and an unused zero row
+        """
+        return (KIND_DISK, make_batch_params(self.center, self.rad*X_AXIS,
+                                             self.rad*Y_AXIS))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -490,6 +539,20 @@ class CircleXZ(Shape):
         return lib.makeCircleXZ((self.center-offset).ctypes.data_as(ct.POINTER(ct.c_double)),
                                 self.rad)
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_DISK
+        params : numpy array
+            4x3 array of center, the two radius vectors, and an unused zero row
+        """
+        return (KIND_DISK, make_batch_params(self.center, self.rad*X_AXIS,
+                                             self.rad*Z_AXIS))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -612,6 +675,20 @@ class CircleYZ(Shape):
         return lib.makeCircleYZ((self.center-offset).ctypes.data_as(ct.POINTER(ct.c_double)),
                                 self.rad)
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_DISK
+        params : numpy array
+            4x3 array of center, the two radius vectors, and an unused zero row
+        """
+        return (KIND_DISK, make_batch_params(self.center, self.rad*Y_AXIS,
+                                             self.rad*Z_AXIS))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -7,6 +7,23 @@ import numpy as np
 # that 90.0 in cosine gives 0 (instead of 6.7e-17)
 RMAT_DEC = 15
 
+# the kinds of parameterization used by the batched (vectorized) integrators,
+# every shape maps onto one of these with a center and three vectors, see
+# Shape.get_batch_params for the meaning of the vectors for each kind
+KIND_POINT = 0
+KIND_LINE = 1
+KIND_PARALLELOGRAM = 2
+KIND_DISK = 3
+KIND_CYLINDER = 4
+
+KIND_NAMES = ["Point", "Line", "Parallelogram", "Disk", "Cylinder"]
+
+KIND_BOUNDS = [[],
+               [(-1.0, 1.0)],
+               [(-1.0, 1.0), (-1.0, 1.0)],
+               [(0.0, 2.0*np.pi), (0.0, 1.0)],
+               [(0.0, 2.0*np.pi), (-1.0, 1.0)]]
+
 
 class Shape(object):
     """Base class for 1D, 2D, and 3D shapes, provides several functions to be
@@ -86,6 +103,172 @@ class Shape(object):
         """
         raise NotImplementedError("Call to unimplemented base class")
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            One of the KIND_* constants
+        params : numpy array
+            4x3 array, the first row is the center (centroid) of the shape and
+            the other three rows are the vectors of the parameterization (rows
+            that are not used by the kind are zero)
+        """
+        raise NotImplementedError("Call to unimplemented base class")
+
+    def get_bounding_box(self):
+        """Returns the axis aligned box that contains the whole shape
+
+        Returns
+        -------
+        box : numpy array
+            2x3 array, the first row is the lower corner of the box and the
+            second row is the upper corner
+        """
+        kind, params = self.get_batch_params()
+        return batch_bounding_boxes(kind, params[np.newaxis])[0]
+
+    def get_class_name(self):
+        """Returns the name of the class of the shape, shapes with the same
+        batch parameters but different classes are not the same source
+
+        Returns
+        -------
+        class_name : str
+            The class name
+        """
+        return type(self).__name__
+
+
+def make_batch_params(center, vec1=None, vec2=None, vec3=None):
+    """Stacks a center and up to three parameterization vectors into the 4x3
+    array returned by Shape.get_batch_params
+
+    Parameters
+    ----------
+    center : vector
+        The center (centroid) of the shape
+    vec1, vec2, vec3 : vector
+        The parameterization vectors, missing vectors are left as zero
+
+    Returns
+    -------
+    params : numpy array
+        4x3 array of center, vec1, vec2, vec3
+    """
+    params = np.zeros((4, 3), dtype=np.float64)
+    params[0] = center
+    for i, vec in enumerate([vec1, vec2, vec3]):
+        if vec is not None:
+            params[i+1] = vec
+    return params
+
+
+def batch_positions(kind, params, args):
+    """Calculates the positions of many shapes of one kind at once
+
+    Parameters
+    ----------
+    kind : int
+        One of the KIND_* constants
+    params : numpy array
+        (N, 4, 3) array of stacked batch parameters of the shapes
+    args : list of numpy arrays
+        One array per integration parameter of the kind, each of shape (M,)
+        or (N, M)
+
+    Returns
+    -------
+    positions : numpy array
+        (N, M, 3) array of positions
+    """
+    cent = params[:, 0, np.newaxis, :]
+    vecs = [params[:, i, np.newaxis, :] for i in range(1, 4)]
+    args = [np.asarray(arg)[..., np.newaxis] for arg in args]
+    if kind == KIND_POINT:
+        return cent
+    elif kind == KIND_LINE:
+        return cent + args[0]*vecs[0]
+    elif kind == KIND_PARALLELOGRAM:
+        return cent + args[0]*vecs[0] + args[1]*vecs[1]
+    elif kind == KIND_DISK:
+        return cent + args[1]*(np.cos(args[0])*vecs[0] +
+                               np.sin(args[0])*vecs[1])
+    elif kind == KIND_CYLINDER:
+        return (cent + np.cos(args[0])*vecs[0] + np.sin(args[0])*vecs[1] +
+                args[1]*vecs[2])
+    raise ValueError("Unknown shape kind: {0:d}".format(kind))
+
+
+def batch_area_elements(kind, params, args):
+    """Calculates the area (or length or volume) scaling factors of many
+    shapes of one kind at once
+
+    Parameters
+    ----------
+    kind : int
+        One of the KIND_* constants
+    params : numpy array
+        (N, 4, 3) array of stacked batch parameters of the shapes
+    args : list of numpy arrays
+        One array per integration parameter of the kind, each of shape (M,)
+        or (N, M)
+
+    Returns
+    -------
+    area_scale : numpy array
+        (N, M) array (or (N, 1) if it does not depend on the parameters) of
+        the scaling factors
+    """
+    mags = np.sqrt(np.sum(np.square(params[:, 1:, :]), axis=2))
+    if kind == KIND_POINT:
+        return np.ones((params.shape[0], 1), dtype=np.float64)
+    elif kind == KIND_LINE:
+        return mags[:, 0, np.newaxis]
+    elif kind == KIND_PARALLELOGRAM:
+        return (mags[:, 0]*mags[:, 1])[:, np.newaxis]
+    elif kind == KIND_DISK:
+        return (mags[:, 0]*mags[:, 1])[:, np.newaxis]*np.asarray(args[1])
+    elif kind == KIND_CYLINDER:
+        return (mags[:, 0]*mags[:, 2])[:, np.newaxis]
+    raise ValueError("Unknown shape kind: {0:d}".format(kind))
+
+
+def batch_bounding_boxes(kind, params):
+    """Calculates the axis aligned bounding boxes of many shapes of one kind
+    at once
+
+    Parameters
+    ----------
+    kind : int
+        One of the KIND_* constants
+    params : numpy array
+        (N, 4, 3) array of stacked batch parameters of the shapes
+
+    Returns
+    -------
+    boxes : numpy array
+        (N, 2, 3) array of the lower and upper corners of the boxes
+    """
+    cent = params[:, 0, :]
+    absv = np.abs(params[:, 1:, :])
+    if kind == KIND_POINT:
+        half = np.zeros_like(cent)
+    elif kind == KIND_LINE:
+        half = absv[:, 0]
+    elif kind == KIND_PARALLELOGRAM:
+        half = absv[:, 0] + absv[:, 1]
+    elif kind == KIND_DISK:
+        half = np.sqrt(np.square(absv[:, 0]) + np.square(absv[:, 1]))
+    elif kind == KIND_CYLINDER:
+        half = (np.sqrt(np.square(absv[:, 0]) + np.square(absv[:, 1])) +
+                absv[:, 2])
+    else:
+        raise ValueError("Unknown shape kind: {0:d}".format(kind))
+    return np.stack((cent - half, cent + half), axis=1)
+
 
 class Rotation(object):
     """This class contains the rotation matrix for describing a shapes
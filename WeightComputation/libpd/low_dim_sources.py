@@ -3,7 +3,8 @@
 
 import ctypes as ct
 import numpy as np
-from libpd.geom_base import Shape
+from libpd.geom_base import Shape, make_batch_params, KIND_POINT, \
+    KIND_LINE
 
 
 class PointSource(Shape):
@@ -101,6 +102,19 @@ class PointSource(Shape):
         """
         return lib.makePoint((self.center-offset).ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_POINT
+        params : numpy array
+            4x3 array of the point position and three unused zero rows
+        """
+        return (KIND_POINT, make_batch_params(self.center))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -219,6 +233,21 @@ class LineSource(Shape):
         return lib.makeLine((self.strt-offset).ctypes.data_as(ct.POINTER(ct.c_double)),
                             self.vec.ctypes.data_as(ct.POINTER(ct.c_double)))
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_LINE
+        params : numpy array
+            4x3 array of the midpoint of the line, half the line vector,
+            and two unused zero rows
+        """
+        return (KIND_LINE, make_batch_params(self.strt + self.vec/2.0,
+                                             self.vec/2.0))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -0,0 +1,216 @@
+"""This file contains the batched, vectorized, Monte Carlo integration engine.
+For many detecting surface and source pairs whose sources share a kind of
+parameterization it draws random points on each surface and each source with
+numpy (using the same batch parameterizations as libpd.cubature), and keeps
+drawing rounds of points only for the pairs whose relative standard error has
+not yet reached the target, so cheap, low importance pairs can be given a
+loose tolerance. Every weight is returned with its standard error"""
+
+import numpy as np
+import libpd.geom_base as gb
+import libpd.cubature as cub
+
+INV_FOUR_PI = (1.0/(4.0*np.pi))
+# the relative standard error at which a pair stops being sampled
+DEFAULT_RTOL = 1.0e-2
+# the absolute standard error below which a pair stops being sampled
+DEFAULT_ATOL = 1.0e-14
+# the number of points drawn per pair per round
+DEFAULT_ROUND_SAMPLES = 256
+# the number of points a pair gets before its error estimate is trusted
+DEFAULT_MIN_SAMPLES = 1024
+# the number of points after which a pair stops being sampled regardless
+DEFAULT_MAX_SAMPLES = 2**18
+# the seed of the random number generator used when none is given
+DEFAULT_SEED = 12345
+
+
+def draw_uniform(rng, num_pairs, num_dims, num_samples):
+    """Draws independent uniform points in the unit hypercube
+
+    Parameters
+    ----------
+    rng : numpy.random.RandomState
+        The random number generator
+    num_pairs : int
+        The number of pairs to draw points for
+    num_dims : int
+        The dimension of the points
+    num_samples : int
+        The number of points per pair
+
+    Returns
+    -------
+    points : numpy array
+        (num_dims, num_pairs, num_samples) array of coordinates in [0, 1)
+    """
+    return rng.random_sample((num_dims, num_pairs, num_samples))
+
+
+def sample_integrand(rel_surf, kind, rel_src, src_bnds, unit):
+    """Evaluates the integrand at random points of a batch of pairs that have
+    already been made relative to their surface centers, scaled so the mean
+    over the points is the estimate of the integral
+
+    Parameters
+    ----------
+    rel_surf : numpy array
+        (N, 4, 3) array of relative surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    rel_src : numpy array
+        (N, 4, 3) array of relative source batch parameters
+    src_bnds : numpy array
+        (N, D, 2) array of the source bounds from cubature.source_bounds
+    unit : numpy array
+        (2 + D, N, M) array of points in the unit hypercube (or (2 + D, 1, M)
+        to use the same points for every pair), the first two coordinates are
+        used on the surface and the rest on the source
+
+    Returns
+    -------
+    values : numpy array
+        (N, M) array of the scaled integrand values
+    """
+    det_bnds = np.array(gb.KIND_BOUNDS[gb.KIND_PARALLELOGRAM],
+                        dtype=np.float64)
+    det_args = [det_bnds[i, 0] + (det_bnds[i, 1] - det_bnds[i, 0])*unit[i]
+                for i in range(2)]
+    widths = src_bnds[:, :, 1] - src_bnds[:, :, 0]
+    src_args = [src_bnds[:, i, 0, np.newaxis] +
+                widths[:, i, np.newaxis]*unit[2+i]
+                for i in range(src_bnds.shape[1])]
+    det_pos = gb.batch_positions(gb.KIND_PARALLELOGRAM, rel_surf, det_args)
+    src_pos = gb.batch_positions(kind, rel_src, src_args)
+    volume = (np.prod(det_bnds[:, 1] - det_bnds[:, 0]) *
+              np.prod(widths, axis=1)[:, np.newaxis])
+    scale = (volume *
+             gb.batch_area_elements(gb.KIND_PARALLELOGRAM, rel_surf,
+                                    det_args) *
+             gb.batch_area_elements(kind, rel_src, src_args))
+    # line of sight test, the source point must be in front of the surface
+    visible = np.einsum("nmk,nk->nm", src_pos, rel_surf[:, 3, :]) > 0.0
+    dist_sq = np.sum(np.square(det_pos - src_pos), axis=2)
+    return INV_FOUR_PI*scale*visible/dist_sq
+
+
+def integrate_mc(surf_params, kind, src_params, rtol=DEFAULT_RTOL,
+                 atol=DEFAULT_ATOL, round_samples=DEFAULT_ROUND_SAMPLES,
+                 min_samples=DEFAULT_MIN_SAMPLES,
+                 max_samples=DEFAULT_MAX_SAMPLES, rng=None):
+    """Integrates a batch of pairs by Monte Carlo, drawing rounds of points
+    for the pairs whose standard error is still above the tolerance
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+    rtol : float
+        The relative standard error at which a pair stops
+    atol : float
+        The absolute standard error at which a pair stops
+    round_samples : int
+        The number of points drawn per pair per round
+    min_samples : int
+        The number of points every pair gets before it can stop
+    max_samples : int
+        The number of points after which a pair stops regardless
+    rng : numpy.random.RandomState
+        The random number generator, a new one seeded with DEFAULT_SEED if
+        None
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the integrals
+    errors : numpy array
+        (N,) array of the standard errors of the integrals
+    counts : numpy array
+        (N,) array of the number of points each pair used
+    """
+    if rng is None:
+        rng = np.random.RandomState(DEFAULT_SEED)
+    rel_surf, rel_src = cub.make_relative(surf_params, src_params)
+    src_bnds = cub.source_bounds(kind, rel_surf, rel_src)
+    num_dims = 2 + src_bnds.shape[1]
+    num = rel_surf.shape[0]
+    means = np.zeros(num, dtype=np.float64)
+    sq_devs = np.zeros(num, dtype=np.float64)
+    counts = np.zeros(num, dtype=np.int64)
+    active = np.arange(num)
+    while active.size != 0:
+        values = sample_integrand(rel_surf[active], kind, rel_src[active],
+                                  src_bnds[active],
+                                  draw_uniform(rng, active.size, num_dims,
+                                               round_samples))
+        # merge the mean and squared deviations of the round into the totals
+        # (the pairwise update of Chan et al.)
+        rnd_mean = np.mean(values, axis=1)
+        rnd_sq_dev = np.sum(np.square(values - rnd_mean[:, np.newaxis]),
+                            axis=1)
+        old = counts[active].astype(np.float64)
+        total = old + round_samples
+        delta = rnd_mean - means[active]
+        means[active] += delta*round_samples/total
+        sq_devs[active] += (rnd_sq_dev +
+                            np.square(delta)*old*round_samples/total)
+        counts[active] += round_samples
+        errors = np.sqrt(sq_devs[active]/(total*(total - 1.0)))
+        done = ((errors <= rtol*np.abs(means[active]) + atol) &
+                (counts[active] >= min_samples)) | (counts[active] >=
+                                                    max_samples)
+        active = active[np.logical_not(done)]
+    errors = np.sqrt(sq_devs/(counts*(counts - 1.0)))
+    return (means, errors, counts)
+
+
+def calc_weights_mc(input_list, rtol=DEFAULT_RTOL, seed=DEFAULT_SEED):
+    """Calculates the weights and their standard errors for a list of
+    detecting surface source pairs by grouping them by source kind and
+    integrating each group as a batch
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data,
+        as built by weight_calc.calculate_weights
+    rtol : float
+        The relative standard error at which a pair stops
+    seed : int or list of ints
+        The seed of the random number generator, the same seed and input
+        give the same weights
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry in input_list, in the same order
+    error_list : list of tuples
+        (pos_info, standard error) for every entry in input_list, in the same
+        order
+    count_list : list of tuples
+        (pos_info, number of points) for every entry in input_list, in the
+        same order
+    """
+    rng = np.random.RandomState(seed)
+    groups = {}
+    for i, data in enumerate(input_list):
+        groups.setdefault(data[2].get_batch_params()[0], []).append(i)
+    weights = np.zeros(len(input_list), dtype=np.float64)
+    errors = np.zeros(len(input_list), dtype=np.float64)
+    all_counts = np.zeros(len(input_list), dtype=np.int64)
+    for kind in sorted(groups):
+        inds = groups[kind]
+        surf_params, src_params = cub.stack_pairs([input_list[i][1:3]
+                                                   for i in inds])
+        weights[inds], errors[inds], counts = integrate_mc(
+            surf_params, kind, src_params, rtol, rng=rng)
+        temp = "Sampled {0:d} {1:s} pairs, {2:.0f} points per pair on average"
+        print temp.format(len(inds), gb.KIND_NAMES[kind], np.mean(counts))
+        all_counts[inds] = counts
+    return ([(data[0], weights[i]) for i, data in enumerate(input_list)],
+            [(data[0], errors[i]) for i, data in enumerate(input_list)],
+            [(data[0], all_counts[i]) for i, data in enumerate(input_list)])
@@ -0,0 +1,135 @@
+"""This file contains the multi-resolution wall weight builder. The weights are
+additive over area so the weight of a coarse wall patch is exactly the sum of
+the weights of the finest patches (from
+source_construction.make_sectioned_cube_wall_sources) it covers, every coarser
+level is made by block summation instead of being integrated again"""
+
+import numpy as np
+import libpd.source_construction as sc
+
+# the format of the multi-resolution names, the wall name followed by the
+# number of divisions per axis and the indices along the two wall edges, this
+# is the format used by RecursiveSegmentation
+LEVEL_SUFFIX = "_{0:d}_{1:d}_{2:d}"
+# the format of the names of the finest patches
+FINE_SUFFIX = "_{0:d}_{1:d}"
+
+
+def level_divisions(wall_divs, bases=(2,)):
+    """Returns every number of divisions per axis that is a power of one of
+    the bases and that evenly divides the finest number of divisions
+
+    Parameters
+    ----------
+    wall_divs : int
+        The number of divisions per axis of the finest level
+    bases : tuple of ints
+        The bases of the levels, (2,) gives the 2^k levels and (2, 3) adds the
+        3^k levels
+
+    Returns
+    -------
+    divs_list : list of ints
+        The numbers of divisions, in increasing order, always including 1 and
+        wall_divs
+
+    Raises
+    ------
+    ValueError
+        If no power of one of the bases divides wall_divs, that base would
+        add no level
+    """
+    divs_list = set([1, wall_divs])
+    for base in bases:
+        divs = base
+        if wall_divs % divs != 0:
+            temp = "No power of {0:d} divides the {1:d} wall divisions, the "\
+                "base {0:d} would add no multi-resolution level"
+            raise ValueError(temp.format(base, wall_divs))
+        while divs <= wall_divs:
+            if wall_divs % divs == 0:
+                divs_list.add(divs)
+            divs *= base
+    return sorted(divs_list)
+
+
+def block_sum(fine, divs):
+    """Sums the blocks of the finest level weights to a coarser level
+
+    Parameters
+    ----------
+    fine : numpy array
+        (..., wall_divs, wall_divs) array of the finest level weights
+    divs : int
+        The number of divisions per axis of the coarse level, must divide
+        wall_divs
+
+    Returns
+    -------
+    coarse : numpy array
+        (..., divs, divs) array of the coarse level weights
+    """
+    ratio = fine.shape[-1]//divs
+    shape = fine.shape[:-2] + (divs, ratio, divs, ratio)
+    return fine.reshape(shape).sum(axis=(-3, -1))
+
+
+def build_multi_res_weights(weights, wall_divs=None, bases=(2,)):
+    """Replaces the finest wall patch weights in a weight list with the
+    weights of every level, named Name_{divs}_{i}_{j}
+
+    Parameters
+    ----------
+    weights : list of tuples
+        (det num, run num, source name, weight) as returned by
+        weight_calc.calculate_weights
+    wall_divs : int
+        The number of divisions per axis of the finest wall patches, defaults
+        to source_construction.WALL_DIVS
+    bases : tuple of ints
+        The bases of the levels to make, see level_divisions
+
+    Returns
+    -------
+    out_list : list of tuples
+        The weights of the sources that are not finest wall patches, followed
+        by the multi-resolution wall weights, sorted by det, run, and name
+    """
+    if wall_divs is None:
+        wall_divs = sc.WALL_DIVS
+    fine_names = {}
+    for k, name in enumerate(sc.WALL_NAMES):
+        for i in range(wall_divs):
+            for j in range(wall_divs):
+                fine_names[name + FINE_SUFFIX.format(i, j)] = (k, i, j)
+    # gather the finest patches of every det, run pair into one array
+    runs = {}
+    out_list = []
+    for det, run, name, weight in weights:
+        if name in fine_names:
+            if (det, run) not in runs:
+                runs[(det, run)] = np.full((len(sc.WALL_NAMES), wall_divs,
+                                            wall_divs), np.nan)
+            runs[(det, run)][fine_names[name]] = weight
+        else:
+            out_list.append((det, run, name, weight))
+    divs_list = level_divisions(wall_divs, bases)
+    for (det, run), fine in runs.items():
+        found = np.logical_not(np.isnan(fine))
+        for k, name in enumerate(sc.WALL_NAMES):
+            if not np.any(found[k]):
+                continue
+            if not np.all(found[k]):
+                temp = "Wall {0:s} is missing patches for det {1:d} run {2:d}"
+                raise ValueError(temp.format(name, det, run))
+            for divs in divs_list:
+                coarse = block_sum(fine[k], divs)
+                for i in range(divs):
+                    for j in range(divs):
+                        out_list.append((det, run, name +
+                                         LEVEL_SUFFIX.format(divs, i, j),
+                                         coarse[i, j]))
+    temp = "Built {0:d} wall levels {1:s} from the finest patches"
+    print temp.format(len(divs_list), str(divs_list))
+    out_list.sort(key=lambda x: (x[0], x[1], x[2]))
+    return out_list
@@ -0,0 +1,188 @@
+"""This file contains the far field approximation of the weights. When the
+distance between the centers of a detecting surface and a source is large
+compared to their sizes, 1/r^2 is expanded about the separation of the
+centers, the odd terms vanish because every shape is symmetric about its
+center, so the monopole and quadrupole terms are exact to fourth order in
+size/distance, and the remainder of the expansion gives an a-priori bound on
+the error"""
+
+import numpy as np
+import libpd.geom_base as gb
+
+INV_FOUR_PI = (1.0/(4.0*np.pi))
+# the total measure (area, length, or 1 for points) of each kind is this
+# factor times the area element of the batch parameters
+KIND_MEASURE = [1.0, 2.0, 4.0, np.pi, 4.0*np.pi]
+
+
+def gram_radius(vec1, vec2):
+    """Returns the largest length of cos(u)*vec1 + sin(u)*vec2 over u
+
+    Parameters
+    ----------
+    vec1, vec2 : numpy array
+        (N, 3) arrays of vectors
+
+    Returns
+    -------
+    radius : numpy array
+        (N,) array of the largest lengths
+    """
+    aa = np.sum(vec1*vec1, axis=1)
+    bb = np.sum(vec2*vec2, axis=1)
+    ab = np.sum(vec1*vec2, axis=1)
+    return np.sqrt(0.5*(aa + bb) + np.sqrt(0.25*np.square(aa - bb) +
+                                           np.square(ab)))
+
+
+def batch_moments(kind, params):
+    """Calculates the measure, the second moment about the center (per unit
+    measure), and the radius of many shapes of one kind at once
+
+    Parameters
+    ----------
+    kind : int
+        One of the KIND_* constants
+    params : numpy array
+        (N, 4, 3) array of stacked batch parameters of the shapes, for
+        parallelograms the fourth row is ignored so surfaces can be passed
+
+    Returns
+    -------
+    measure : numpy array
+        (N,) array of the areas, lengths, or 1 for points
+    moment : numpy array
+        (N, 3, 3) array of the second moments
+    radius : numpy array
+        (N,) array of the largest distances from the centers to the shapes
+    """
+    vecs = params[:, 1:, :]
+    outer = vecs[:, :, :, np.newaxis]*vecs[:, :, np.newaxis, :]
+    mags = np.sqrt(np.sum(np.square(vecs), axis=2))
+    if kind == gb.KIND_POINT:
+        moment = np.zeros((params.shape[0], 3, 3), dtype=np.float64)
+        radius = np.zeros(params.shape[0], dtype=np.float64)
+        elem = np.ones(params.shape[0], dtype=np.float64)
+    elif kind == gb.KIND_LINE:
+        moment = outer[:, 0]/3.0
+        radius = mags[:, 0]
+        elem = mags[:, 0]
+    elif kind == gb.KIND_PARALLELOGRAM:
+        moment = (outer[:, 0] + outer[:, 1])/3.0
+        radius = np.maximum(np.linalg.norm(vecs[:, 0] + vecs[:, 1], axis=1),
+                            np.linalg.norm(vecs[:, 0] - vecs[:, 1], axis=1))
+        elem = mags[:, 0]*mags[:, 1]
+    elif kind == gb.KIND_DISK:
+        moment = (outer[:, 0] + outer[:, 1])/4.0
+        radius = gram_radius(vecs[:, 0], vecs[:, 1])
+        elem = mags[:, 0]*mags[:, 1]
+    elif kind == gb.KIND_CYLINDER:
+        moment = (outer[:, 0] + outer[:, 1])/2.0 + outer[:, 2]/3.0
+        radius = gram_radius(vecs[:, 0], vecs[:, 1]) + mags[:, 2]
+        elem = mags[:, 0]*mags[:, 2]
+    else:
+        raise ValueError("Unknown shape kind: {0:d}".format(kind))
+    return (KIND_MEASURE[kind]*elem, moment, radius)
+
+
+def error_bound(ratio):
+    """Returns the bound on the relative error of the far field weight. The
+    terms of degree k of the expansion of 1/|d + x|^2 are bounded by
+    (k + 1)*(|x|/|d|)^k/|d|^2 (they are Chebyshev polynomials of the second
+    kind), summing the terms of degree 4 and up and dividing by the smallest
+    possible weight gives the bound
+
+    Parameters
+    ----------
+    ratio : numpy array
+        The sum of the radii of the two shapes divided by the distance
+        between their centers, must be less than 1
+
+    Returns
+    -------
+    bound : numpy array
+        The bound on the relative error
+    """
+    tail = (1.0/np.square(1.0 - ratio) - 1.0 - 2.0*ratio -
+            3.0*np.square(ratio) - 4.0*np.power(ratio, 3))
+    return tail*np.square(1.0 + ratio)
+
+
+def far_field_weights(surf_params, kind, src_params):
+    """Calculates the far field weights and their error bounds for a batch of
+    pairs whose sources share a kind, the sources must be entirely in front of
+    their surfaces
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the weights
+    bounds : numpy array
+        (N,) array of the bounds on their relative errors, infinite where the
+        shapes are too close for the expansion to converge
+    """
+    surf_meas, surf_mom, surf_rad = batch_moments(gb.KIND_PARALLELOGRAM,
+                                                  surf_params)
+    src_meas, src_mom, src_rad = batch_moments(kind, src_params)
+    sep = src_params[:, 0, :] - surf_params[:, 0, :]
+    dist_sq = np.sum(np.square(sep), axis=1)
+    moment = surf_mom + src_mom
+    quad = (4.0*np.einsum("ni,nij,nj->n", sep, moment, sep)/dist_sq -
+            np.trace(moment, axis1=1, axis2=2))/np.square(dist_sq)
+    weights = INV_FOUR_PI*surf_meas*src_meas*(1.0/dist_sq + quad)
+    ratio = (surf_rad + src_rad)/np.sqrt(dist_sq)
+    bounds = np.full(ratio.shape, np.inf)
+    conv = ratio < 1.0
+    bounds[conv] = error_bound(ratio[conv])
+    return (weights, bounds)
+
+
+def split_far_field(input_list, tolerance):
+    """Evaluates the far field weights of a list of surface source pairs and
+    splits off the pairs whose error bound is within the tolerance, every
+    source must be entirely in front of its surface
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    tolerance : float
+        The largest acceptable bound on the relative error
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for the pairs that are far enough apart
+    near_list : list of tuples
+        The entries of input_list that are not
+    """
+    groups = {}
+    for i, data in enumerate(input_list):
+        groups.setdefault(data[2].get_batch_params()[0], []).append(i)
+    weights = np.zeros(len(input_list), dtype=np.float64)
+    bounds = np.full(len(input_list), np.inf)
+    for kind, inds in groups.items():
+        surf_params = np.array([input_list[i][1].get_batch_params()[1]
+                                for i in inds])
+        src_params = np.array([input_list[i][2].get_batch_params()[1]
+                               for i in inds])
+        weights[inds], bounds[inds] = far_field_weights(surf_params, kind,
+                                                        src_params)
+    far = bounds <= tolerance
+    weight_list = [(data[0], weights[i]) for i, data in enumerate(input_list)
+                   if far[i]]
+    near_list = [data for i, data in enumerate(input_list) if not far[i]]
+    if np.any(far):
+        temp = "Far field: {0:d} pairs within tolerance {1:e} (largest "\
+            "bound {2:e})"
+        print temp.format(int(np.sum(far)), tolerance, np.max(bounds[far]))
+    return (weight_list, near_list)
@@ -0,0 +1,369 @@
+"""This file contains the randomized quasi-Monte Carlo integration engine. It
+evaluates the integrand of many detecting surface and source pairs at the
+points of a low discrepancy sequence (Sobol or Halton) mapped onto the
+parameter boxes of the surfaces and sources, using the vectorized integrand of
+libpd.monte_carlo. The sequence is randomized (scrambled) several times
+independently, the spread of the estimates of these replicas gives the
+standard error, and the number of points per replica is doubled for the pairs
+whose standard error is still above the target"""
+
+import numpy as np
+import libpd.cubature as cub
+import libpd.geom_base as gb
+import libpd.monte_carlo as mc
+
+# the low discrepancy sequences that can be used
+SEQUENCES = ["sobol", "halton"]
+# the number of bits of precision of the Sobol points
+SOBOL_BITS = 32
+# the degree, polynomial coefficients, and initial direction numbers of the
+# Sobol sequence beyond the first dimension (from Joe and Kuo's table)
+SOBOL_POLYS = [(1, 0, [1]),
+               (2, 1, [1, 3]),
+               (3, 1, [1, 3, 1]),
+               (3, 2, [1, 1, 1]),
+               (4, 1, [1, 1, 3, 3])]
+# the bases of the dimensions of the Halton sequence
+HALTON_BASES = [2, 3, 5, 7, 11, 13]
+# the number of independently randomized replicas of the sequence
+DEFAULT_REPLICAS = 8
+# the number of points per replica in the first round
+DEFAULT_MIN_POINTS = 2**7
+# the number of points per replica after which a pair stops regardless
+DEFAULT_MAX_POINTS = 2**14
+# the maximum number of (pair, point) combinations evaluated in one numpy
+# operation, this bounds the memory use
+MAX_BLOCK_POINTS = 2**20
+
+
+def sobol_directions(num_dims):
+    """Builds the direction numbers of the first dimensions of the Sobol
+    sequence
+
+    Parameters
+    ----------
+    num_dims : int
+        The number of dimensions
+
+    Returns
+    -------
+    dirs : numpy array
+        (num_dims, SOBOL_BITS) array of the direction numbers, scaled to
+        integers of SOBOL_BITS bits
+    """
+    if num_dims > len(SOBOL_POLYS) + 1:
+        temp = "The Sobol sequence only has {0:d} dimensions"
+        raise ValueError(temp.format(len(SOBOL_POLYS) + 1))
+    dirs = np.zeros((num_dims, SOBOL_BITS), dtype=np.uint64)
+    # the first dimension is the van der Corput sequence
+    dirs[0] = [1 << (SOBOL_BITS - 1 - k) for k in range(SOBOL_BITS)]
+    for dim in range(1, num_dims):
+        deg, coeffs, init = SOBOL_POLYS[dim-1]
+        vals = [m << (SOBOL_BITS - 1 - k) for k, m in enumerate(init)]
+        for k in range(deg, SOBOL_BITS):
+            new = vals[k-deg] ^ (vals[k-deg] >> deg)
+            for j in range(1, deg):
+                if (coeffs >> (deg - 1 - j)) & 1:
+                    new ^= vals[k-j]
+            vals.append(new)
+        dirs[dim] = vals
+    return dirs
+
+
+def scramble_sobol(dirs, rng):
+    """Randomizes the Sobol sequence with a random linear matrix scramble and
+    a random digital shift (Matousek's scrambling)
+
+    Parameters
+    ----------
+    dirs : numpy array
+        The direction numbers from sobol_directions
+    rng : numpy.random.RandomState
+        The random number generator
+
+    Returns
+    -------
+    scrambled : numpy array
+        The scrambled direction numbers
+    shift : numpy array
+        (num_dims,) array of the digital shifts
+    """
+    scrambled = np.zeros_like(dirs)
+    # bit j of the output (counting from the most significant) is the parity
+    # of row j of a random lower triangular matrix with a unit diagonal and
+    # the input bits
+    for dim in range(dirs.shape[0]):
+        rows = []
+        for j in range(SOBOL_BITS):
+            bits = list(rng.randint(0, 2, size=j)) + [1]
+            rows.append(sum([int(b) << (SOBOL_BITS - 1 - i) for i, b in
+                             enumerate(bits)]))
+        for k in range(SOBOL_BITS):
+            val = int(dirs[dim, k])
+            out = 0
+            for j, row in enumerate(rows):
+                if bin(row & val).count("1") % 2:
+                    out |= 1 << (SOBOL_BITS - 1 - j)
+            scrambled[dim, k] = out
+    shift = np.array([rng.randint(0, 2**16) << 16 | rng.randint(0, 2**16) for
+                      _ in range(dirs.shape[0])], dtype=np.uint64)
+    return (scrambled, shift)
+
+
+def sobol_points(dirs, shift, start, num):
+    """Generates points of a scrambled Sobol sequence
+
+    Parameters
+    ----------
+    dirs : numpy array
+        The (scrambled) direction numbers
+    shift : numpy array
+        The digital shifts
+    start : int
+        The index of the first point
+    num : int
+        The number of points
+
+    Returns
+    -------
+    points : numpy array
+        (num_dims, num) array of coordinates in [0, 1)
+    """
+    inds = np.arange(start, start + num, dtype=np.uint64)
+    vals = np.zeros((dirs.shape[0], num), dtype=np.uint64)
+    for k in range(SOBOL_BITS):
+        bit = ((inds >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        vals[:, bit] ^= dirs[:, k, np.newaxis]
+    vals ^= shift[:, np.newaxis]
+    # the half is added so no coordinate is exactly zero
+    return (vals.astype(np.float64) + 0.5)/float(2**SOBOL_BITS)
+
+
+def scramble_halton(num_dims, rng):
+    """Draws the random digit permutations of a scrambled Halton sequence,
+    every digit of every dimension gets its own permutation
+
+    Parameters
+    ----------
+    num_dims : int
+        The number of dimensions
+    rng : numpy.random.RandomState
+        The random number generator
+
+    Returns
+    -------
+    perms : list of numpy arrays
+        (num digits, base) array of permutations for each dimension
+    """
+    if num_dims > len(HALTON_BASES):
+        temp = "The Halton sequence only has {0:d} dimensions"
+        raise ValueError(temp.format(len(HALTON_BASES)))
+    perms = []
+    for base in HALTON_BASES[:num_dims]:
+        num_digits = int(np.ceil(SOBOL_BITS*np.log(2.0)/np.log(base)))
+        perms.append(np.array([rng.permutation(base) for _ in
+                               range(num_digits)]))
+    return perms
+
+
+def halton_points(perms, start, num):
+    """Generates points of a scrambled Halton sequence
+
+    Parameters
+    ----------
+    perms : list of numpy arrays
+        The digit permutations from scramble_halton
+    start : int
+        The index of the first point
+    num : int
+        The number of points
+
+    Returns
+    -------
+    points : numpy array
+        (num_dims, num) array of coordinates in [0, 1)
+    """
+    points = np.zeros((len(perms), num), dtype=np.float64)
+    for dim, perm in enumerate(perms):
+        base = HALTON_BASES[dim]
+        rest = np.arange(start, start + num, dtype=np.int64)
+        scale = 1.0/base
+        for digits in perm:
+            points[dim] += scale*digits[rest % base]
+            rest //= base
+            scale /= base
+    return points
+
+
+class ScrambledSequence(object):
+    """This class is one randomized replica of a low discrepancy sequence"""
+    def __init__(self, sequence, num_dims, rng):
+        """Draws the randomization of the replica
+
+        Parameters
+        ----------
+        sequence : str
+            One of SEQUENCES
+        num_dims : int
+            The number of dimensions
+        rng : numpy.random.RandomState
+            The random number generator
+        """
+        if sequence not in SEQUENCES:
+            raise ValueError("Unknown sequence: {0:s}".format(sequence))
+        self.sequence = sequence
+        if sequence == "sobol":
+            self.dirs, self.shift = scramble_sobol(sobol_directions(num_dims),
+                                                   rng)
+        else:
+            self.perms = scramble_halton(num_dims, rng)
+
+    def points(self, start, num):
+        """Returns points of the replica
+
+        Parameters
+        ----------
+        start : int
+            The index of the first point
+        num : int
+            The number of points
+
+        Returns
+        -------
+        points : numpy array
+            (num_dims, num) array of coordinates in [0, 1)
+        """
+        if self.sequence == "sobol":
+            return sobol_points(self.dirs, self.shift, start, num)
+        return halton_points(self.perms, start, num)
+
+
+def integrate_qmc(surf_params, kind, src_params, sequence="sobol",
+                  rtol=mc.DEFAULT_RTOL, atol=mc.DEFAULT_ATOL,
+                  replicas=DEFAULT_REPLICAS, min_points=DEFAULT_MIN_POINTS,
+                  max_points=DEFAULT_MAX_POINTS, rng=None):
+    """Integrates a batch of pairs by randomized quasi-Monte Carlo, doubling
+    the number of points per replica for the pairs whose standard error is
+    still above the tolerance
+
+    Parameters
+    ----------
+    surf_params : numpy array
+        (N, 4, 3) array of surface batch parameters
+    kind : int
+        The kind of parameterization of the sources
+    src_params : numpy array
+        (N, 4, 3) array of source batch parameters
+    sequence : str
+        One of SEQUENCES
+    rtol : float
+        The relative standard error at which a pair stops
+    atol : float
+        The absolute standard error at which a pair stops
+    replicas : int
+        The number of independently randomized replicas
+    min_points : int
+        The number of points per replica of the first round
+    max_points : int
+        The number of points per replica after which a pair stops regardless
+    rng : numpy.random.RandomState
+        The random number generator, a new one seeded with
+        monte_carlo.DEFAULT_SEED if None
+
+    Returns
+    -------
+    weights : numpy array
+        (N,) array of the integrals
+    errors : numpy array
+        (N,) array of the standard errors of the integrals
+    counts : numpy array
+        (N,) array of the number of points each pair used (over all replicas)
+    """
+    if rng is None:
+        rng = np.random.RandomState(mc.DEFAULT_SEED)
+    rel_surf, rel_src = cub.make_relative(surf_params, src_params)
+    src_bnds = cub.source_bounds(kind, rel_surf, rel_src)
+    num_dims = 2 + src_bnds.shape[1]
+    seqs = [ScrambledSequence(sequence, num_dims, rng) for _ in
+            range(replicas)]
+    num = rel_surf.shape[0]
+    sums = np.zeros((replicas, num), dtype=np.float64)
+    counts = np.zeros(num, dtype=np.int64)
+    weights = np.zeros(num, dtype=np.float64)
+    errors = np.zeros(num, dtype=np.float64)
+    active = np.arange(num)
+    done_pts = 0
+    num_pts = min_points
+    while active.size != 0:
+        # only the new points of the doubled replicas are evaluated
+        step = max(1, MAX_BLOCK_POINTS // active.size)
+        for rep, seq in enumerate(seqs):
+            for pstart in range(done_pts, num_pts, step):
+                pnum = min(step, num_pts - pstart)
+                unit = seq.points(pstart, pnum)[:, np.newaxis, :]
+                sums[rep, active] += np.sum(mc.sample_integrand(
+                    rel_surf[active], kind, rel_src[active], src_bnds[active],
+                    unit), axis=1)
+        counts[active] = replicas*num_pts
+        means = sums[:, active]/num_pts
+        weights[active] = np.mean(means, axis=0)
+        errors[active] = np.std(means, axis=0, ddof=1)/np.sqrt(replicas)
+        done = ((errors[active] <= rtol*np.abs(weights[active]) + atol) |
+                (num_pts >= max_points))
+        active = active[np.logical_not(done)]
+        done_pts = num_pts
+        num_pts *= 2
+    return (weights, errors, counts)
+
+
+def calc_weights_qmc(input_list, sequence="sobol", rtol=mc.DEFAULT_RTOL,
+                     seed=mc.DEFAULT_SEED):
+    """Calculates the weights and their standard errors for a list of
+    detecting surface source pairs by grouping them by source kind and
+    integrating each group as a batch
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data,
+        as built by weight_calc.calculate_weights
+    sequence : str
+        One of SEQUENCES
+    rtol : float
+        The relative standard error at which a pair stops
+    seed : int or list of ints
+        The seed of the randomization of the replicas, the same seed and
+        input give the same weights
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry in input_list, in the same order
+    error_list : list of tuples
+        (pos_info, standard error) for every entry in input_list, in the same
+        order
+    count_list : list of tuples
+        (pos_info, number of points) for every entry in input_list, in the
+        same order
+    """
+    rng = np.random.RandomState(seed)
+    groups = {}
+    for i, data in enumerate(input_list):
+        groups.setdefault(data[2].get_batch_params()[0], []).append(i)
+    weights = np.zeros(len(input_list), dtype=np.float64)
+    errors = np.zeros(len(input_list), dtype=np.float64)
+    all_counts = np.zeros(len(input_list), dtype=np.int64)
+    for kind in sorted(groups):
+        inds = groups[kind]
+        surf_params, src_params = cub.stack_pairs([input_list[i][1:3]
+                                                   for i in inds])
+        weights[inds], errors[inds], counts = integrate_qmc(
+            surf_params, kind, src_params, sequence, rtol, rng=rng)
+        temp = "Sampled {0:d} {1:s} pairs with {2:s} points, {3:.0f} points "\
+            "per pair on average"
+        print temp.format(len(inds), gb.KIND_NAMES[kind], sequence,
+                          np.mean(counts))
+        all_counts[inds] = counts
+    return ([(data[0], weights[i]) for i, data in enumerate(input_list)],
+            [(data[0], errors[i]) for i, data in enumerate(input_list)],
+            [(data[0], all_counts[i]) for i, data in enumerate(input_list)])
@@ -0,0 +1,168 @@
+"""This file contains the cost model based scheduling of the backend
+integrations. The cost of a pair (the backend's integrand evaluation count)
+is learned per source class, visibility, and distance band, the pairs are
+handed out longest first in chunks that shrink as the remaining work does
+(guided scheduling) and the model is saved between runs"""
+
+import os
+import json
+import numpy as np
+import libpd.geom_base as gb
+import libpd.multipole as mpole
+
+# the predicted evaluation count of a pair nothing is known about
+DEFAULT_COST = 1000.0
+# the distance bands are floor(log2(distance/size)) clipped to these limits
+MIN_BAND = -2
+MAX_BAND = 12
+# each chunk holds about 1/(CHUNK_FACTOR*num_cores) of the remaining work
+CHUNK_FACTOR = 2
+# the largest number of pairs in a chunk (one batched backend call per source
+# kind)
+MAX_CHUNK_SIZE = 2048
+
+
+def pair_features(surface, source, vis):
+    """Returns the key of the cost model bin of a surface source pair
+
+    Parameters
+    ----------
+    surface : libpd.detector.DetectingSurface
+        The detector's detection surface
+    source : libpd.geom_base.Shape
+        The source geometry
+    vis : int
+        The visibility of the source from the surface, see
+        weight_calc.plane_visibility
+
+    Returns
+    -------
+    key : str
+        "class|visibility|distance band"
+    """
+    surf_params = surface.get_batch_params()[1]
+    kind, src_params = source.get_batch_params()
+    size = (mpole.batch_moments(gb.KIND_PARALLELOGRAM,
+                                surf_params[np.newaxis])[2][0] +
+            mpole.batch_moments(kind, src_params[np.newaxis])[2][0])
+    dist = np.linalg.norm(src_params[0] - surf_params[0])
+    band = MAX_BAND
+    if dist < size*2.0**MAX_BAND:
+        band = MIN_BAND
+        if dist > size*2.0**MIN_BAND:
+            band = int(np.floor(np.log2(dist/size)))
+    return "{0:s}|{1:d}|{2:d}".format(source.get_class_name(), vis, band)
+
+
+class CostModel(object):
+    """This class holds the running mean of the log of the evaluation counts
+    of every bin of pairs"""
+    def __init__(self, path=None):
+        """Loads the model, if there is a saved one
+
+        Parameters
+        ----------
+        path : str
+            The path to the JSON file of the model, if None the model is not
+            saved
+        """
+        self.path = path
+        self.stats = {}
+        # the total evaluation count of the updates since the model was made
+        self.evals = 0.0
+        if path is not None and os.path.exists(path):
+            with open(path) as in_file:
+                self.stats = json.load(in_file)
+
+    def predict(self, keys):
+        """Predicts the evaluation counts of pairs, bins that have not been
+        seen use the mean of their source class, or DEFAULT_COST
+
+        Parameters
+        ----------
+        keys : list of str
+            The bin keys of the pairs, see pair_features
+
+        Returns
+        -------
+        costs : numpy array
+            The predicted evaluation counts
+        """
+        class_stats = {}
+        for key, (count, mean) in self.stats.items():
+            name = key.split("|")[0]
+            prev = class_stats.get(name, (0, 0.0))
+            class_stats[name] = (prev[0] + count, prev[1] + count*mean)
+        costs = np.full(len(keys), DEFAULT_COST)
+        for i, key in enumerate(keys):
+            if key in self.stats:
+                costs[i] = np.exp(self.stats[key][1])
+            elif key.split("|")[0] in class_stats:
+                count, total = class_stats[key.split("|")[0]]
+                costs[i] = np.exp(total/count)
+        return costs
+
+    def update(self, key, evals):
+        """Adds an observed evaluation count to the bin of a pair
+
+        Parameters
+        ----------
+        key : str
+            The bin key of the pair
+        evals : float
+            The number of integrand evaluations the backend made
+        """
+        self.evals += evals
+        count, mean = self.stats.get(key, (0, 0.0))
+        count += 1
+        mean += (np.log(max(evals, 1.0)) - mean)/count
+        self.stats[key] = (count, mean)
+
+    def save(self):
+        """Writes the model to its file, if it has one"""
+        if self.path is None:
+            return
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as out_file:
+            json.dump(self.stats, out_file, indent=1, sort_keys=True)
+        os.rename(temp_path, self.path)
+
+
+def make_chunks(costs, num_cores, factor=CHUNK_FACTOR,
+                max_size=MAX_CHUNK_SIZE):
+    """Orders pairs longest first and groups them into chunks that each hold
+    about 1/(factor*num_cores) of the remaining predicted work
+
+    Parameters
+    ----------
+    costs : numpy array
+        The predicted costs of the pairs
+    num_cores : int
+        The number of workers
+    factor : int
+        The number of chunks per worker the remaining work is split into
+    max_size : int
+        The largest number of pairs in a chunk
+
+    Returns
+    -------
+    chunks : list of lists of ints
+        The indices of the pairs in every chunk, in the order they should be
+        handed out
+    """
+    order = np.argsort(-costs, kind="mergesort")
+    remaining = np.sum(costs)
+    chunks = []
+    start = 0
+    while start < len(order):
+        target = remaining/float(factor*num_cores)
+        stop = start + 1
+        total = costs[order[start]]
+        while (stop < len(order) and stop - start < max_size and
+               total + costs[order[stop]] <= target):
+            total += costs[order[stop]]
+            stop += 1
+        chunks.append([int(x) for x in order[start:stop]])
+        remaining -= total
+        start = stop
+    return chunks
@@ -0,0 +1,367 @@
+"""This file contains the sharded weight calculation, for spreading one
+calculation across many hosts that share a directory. A planner splits the
+detecting surface x source product into shards (ranges of the pair numbering
+of weight_calc.calculate_weights) and writes a manifest per shard into the
+queue directory, any number of workers on any hosts claim shards by renaming
+their manifests into the claimed directory (a rename is atomic, so exactly
+one worker gets each shard) and write a partial weight tensor per shard, and
+the merge step sums the partial tensors into the final one"""
+
+import os
+import json
+import time
+import socket
+import cPickle
+import threading
+import numpy as np
+import libpd.weight_calc as wc
+import libpd.source_table as st
+
+# the file holding the pickled geometry and settings of the calculation
+JOB_FILE = "job.pkl"
+# the directories of the manifests of the shards in each state
+QUEUE_DIR = "queue"
+CLAIMED_DIR = "claimed"
+DONE_DIR = "done"
+# the directory of the per shard checkpoint files, see weight_calc
+PARTIAL_DIR = "partial"
+# the directory of the partial weight tensors
+RESULTS_DIR = "results"
+# the format of the shard names
+SHARD_NAME = "shard_{0:05d}"
+# the extensions of the manifests, checkpoints, and partial results
+MANIFEST_EXT = ".json"
+CHECKPOINT_EXT = ".ckpt"
+RESULT_EXT = ".npz"
+# how often (in seconds) a worker refreshes the modification time of its claim
+# while it calculates the shard, claims are only stale after several times
+# this (see release_stale_claims)
+HEARTBEAT_SECONDS = 60.0
+
+
+def shard_path(shard_dir, state, name, ext=MANIFEST_EXT):
+    """Returns the path of a file of a shard
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+    state : str
+        The subdirectory, one of the *_DIR constants
+    name : str
+        The name of the shard
+    ext : str
+        The extension of the file
+
+    Returns
+    -------
+    path : str
+        The path
+    """
+    return os.path.join(shard_dir, state, name + ext)
+
+
+def plan_shards(shard_dir, detectors, sources, num_shards, settings=None):
+    """Writes the job file and the manifest of every shard of a calculation
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation, it must not hold another
+        calculation
+    detectors : list of libpd.detector.Detector classes
+        The detectors of the calculation
+    sources : list of Shapes or SourceTables
+        The sources of the calculation, see calculate_weights
+    num_shards : int
+        The number of shards to split the pairs into
+    settings : dict
+        Keyword arguments passed on to calculate_weights by the workers,
+        e.g. integrator and far_tol
+
+    Returns
+    -------
+    names : list of str
+        The names of the shards
+    """
+    if os.path.exists(os.path.join(shard_dir, JOB_FILE)):
+        temp = "{0:s} already holds a sharded calculation"
+        raise ValueError(temp.format(shard_dir))
+    num_surfs = sum([len(x.get_detecting_surfaces()) for x in detectors])
+    num_pairs = num_surfs*sum([len(x) for x in st.as_tables(sources)])
+    bounds = np.linspace(0, num_pairs, num_shards + 1).round().astype(int)
+    names = [SHARD_NAME.format(i) for i in range(num_shards)]
+    for state in [QUEUE_DIR, CLAIMED_DIR, DONE_DIR, PARTIAL_DIR, RESULTS_DIR]:
+        if not os.path.isdir(os.path.join(shard_dir, state)):
+            os.makedirs(os.path.join(shard_dir, state))
+    job = {"detectors": detectors, "sources": sources, "names": names,
+           "settings": (settings if settings is not None else {})}
+    write_atomic(os.path.join(shard_dir, JOB_FILE),
+                 cPickle.dumps(job, cPickle.HIGHEST_PROTOCOL))
+    for i, name in enumerate(names):
+        manifest = {"name": name, "start": int(bounds[i]),
+                    "stop": int(bounds[i+1])}
+        write_atomic(shard_path(shard_dir, QUEUE_DIR, name),
+                     json.dumps(manifest, sort_keys=True))
+    temp = "Planned {0:d} pairs in {1:d} shards in {2:s}"
+    print temp.format(num_pairs, num_shards, shard_dir)
+    return names
+
+
+def write_atomic(path, data):
+    """Writes a file so that readers never see it partially written
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    data : str
+        The contents of the file
+    """
+    temp_path = "{0:s}.{1:s}.{2:d}.tmp".format(path, socket.gethostname(),
+                                               os.getpid())
+    with open(temp_path, "wb") as out_file:
+        out_file.write(data)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+    os.rename(temp_path, path)
+
+
+def claim_shard(shard_dir):
+    """Claims the next unclaimed shard
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+
+    Returns
+    -------
+    manifest : dict
+        The manifest of the claimed shard, None if the queue is empty
+    """
+    for fname in sorted(os.listdir(os.path.join(shard_dir, QUEUE_DIR))):
+        if not fname.endswith(MANIFEST_EXT):
+            continue
+        name = fname[:-len(MANIFEST_EXT)]
+        claimed = shard_path(shard_dir, CLAIMED_DIR, name)
+        try:
+            os.rename(shard_path(shard_dir, QUEUE_DIR, name), claimed)
+        except OSError:
+            # another worker claimed it first
+            continue
+        # the claim time is the modification time, see release_stale_claims
+        os.utime(claimed, None)
+        with open(claimed) as in_file:
+            return json.load(in_file)
+    return None
+
+
+def refresh_claim(claimed, stop, interval=HEARTBEAT_SECONDS):
+    """Refreshes the modification time of a claim until stop is set, so the
+    claim of a shard that is still being calculated does not become stale,
+    meant to run in a thread of the worker
+
+    Parameters
+    ----------
+    claimed : str
+        The path to the claimed manifest
+    stop : threading.Event
+        Set when the shard is finished
+    interval : float
+        The time (in seconds) between refreshes
+    """
+    while not stop.wait(interval):
+        try:
+            os.utime(claimed, None)
+        except OSError:
+            # the claim was released or finished by another worker
+            return
+
+
+def finish_shard(shard_dir, name, tensor, det_nums, run_nums, src_names):
+    """Writes the partial weight tensor of a shard and marks it done, unless
+    another worker (given the shard after its claim was released as stale)
+    finished it first, in which case that worker's result is kept
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+    name : str
+        The name of the shard
+    tensor : numpy array
+        The partial weight tensor
+    det_nums : list of ints
+        The det number of each index of the first axis
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis
+
+    Returns
+    -------
+    finished : bool
+        False if another worker finished the shard first
+    """
+    claimed = shard_path(shard_dir, CLAIMED_DIR, name)
+    done = shard_path(shard_dir, DONE_DIR, name)
+    if not os.path.exists(claimed) and os.path.exists(done):
+        return False
+    result_path = shard_path(shard_dir, RESULTS_DIR, name, RESULT_EXT)
+    temp_path = "{0:s}.{1:s}.{2:d}.tmp{3:s}".format(
+        result_path[:-len(RESULT_EXT)], socket.gethostname(), os.getpid(),
+        RESULT_EXT)
+    np.savez(temp_path, weights=tensor, det_nums=np.array(det_nums),
+             run_nums=np.array(run_nums), src_names=np.array(src_names))
+    os.rename(temp_path, result_path)
+    try:
+        os.rename(claimed, done)
+    except OSError:
+        # another worker finished at the same time, both results are complete
+        pass
+    try:
+        os.remove(shard_path(shard_dir, PARTIAL_DIR, name, CHECKPOINT_EXT))
+    except OSError:
+        pass
+    return True
+
+
+def run_worker(shard_dir, num_cores=1, cache_path=None):
+    """Claims and calculates shards until the queue is empty
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+    num_cores : int
+        Number of cores to spread the calculation of each shard across
+    cache_path : str
+        If not None, the path to a weight cache of this worker
+
+    Returns
+    -------
+    names : list of str
+        The names of the shards calculated by this worker
+    """
+    with open(os.path.join(shard_dir, JOB_FILE), "rb") as in_file:
+        job = cPickle.load(in_file)
+    names = []
+    manifest = claim_shard(shard_dir)
+    while manifest is not None:
+        name = manifest["name"]
+        temp = "Worker {0:s}:{1:d} calculating {2:s}, pairs {3:d} to {4:d}"
+        print temp.format(socket.gethostname(), os.getpid(), name,
+                          manifest["start"], manifest["stop"])
+        # a shard that was released by a dead worker resumes from its
+        # checkpoint
+        ckpt_path = shard_path(shard_dir, PARTIAL_DIR, name, CHECKPOINT_EXT)
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=refresh_claim,
+                                     args=(shard_path(shard_dir, CLAIMED_DIR,
+                                                      name), stop))
+        heartbeat.daemon = True
+        heartbeat.start()
+        try:
+            result = wc.calculate_weights(
+                job["detectors"], job["sources"], num_cores,
+                cache_path=cache_path, checkpoint_path=ckpt_path,
+                resume=True, as_tensor=True,
+                pair_range=(manifest["start"], manifest["stop"]),
+                **job["settings"])
+        finally:
+            stop.set()
+            heartbeat.join()
+        if finish_shard(shard_dir, name, *result):
+            names.append(name)
+        else:
+            print "Shard {0:s} was finished first by another worker".format(
+                name)
+        manifest = claim_shard(shard_dir)
+    print "The queue is empty, calculated {0:d} shards".format(len(names))
+    return names
+
+
+def release_stale_claims(shard_dir, max_age):
+    """Puts shards that were claimed too long ago back in the queue, for
+    recovering the shards of workers that died, a released shard resumes
+    from its checkpoint
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+    max_age : float
+        The age (in seconds) of a claim after which it is stale, the claims
+        of running workers are refreshed every HEARTBEAT_SECONDS
+
+    Returns
+    -------
+    names : list of str
+        The names of the released shards
+    """
+    names = []
+    now = time.time()
+    for fname in sorted(os.listdir(os.path.join(shard_dir, CLAIMED_DIR))):
+        if not fname.endswith(MANIFEST_EXT):
+            continue
+        name = fname[:-len(MANIFEST_EXT)]
+        claimed = shard_path(shard_dir, CLAIMED_DIR, name)
+        try:
+            if now - os.path.getmtime(claimed) < max_age:
+                continue
+            os.rename(claimed, shard_path(shard_dir, QUEUE_DIR, name))
+        except OSError:
+            # the shard was finished in the meantime
+            continue
+        names.append(name)
+    print "Released {0:d} stale shards".format(len(names))
+    return names
+
+
+def merge_shards(shard_dir):
+    """Sums the partial weight tensors of every shard into the final one
+
+    Parameters
+    ----------
+    shard_dir : str
+        The shared directory of the calculation
+
+    Returns
+    -------
+    tensor : numpy array
+        (num dets, num runs, num sources) array of the weights, see
+        weight_calc.calculate_weights
+    det_nums : list of ints
+        The det number of each index of the first axis
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis
+    """
+    with open(os.path.join(shard_dir, JOB_FILE), "rb") as in_file:
+        names = cPickle.load(in_file)["names"]
+    missing = [x for x in names if not
+               os.path.exists(shard_path(shard_dir, RESULTS_DIR, x,
+                                         RESULT_EXT))]
+    if missing:
+        temp = "{0:d} shards are not finished, the first is {1:s}"
+        raise ValueError(temp.format(len(missing), missing[0]))
+    tensor = None
+    for name in names:
+        with np.load(shard_path(shard_dir, RESULTS_DIR, name,
+                                RESULT_EXT)) as data:
+            part = data["weights"]
+            if tensor is None:
+                tensor = part
+                det_nums = [int(x) for x in data["det_nums"]]
+                run_nums = [int(x) for x in data["run_nums"]]
+                src_names = [str(x) for x in data["src_names"]]
+                continue
+        # a combination is NaN only if no shard had any of its pairs
+        both = np.logical_not(np.isnan(tensor) | np.isnan(part))
+        tensor[both] += part[both]
+        only_part = np.isnan(tensor) & np.logical_not(np.isnan(part))
+        tensor[only_part] = part[only_part]
+    print "Merged {0:d} shards from {1:s}".format(len(names), shard_dir)
+    return (tensor, det_nums, run_nums, src_names)
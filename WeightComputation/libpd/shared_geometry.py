@@ -0,0 +1,163 @@
+"""This file contains the shared memory geometry tables of the process pool.
+The parent places the batch parameters of every distinct detecting surface
+and source, and the surface and source index of every pair, in shared arrays
+once before the pool is started, the forked workers attach to them, and the
+tasks sent to the workers are only arrays of pair indices"""
+
+import ctypes as ct
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+import libpd.detector as dt
+import libpd.source_table as st
+
+# the number of doubles of the batch parameters of a surface or source
+NUM_GEOM_PARAMS = 12
+
+
+def shared_array(ctype, values):
+    """Copies values into a new shared (unsynchronized) array
+
+    Parameters
+    ----------
+    ctype : ctypes type
+        The element type of the array
+    values : numpy array
+        The values, flattened into the array
+
+    Returns
+    -------
+    arr : multiprocessing.sharedctypes.RawArray
+        The shared array
+    """
+    values = np.asarray(values).ravel()
+    arr = RawArray(ctype, max(values.size, 1))
+    np.ctypeslib.as_array(arr)[:values.size] = values
+    return arr
+
+
+class SharedGeometry(object):
+    """This class holds the geometry of a list of surface source pairs in
+    shared arrays and rebuilds the data tuples of the pairs from them"""
+    def __init__(self, input_list):
+        """Places the geometry of the pairs in shared arrays
+
+        Parameters
+        ----------
+        input_list : list of tuples
+            The list of detecting surface source pairs and their associated
+            data
+        """
+        surf_ind = {}
+        src_ind = {}
+        surfaces = []
+        sources = []
+        pairs = np.zeros((len(input_list), 5), dtype=np.int32)
+        for i, data in enumerate(input_list):
+            if id(data[1]) not in surf_ind:
+                surf_ind[id(data[1])] = len(surfaces)
+                surfaces.append(data[1])
+            if id(data[2]) not in src_ind:
+                src_ind[id(data[2])] = len(sources)
+                sources.append(data[2])
+            pairs[i] = (surf_ind[id(data[1])], src_ind[id(data[2])],
+                        data[0][0], data[0][1], data[0][2])
+        src_batch = [x.get_batch_params() for x in sources]
+        self.class_names = sorted(set([x.get_class_name() for x in sources]))
+        class_ind = dict((x, i) for i, x in enumerate(self.class_names))
+        self.num_pairs = len(input_list)
+        self.num_surfaces = len(surfaces)
+        self.num_sources = len(sources)
+        self.surf_arr = shared_array(ct.c_double, [x.get_batch_params()[1] for
+                                                   x in surfaces])
+        self.src_arr = shared_array(ct.c_double, [x[1] for x in src_batch])
+        self.src_kinds = shared_array(ct.c_int, [x[0] for x in src_batch])
+        self.src_classes = shared_array(ct.c_int, [class_ind[x.get_class_name()]
+                                                   for x in sources])
+        self.pair_arr = shared_array(ct.c_int, pairs)
+        # the names are only read, so the forked workers share the parent's
+        # copy of the list
+        self.src_names = [x.name for x in sources]
+        # the few sources the backend cannot rebuild from their parameters
+        # are kept as objects
+        self.extras = dict((i, x) for i, x in enumerate(sources) if not
+                           st.has_backend_shape(src_batch[i][0],
+                                                src_batch[i][1]))
+        self.surfaces = {}
+        self.sources = {}
+
+    def attach(self):
+        """Makes the numpy views of the shared arrays, called in the worker"""
+        self.surf_params = np.ctypeslib.as_array(self.surf_arr)[
+            :NUM_GEOM_PARAMS*self.num_surfaces].reshape((-1, 4, 3))
+        self.src_params = np.ctypeslib.as_array(self.src_arr)[
+            :NUM_GEOM_PARAMS*self.num_sources].reshape((-1, 4, 3))
+        self.kinds = np.ctypeslib.as_array(self.src_kinds)
+        self.classes = np.ctypeslib.as_array(self.src_classes)
+        self.pairs = np.ctypeslib.as_array(self.pair_arr)[
+            :5*self.num_pairs].reshape((-1, 5))
+        self.surfaces = {}
+        self.sources = {}
+
+    def get_surface(self, index):
+        """Returns the detecting surface with an index, built from the shared
+        parameters on first use
+
+        Parameters
+        ----------
+        index : int
+            The surface index
+
+        Returns
+        -------
+        surface : libpd.detector.DetectingSurface
+            The surface
+        """
+        if index not in self.surfaces:
+            params = self.surf_params[index]
+            self.surfaces[index] = dt.DetectingSurface(params[0], params[1],
+                                                       params[2], params[3])
+        return self.surfaces[index]
+
+    def get_source(self, index):
+        """Returns the source with an index, built from the shared parameters
+        on first use
+
+        Parameters
+        ----------
+        index : int
+            The source index
+
+        Returns
+        -------
+        source : libpd.geom_base.Shape
+            The source
+        """
+        if index not in self.sources:
+            if index in self.extras:
+                self.sources[index] = self.extras[index]
+            else:
+                self.sources[index] = st.TableSource(
+                    self.src_names[index], int(self.kinds[index]),
+                    self.src_params[index],
+                    self.class_names[self.classes[index]])
+        return self.sources[index]
+
+    def get_pairs(self, inds):
+        """Returns the data tuples of pairs
+
+        Parameters
+        ----------
+        inds : numpy array
+            The indices of the pairs in the input list
+
+        Returns
+        -------
+        data_list : list of tuples
+            (pos_info, surface, source) for every pair
+        """
+        data_list = []
+        for ind in inds:
+            surf, src, det, run, side = [int(x) for x in self.pairs[ind]]
+            data_list.append(((det, run, side, self.src_names[src]),
+                              self.get_surface(surf), self.get_source(src)))
+        return data_list
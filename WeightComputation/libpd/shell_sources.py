@@ -3,7 +3,12 @@ like cylinders"""
 
 import ctypes as ct
 import numpy as np
-from libpd.geom_base import Shape
+from libpd.geom_base import Shape, make_batch_params, KIND_CYLINDER
+
+X_AXIS = np.array([1.0, 0.0, 0.0], dtype=np.float64)
+Y_AXIS = np.array([0.0, 1.0, 0.0], dtype=np.float64)
+Z_AXIS = np.array([0.0, 0.0, 1.0], dtype=np.float64)
+
 
 class VertCylinder(Shape):
     """This class allows the creation of a flat patch, with some arbitrary
@@ -112,6 +117,22 @@ class VertCylinder(Shape):
         return lib.makeVertCylinder((self.center-offset).ctypes.data_as(ct.POINTER(ct.c_double)),
                                     self.rad, self.len)
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_CYLINDER
+        params : numpy array
+            4x3 array of center, the two radius vectors, and the half length
+            vector
+        """
+        return (KIND_CYLINDER, make_batch_params(self.center,
+                                                 self.rad*X_AXIS,
+                                                 self.rad*Y_AXIS, self.zvec))
+
     def __str__(self):
         """Returns the string representation of the object
 
@@ -244,6 +265,24 @@ class RotXaxisCylinder(Shape):
         return lib.makeRotXaxisCylinder(temp.ctypes.data_as(ct.POINTER(ct.c_double)),
                                         self.sizes[0], self.sizes[1], self.angle)
 
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            KIND_CYLINDER
+        params : numpy array
+            4x3 array of center, the two radius vectors, and the half length
+            vector (the cylinder axis is the x axis rotated about the z axis)
+        """
+        return (KIND_CYLINDER,
+                make_batch_params(self.center,
+                                  self.sizes[0]*self.rmat.dot(Y_AXIS),
+                                  self.sizes[0]*Z_AXIS,
+                                  self.rmat.dot(self.xvec)))
+
     def __str__(self):
         """Returns the string representation of the object
 
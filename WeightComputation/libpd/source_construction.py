@@ -6,6 +6,7 @@ import libpd.geom_base as gb
 import libpd.flat_sources as fs
 import libpd.shell_sources as ss
 import libpd.low_dim_sources as lds
+import libpd.source_table as st
 
 #      [MAX VALUE   , CENTER VALUE,     MIN VALUE]
 WALX = [2.54 * 800.0, 2.54 * 136.0, -2.54 * 528.0]
@@ -87,6 +88,22 @@ def set_up_all_sources():
     return src_list
 
 
+def set_up_source_tables():
+    """This function generates the same sources as set_up_all_sources, but
+    with the wall patches built directly as a source table instead of one
+    Square object per patch
+
+    Returns
+    -------
+    table_list : list of libpd.source_table.SourceTable
+        the tables of the sources, in the order of set_up_all_sources
+    """
+    table_list = [make_sectioned_cube_wall_table()]
+    table_list.extend(st.as_tables(make_point_sources()))
+    table_list.extend(st.as_tables(make_cube_edge_sources()))
+    return table_list
+
+
 def make_cube_wall_sources():
     """This function generates the sources that represent segments "walls"
     around the AD1 and position scan area
@@ -139,6 +156,34 @@ def make_sectioned_cube_wall_sources():
     return wall_list
 
 
+def make_sectioned_cube_wall_table():
+    """This function generates the same patches as
+    make_sectioned_cube_wall_sources, as a single source table
+
+    Returns
+    -------
+    wall_table : libpd.source_table.SourceTable
+        table of the square patches located at "Effective" walls
+    """
+    num_patches = len(WALL_DATA)*WALL_DIVS*WALL_DIVS
+    params = np.zeros((num_patches, 4, 3), dtype=np.float64)
+    names = []
+    offset = float(WALL_DIVS-1)/float(WALL_DIVS)
+    shifts = offset - np.arange(WALL_DIVS)*2.0/float(WALL_DIVS)
+    for k, (name, cent, edge1, edge2) in enumerate(WALL_DATA):
+        print "Making wall patches for:", name
+        block = params[k*WALL_DIVS*WALL_DIVS:(k+1)*WALL_DIVS*WALL_DIVS]
+        block = block.reshape((WALL_DIVS, WALL_DIVS, 4, 3))
+        block[:, :, 0, :] = (cent + shifts[:, np.newaxis, np.newaxis]*edge1 +
+                             shifts[np.newaxis, :, np.newaxis]*edge2)
+        block[:, :, 1, :] = edge1/float(WALL_DIVS)
+        block[:, :, 2, :] = edge2/float(WALL_DIVS)
+        names.extend([name + "_{0:d}_{1:d}".format(ind1, ind2)
+                      for ind1 in range(WALL_DIVS)
+                      for ind2 in range(WALL_DIVS)])
+    return st.SourceTable(gb.KIND_PARALLELOGRAM, params, names, "Square")
+
+
 def make_sixteenthed_cube_wall_sources():
     """This function generates the sixteenthed sources that represent "walls"
     around the AD1 and position scan area
@@ -0,0 +1,383 @@
+"""This file contains the structure of arrays source registry. A SourceTable
+holds every source of one kind of parameterization as one contiguous array of
+batch parameters (see geom_base.Shape.get_batch_params) and a list of names,
+so thousands of wall patches do not need thousands of Shape objects to be
+built and pickled. A row of a table is only turned into a (lightweight)
+TableSource when a single source is needed"""
+
+import ctypes as ct
+import numpy as np
+import libpd.geom_base as gb
+import libpd.multipole as mpole
+
+
+class TableSource(gb.Shape):
+    """This class is a single row of a SourceTable, it implements the Shape
+    interface from the batch parameters of the row"""
+    def __init__(self, name, kind, params, class_name):
+        """Creates the source from its batch parameters
+
+        Parameters
+        ----------
+        name : str
+            The name for this source
+        kind : int
+            One of the geom_base.KIND_* constants
+        params : numpy array
+            4x3 array of the batch parameters of the source
+        class_name : str
+            The name of the class of the shapes of the table
+        """
+        self.name = name
+        self.kind = kind
+        self.params = np.array(params, dtype=np.float64)
+        self.center = self.params[0]
+        self.class_name = class_name
+
+    def __reduce__(self):
+        """Pickles the source as its constructor arguments"""
+        return (TableSource, (self.name, self.kind, self.params,
+                              self.class_name))
+
+    def get_num_integral_params(self):
+        """Returns the number of parameters that will need to be integrated
+        over
+
+        Returns
+        -------
+        num_params : int
+            the number of parameters of the kind of the source
+        """
+        return len(gb.KIND_BOUNDS[self.kind])
+
+    def get_integral_bounds(self):
+        """Returns the bounds of each of the parameters to be integrated over
+
+        Returns
+        -------
+        bounds : list of tuples
+            the bounds of the parameters of the kind of the source
+        """
+        return list(gb.KIND_BOUNDS[self.kind])
+
+    def get_position(self, *args):
+        """Given a set of parameter values (in the same order as the bounds
+        array) this returns the x,y,z position corresponding to those bounds
+
+        Parameters
+        ----------
+        *args : vector
+            A list of integration parameters in the same order as the bounds
+            tuple
+
+        Returns
+        -------
+        position : vector
+            The position corresponding to those integration parameters
+        """
+        return gb.batch_positions(self.kind, self.params[np.newaxis],
+                                  args)[0, 0]
+
+    def get_area_element(self, *args):
+        """Given a set of parameter values (in the same order as the bounds
+        array) this returns the area scaling factor corresponding to those
+        parameters
+
+        Parameters
+        ----------
+        *args : vector
+            A list of integration parameters in the same order as the bounds
+            tuple
+
+        Returns
+        -------
+        area_scale : float
+            The area scaling factor
+        """
+        return gb.batch_area_elements(self.kind, self.params[np.newaxis],
+                                      args)[0, 0]
+
+    def make_backend_object(self, lib, offset):
+        """This function generates a void ptr for the right backend object
+
+        Parameters
+        ----------
+        lib : ctypes.cdll
+            The link to the backend library
+        offset : numpy vector
+            The center of the detector surface object to be subtracted from
+            this sources position
+
+        Returns
+        -------
+        src_obj : ctypes.c_void_p
+            The pointer to the source object
+        """
+        dptr = ct.POINTER(ct.c_double)
+        cent = np.ascontiguousarray(self.center - offset)
+        vecs = [np.ascontiguousarray(x) for x in self.params[1:]]
+        if self.kind == gb.KIND_POINT:
+            return lib.makePoint(cent.ctypes.data_as(dptr))
+        elif self.kind == gb.KIND_LINE:
+            strt = cent - vecs[0]
+            full = 2.0*vecs[0]
+            return lib.makeLine(strt.ctypes.data_as(dptr),
+                                full.ctypes.data_as(dptr))
+        elif self.kind == gb.KIND_PARALLELOGRAM:
+            return lib.makeSquare(cent.ctypes.data_as(dptr),
+                                  vecs[0].ctypes.data_as(dptr),
+                                  vecs[1].ctypes.data_as(dptr))
+        elif self.kind == gb.KIND_DISK:
+            rad = np.linalg.norm(vecs[0])
+            rmat = np.ascontiguousarray(np.column_stack(
+                (vecs[0]/rad, vecs[1]/rad, np.cross(vecs[0], vecs[1])/rad**2)))
+            return lib.makeCircle(cent.ctypes.data_as(dptr), rad,
+                                  rmat.ctypes.data_as(dptr))
+        elif has_backend_shape(self.kind, self.params):
+            # the remaining kind with a backend shape is the vertical cylinder
+            return lib.makeVertCylinder(cent.ctypes.data_as(dptr),
+                                        np.linalg.norm(vecs[0]),
+                                        abs(vecs[2][2]))
+        temp = "The backend has no {0:s} object for source {1:s}"
+        raise ValueError(temp.format(gb.KIND_NAMES[self.kind], self.name))
+
+    def get_batch_params(self):
+        """Returns the kind of parameterization and the stacked parameter
+        vectors used by the batched integrators
+
+        Returns
+        -------
+        kind : int
+            One of the KIND_* constants
+        params : numpy array
+            4x3 array of the batch parameters of the row
+        """
+        return (self.kind, self.params)
+
+    def get_class_name(self):
+        """Returns the name of the class of the shapes of the table
+
+        Returns
+        -------
+        class_name : str
+            The class name
+        """
+        return self.class_name
+
+
+class SourceTable(object):
+    """This class holds every source of one kind and class as contiguous
+    arrays of batch parameters and names"""
+    def __init__(self, kind, params, names, class_name, shapes=None):
+        """Creates the table
+
+        Parameters
+        ----------
+        kind : int
+            One of the geom_base.KIND_* constants
+        params : numpy array
+            (N, 4, 3) array of the batch parameters of the sources
+        names : list of str
+            The names of the sources
+        class_name : str
+            The name of the class of the sources, used to tell sources with
+            the same parameters apart (e.g. in weight_cache.pair_key)
+        shapes : list of libpd.geom_base.Shape
+            If the table was made from Shape objects, the objects, they are
+            used as the rows so the table behaves exactly like the list
+        """
+        self.kind = kind
+        self.params = np.ascontiguousarray(params, dtype=np.float64)
+        self.names = list(names)
+        self.class_name = class_name
+        self.shapes = shapes
+        self.name_index = dict((x, i) for i, x in enumerate(self.names))
+        self.boxes = None
+        self.radii_arr = None
+        self.rows = {}
+        if self.params.shape != (len(self.names), 4, 3):
+            raise ValueError("The parameters do not match the names")
+        if len(self.name_index) != len(self.names):
+            raise ValueError("The source names are not unique")
+
+    def __len__(self):
+        """Returns the number of sources in the table"""
+        return len(self.names)
+
+    def __getitem__(self, key):
+        """Returns a row (for an integer) or a sub-table (for a slice, boolean
+        mask, or array of indices)
+
+        Parameters
+        ----------
+        key : int, slice, or numpy array
+            The selection
+
+        Returns
+        -------
+        selection : TableSource or SourceTable
+            The row or the sub-table
+        """
+        if isinstance(key, (int, long, np.integer)):
+            return self.row(key)
+        inds = np.arange(len(self.names))[key]
+        shapes = None
+        if self.shapes is not None:
+            shapes = [self.shapes[i] for i in inds]
+        return SourceTable(self.kind, self.params[inds],
+                           [self.names[i] for i in inds], self.class_name,
+                           shapes)
+
+    def row(self, index):
+        """Returns a single source of the table, the same object is returned
+        every time the row is asked for
+
+        Parameters
+        ----------
+        index : int
+            The row number
+
+        Returns
+        -------
+        source : libpd.geom_base.Shape
+            The original shape if the table was made from shapes, otherwise a
+            TableSource
+        """
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError("Source table row out of range")
+        if self.shapes is not None:
+            return self.shapes[index]
+        if index not in self.rows:
+            self.rows[index] = TableSource(self.names[index], self.kind,
+                                           self.params[index], self.class_name)
+        return self.rows[index]
+
+    def select_prefix(self, prefix):
+        """Returns the sub-table of the sources whose names start with a prefix
+
+        Parameters
+        ----------
+        prefix : str
+            The start of the names to select
+
+        Returns
+        -------
+        table : SourceTable
+            The selected sources, in table order
+        """
+        return self[np.array([x.startswith(prefix) for x in self.names],
+                             dtype=bool)]
+
+    @property
+    def centers(self):
+        """(N, 3) view of the centers of the sources"""
+        return self.params[:, 0, :]
+
+    @property
+    def basis(self):
+        """(N, 3, 3) view of the parameterization vectors of the sources"""
+        return self.params[:, 1:, :]
+
+    @property
+    def radii(self):
+        """(N,) array of the largest distances from the centers to the
+        sources"""
+        if self.radii_arr is None:
+            self.radii_arr = mpole.batch_moments(self.kind, self.params)[2]
+        return self.radii_arr
+
+    def bounding_boxes(self):
+        """Returns the axis aligned bounding boxes of the sources
+
+        Returns
+        -------
+        boxes : numpy array
+            (N, 2, 3) array of the lower and upper corners of the boxes
+        """
+        if self.boxes is None:
+            self.boxes = gb.batch_bounding_boxes(self.kind, self.params)
+        return self.boxes
+
+
+def has_backend_shape(kind, params):
+    """Returns True if the backend can build a source from batch parameters
+    alone (see TableSource.make_backend_object and calcIntegralBatch), which
+    is every kind except cylinders whose axis is not the z axis
+
+    Parameters
+    ----------
+    kind : int
+        One of the geom_base.KIND_* constants
+    params : numpy array
+        4x3 array of the batch parameters of the source
+
+    Returns
+    -------
+    supported : bool
+        True if there is a backend shape for the parameters
+    """
+    if kind == gb.KIND_CYLINDER:
+        return params[3][0] == 0.0 and params[3][1] == 0.0
+    return kind in [gb.KIND_POINT, gb.KIND_LINE, gb.KIND_PARALLELOGRAM,
+                    gb.KIND_DISK]
+
+
+def table_from_shapes(shapes):
+    """Makes a table out of a list of shapes of the same kind and class
+
+    Parameters
+    ----------
+    shapes : list of libpd.geom_base.Shape
+        The shapes
+
+    Returns
+    -------
+    table : SourceTable
+        The table, whose rows are the shapes themselves
+    """
+    batch = [x.get_batch_params() for x in shapes]
+    kinds = set([x[0] for x in batch])
+    classes = set([x.get_class_name() for x in shapes])
+    if len(kinds) != 1 or len(classes) != 1:
+        raise ValueError("The shapes of a table must share a kind and class")
+    return SourceTable(batch[0][0], np.array([x[1] for x in batch]),
+                       [x.name for x in shapes], classes.pop(), list(shapes))
+
+
+def as_tables(sources):
+    """Converts the sources passed to weight_calc.calculate_weights into a
+    list of tables, keeping the order of the sources
+
+    Parameters
+    ----------
+    sources : SourceTable or list of SourceTables and Shapes
+        The sources, runs of consecutive shapes of the same kind and class
+        become one table
+
+    Returns
+    -------
+    tables : list of SourceTable
+        The tables
+    """
+    if isinstance(sources, SourceTable):
+        return [sources]
+    tables = []
+    run = []
+    for src in sources:
+        if isinstance(src, SourceTable):
+            if run:
+                tables.append(table_from_shapes(run))
+                run = []
+            tables.append(src)
+            continue
+        if run and (src.get_batch_params()[0] !=
+                    run[0].get_batch_params()[0] or
+                    src.get_class_name() != run[0].get_class_name()):
+            tables.append(table_from_shapes(run))
+            run = []
+        run.append(src)
+    if run:
+        tables.append(table_from_shapes(run))
+    return tables
@@ -0,0 +1,390 @@
+"""This file contains the surrogate of the weights of a detector as a function
+of its center. The weights of a detector at every source are integrated at the
+corners of a grid of cells covering the scan volume and interpolated
+(trilinearly) between them. A cell is split into eight when the interpolation
+of its corners misses the weights integrated at its center by more than the
+tolerance, so the grid is only fine where the weights change quickly (near the
+sources). The nodes lie on an integer lattice as fine as the deepest level, so
+nodes shared by neighbouring cells are only integrated once, and looking up
+the cell of a position takes one dictionary lookup per level"""
+
+import json
+import numpy as np
+import libpd.detector as dt
+import libpd.source_table as st
+import libpd.weight_calc as wc
+
+# the detector number of the detectors placed at the nodes, the weights of a
+# detector do not depend on its number
+NODE_DET_NUM = 0
+# the margin (in cm) added around the detector centers of a scan to make the
+# volume the surrogate covers
+VOLUME_PAD = 10.0
+# the number of cells along each axis of the coarsest grid
+BASE_DIVS = (2, 2, 2)
+# the relative error of the interpolation above which a cell is split and the
+# number of times a cell of the coarsest grid can be split
+DEFAULT_RTOL = 1.0e-2
+MAX_LEVEL = 5
+# weights smaller than this fraction of the largest weight of a node are held
+# to the tolerance of a weight of that size
+WEIGHT_FLOOR = 1.0e-3
+# the corners of a cell in units of its size
+CORNERS = np.array([[i, j, k] for i in (0, 1) for j in (0, 1)
+                    for k in (0, 1)], dtype=np.int64)
+
+
+def scan_volume(centers, pad=VOLUME_PAD):
+    """Returns the box around a set of detector centers
+
+    Parameters
+    ----------
+    centers : list of numpy arrays
+        The detector centers, e.g. from libpd.detector.read_positions
+    pad : float
+        The margin added on every side of the box
+
+    Returns
+    -------
+    low : numpy array
+        The lower corner of the box
+    high : numpy array
+        The upper corner of the box
+    """
+    centers = np.array(centers, dtype=np.float64)
+    return (centers.min(axis=0) - pad, centers.max(axis=0) + pad)
+
+
+def interpolation_error(interp, weights, rtol):
+    """Returns how far interpolated weights are from the integrated ones, in
+    units of the tolerance
+
+    Parameters
+    ----------
+    interp : numpy array
+        The interpolated weights of every source
+    weights : numpy array
+        The integrated weights of every source
+    rtol : float
+        The relative tolerance, see WEIGHT_FLOOR
+
+    Returns
+    -------
+    error : float
+        The largest error over the sources, above 1.0 the tolerance is missed
+    """
+    scale = np.maximum(np.abs(weights), WEIGHT_FLOOR*np.max(np.abs(weights)))
+    scale = np.maximum(rtol*scale, np.finfo(np.float64).tiny)
+    return np.max(np.abs(interp - weights)/scale)
+
+
+class WeightSurrogate(object):
+    """This class holds the integrated weights at the nodes of the grid and
+    interpolates the weights of detectors at other centers"""
+    def __init__(self, low, high, base_divs, max_level, src_names, node_keys,
+                 node_weights, leaves):
+        """Sets up the lookup of the cells and nodes of a grid
+
+        Parameters
+        ----------
+        low : numpy array
+            The lower corner of the volume
+        high : numpy array
+            The upper corner of the volume
+        base_divs : tuple of ints
+            The number of cells along each axis of the coarsest grid
+        max_level : int
+            The deepest level of the grid
+        src_names : list of str
+            The name of every source
+        node_keys : numpy array
+            (N, 3) lattice coordinates of the nodes
+        node_weights : numpy array
+            (N, number of sources) weights of the nodes
+        leaves : numpy array
+            (M, 4) level and index along each axis (at that level) of the
+            cells that are not split
+        """
+        self.low = np.asarray(low, dtype=np.float64)
+        self.high = np.asarray(high, dtype=np.float64)
+        self.base_divs = np.asarray(base_divs, dtype=np.int64)
+        self.max_level = int(max_level)
+        self.src_names = list(src_names)
+        self.node_keys = np.asarray(node_keys, dtype=np.int64)
+        self.node_weights = np.asarray(node_weights, dtype=np.float64)
+        self.leaves = np.asarray(leaves, dtype=np.int64).reshape(-1, 4)
+        self.num_steps = self.base_divs*2**self.max_level
+        self.step = (self.high - self.low)/self.num_steps
+        self.node_ind = dict((tuple(x), i) for i, x in
+                             enumerate(self.node_keys.tolist()))
+        self.leaf_set = set(tuple(x) for x in self.leaves.tolist())
+
+    def find_leaf(self, lattice_pos):
+        """Returns the cell that contains a position
+
+        Parameters
+        ----------
+        lattice_pos : numpy array
+            The position in lattice units, inside the volume
+
+        Returns
+        -------
+        level : int
+            The level of the cell
+        index : numpy array
+            The index of the cell along each axis at its level
+        """
+        for level in range(self.max_level + 1):
+            size = 2**(self.max_level - level)
+            index = np.minimum(np.floor(lattice_pos/size).astype(np.int64),
+                               self.base_divs*2**level - 1)
+            if (level,) + tuple(index.tolist()) in self.leaf_set:
+                return level, index
+        raise ValueError("No cell contains the lattice position " +
+                         str(lattice_pos))
+
+    def predict(self, centers):
+        """Interpolates the weights of detectors
+
+        Parameters
+        ----------
+        centers : numpy array
+            (N, 3) detector centers
+
+        Returns
+        -------
+        weights : numpy array
+            (N, number of sources) weights, positions outside the volume get
+            the weights of the nearest point of the volume
+        inside : numpy array
+            (N,) True for the centers inside the volume
+        """
+        centers = np.atleast_2d(np.asarray(centers, dtype=np.float64))
+        lattice = (centers - self.low)/self.step
+        inside = np.all(np.logical_and(lattice >= 0.0,
+                                       lattice <= self.num_steps), axis=1)
+        lattice = np.clip(lattice, 0.0, self.num_steps)
+        inds = np.zeros((len(centers), len(CORNERS)), dtype=np.int64)
+        fracs = np.zeros((len(centers), len(CORNERS)), dtype=np.float64)
+        for i, pos in enumerate(lattice):
+            level, index = self.find_leaf(pos)
+            size = 2**(self.max_level - level)
+            frac = pos/size - index
+            for j, corner in enumerate(CORNERS):
+                inds[i, j] = self.node_ind[tuple(((index + corner)*size)
+                                                 .tolist())]
+                fracs[i, j] = np.prod(np.where(corner == 1, frac, 1.0 - frac))
+        return (np.einsum("nc,ncs->ns", fracs, self.node_weights[inds]),
+                inside)
+
+    def predict_weights(self, positions):
+        """Interpolates the weights of the detectors of a position list in the
+        form calculate_weights returns them
+
+        Parameters
+        ----------
+        positions : list of tuples
+            (det num, run num, center) of every detector, see
+            libpd.detector.read_positions
+
+        Returns
+        -------
+        weights_matrix : list of tuples
+            (det num, run num, source name, weight) sorted by det num, run
+            num, and source name
+        inside : numpy array
+            True for the detectors whose center is inside the volume
+        """
+        weights, inside = self.predict([x[2] for x in positions])
+        order = sorted(range(len(positions)),
+                       key=lambda i: (positions[i][0], positions[i][1]))
+        return ([(positions[i][0], positions[i][1], name, weights[i, j])
+                 for i in order for j, name in
+                 sorted(enumerate(self.src_names), key=lambda x: x[1])],
+                inside)
+
+
+def integrate_nodes(keys, low, step, sources, num_cores, **calc_args):
+    """Integrates the weights of detectors centered on lattice points
+
+    Parameters
+    ----------
+    keys : list of tuples
+        The lattice coordinates of the points
+    low : numpy array
+        The lower corner of the volume
+    step : numpy array
+        The size of a lattice step along each axis
+    sources : list of source tables
+        The sources
+    num_cores : int
+        Number of cores to spread the computation across
+    calc_args : dict
+        Passed on to calculate_weights
+
+    Returns
+    -------
+    weights : numpy array
+        (number of keys, number of sources) weights
+    """
+    detectors = [dt.Detector(NODE_DET_NUM, i, low + np.array(x)*step) for
+                 i, x in enumerate(keys)]
+    return wc.calculate_weights(detectors, sources, num_cores,
+                                as_tensor=True, **calc_args)[0][0]
+
+
+def build_surrogate(low, high, sources, num_cores, rtol=DEFAULT_RTOL,
+                    base_divs=BASE_DIVS, max_level=MAX_LEVEL,
+                    integrator="backend", cache_path=None,
+                    cost_model_path=None, execution="process"):
+    """Integrates the weights on a grid that is refined until the
+    interpolation of every cell meets the tolerance at its center or the
+    cell is at the deepest level
+
+    Parameters
+    ----------
+    low : numpy array
+        The lower corner of the volume, see scan_volume
+    high : numpy array
+        The upper corner of the volume
+    sources : list of source classes derived from libpd.Shape
+        The sources, a libpd.source_table.SourceTable or a list of tables can
+        be passed instead
+    num_cores : int
+        Number of cores to spread the computation across
+    rtol : float
+        The relative tolerance of the interpolation, see interpolation_error
+    base_divs : tuple of ints
+        The number of cells along each axis of the coarsest grid
+    max_level : int
+        The number of times a cell of the coarsest grid can be split
+    integrator : str
+        One of weight_calc.INTEGRATORS
+    cache_path : str
+        If not None, the path to the weight cache
+    cost_model_path : str
+        If not None, the file the backend cost model is kept in
+    execution : str
+        One of weight_calc.EXECUTION_MODES
+
+    Returns
+    -------
+    surrogate : WeightSurrogate
+        The surrogate
+    max_error : float
+        The largest relative error of the interpolation found at the centers
+        of the cells that were not split
+    num_unresolved : int
+        The number of cells at the deepest level, their parents missed the
+        tolerance and they could not be tested
+    """
+    low = np.asarray(low, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    base_divs = np.asarray(base_divs, dtype=np.int64)
+    tables = st.as_tables(sources)
+    step = (high - low)/(base_divs*2**max_level)
+    calc_args = {"integrator": integrator, "cache_path": cache_path,
+                 "cost_model_path": cost_model_path, "execution": execution}
+    node_ind = {}
+    node_weights = []
+    leaves = []
+    max_error = 0.0
+    num_unresolved = 0
+    cells = [(0, np.array([i, j, k], dtype=np.int64)) for i in
+             range(base_divs[0]) for j in range(base_divs[1]) for k in
+             range(base_divs[2])]
+    while len(cells) != 0:
+        level = cells[0][0]
+        size = 2**(max_level - level)
+        # the corners of the cells, and their centers if they can be split
+        needed = set()
+        for _, index in cells:
+            needed.update([tuple((index*size + x*size).tolist()) for x in
+                           CORNERS])
+            if level < max_level:
+                needed.add(tuple((index*size + size//2).tolist()))
+        new_keys = sorted([x for x in needed if x not in node_ind])
+        if len(new_keys) != 0:
+            node_weights.extend(integrate_nodes(new_keys, low, step, tables,
+                                                num_cores, **calc_args))
+            for key in new_keys:
+                node_ind[key] = len(node_ind)
+        if level == max_level:
+            leaves.extend([(level,) + tuple(x.tolist()) for _, x in cells])
+            num_unresolved = len(cells)
+            print "Level {0:d}: {1:d} cells, {2:d} nodes integrated".format(
+                level, len(cells), len(new_keys))
+            break
+        split = []
+        for _, index in cells:
+            corners = [node_weights[node_ind[tuple((index*size +
+                                                    x*size).tolist())]]
+                       for x in CORNERS]
+            center = node_weights[node_ind[tuple((index*size +
+                                                  size//2).tolist())]]
+            error = interpolation_error(np.mean(corners, axis=0), center,
+                                        rtol)
+            if error > 1.0:
+                split.extend([(level + 1, 2*index + x) for x in CORNERS])
+            else:
+                leaves.append((level,) + tuple(index.tolist()))
+                max_error = max(max_error, error*rtol)
+        temp = "Level {0:d}: {1:d} cells, {2:d} nodes integrated, {3:d} "\
+            "cells split"
+        print temp.format(level, len(cells), len(new_keys),
+                          len(split)//len(CORNERS))
+        cells = split
+    keys = sorted(node_ind, key=lambda x: node_ind[x])
+    src_names = [x for table in tables for x in table.names]
+    return (WeightSurrogate(low, high, base_divs, max_level, src_names,
+                            np.array(keys, dtype=np.int64),
+                            np.array(node_weights, dtype=np.float64),
+                            np.array(leaves, dtype=np.int64)),
+            max_error, num_unresolved)
+
+
+def write_surrogate(path, surrogate, metadata=None):
+    """Writes a surrogate to a .npz file
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+    surrogate : WeightSurrogate
+        The surrogate
+    metadata : dict
+        Anything JSON serializable to store with the surrogate, e.g. the
+        integrator settings
+    """
+    np.savez(path, low=surrogate.low, high=surrogate.high,
+             base_divs=surrogate.base_divs,
+             max_level=np.array(surrogate.max_level),
+             src_names=np.array(surrogate.src_names, dtype=np.str_),
+             node_keys=surrogate.node_keys,
+             node_weights=surrogate.node_weights, leaves=surrogate.leaves,
+             metadata=np.array(json.dumps(metadata if metadata is not None
+                                          else {}, sort_keys=True)))
+
+
+def read_surrogate(path):
+    """Reads a surrogate written by write_surrogate
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    surrogate : WeightSurrogate
+        The surrogate
+    metadata : dict
+        The metadata stored with it
+    """
+    archive = np.load(path)
+    return (WeightSurrogate(archive["low"], archive["high"],
+                            archive["base_divs"], int(archive["max_level"]),
+                            [str(x) for x in archive["src_names"]],
+                            archive["node_keys"], archive["node_weights"],
+                            archive["leaves"]),
+            json.loads(str(archive["metadata"])))
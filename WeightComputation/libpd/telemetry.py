@@ -0,0 +1,157 @@
+"""This file contains the telemetry of the backend integrations. The statistics
+the backend returns for every pair (recursion depth, single and all axis
+recursions, and integrand evaluations) and the wall time of the pair are kept
+as records, one JSON object per line of the telemetry file, together with the
+source class, visibility, and distance band of the pair (see
+libpd.scheduler.pair_features), and the records are aggregated into a report
+of where the integration time goes"""
+
+import os
+import json
+import numpy as np
+
+# the backend statistics of a pair, in the order they are stored in the
+# statistics arrays passed around by weight_calc, the wall time is last
+STAT_FIELDS = ["depth", "single_axis", "all_axis", "evals", "seconds"]
+# the number of (source class, distance band) bins listed in the report
+NUM_HOTSPOTS = 10
+
+
+def read_telemetry(path):
+    """Reads the complete records of a telemetry file
+
+    Parameters
+    ----------
+    path : str
+        The path to the telemetry file
+
+    Returns
+    -------
+    records : list of dicts
+        The records of the pairs, in the order they were written
+    """
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path) as in_file:
+        for line in in_file:
+            # a line without a newline was cut off when the run was killed
+            if not line.endswith("\n"):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+class TelemetryLog(object):
+    """This class writes the telemetry records of the pairs of a calculation
+    to the telemetry file as they are finished and keeps them for the
+    report"""
+    def __init__(self, path, resume=False):
+        """Opens the telemetry file, emptying it unless a run is resumed
+
+        Parameters
+        ----------
+        path : str
+            The path to the telemetry file
+        resume : bool
+            If True, the records are appended to those the interrupted run
+            wrote, otherwise the records of an earlier run are removed so a
+            rerun does not count its pairs twice
+        """
+        self.path = path
+        self.records = []
+        self.out_file = open(path, ("a" if resume else "w"))
+
+    def add(self, pos_info, key, stats):
+        """Records the backend statistics of a pair
+
+        Parameters
+        ----------
+        pos_info : tuple
+            (det num, run num, side, source name) of the pair
+        key : str
+            The cost model bin of the pair, "class|visibility|distance band"
+        stats : numpy array
+            The values of STAT_FIELDS of the pair
+        """
+        src_class, vis, band = key.split("|")[:3]
+        record = {"det": pos_info[0], "run": pos_info[1], "side": pos_info[2],
+                  "source": pos_info[3], "class": src_class, "vis": int(vis),
+                  "band": int(band)}
+        for name, value in zip(STAT_FIELDS, stats):
+            record[name] = float(value)
+        self.records.append(record)
+        self.out_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+    def close(self):
+        """Closes the file, the records are written as they are added"""
+        self.out_file.close()
+
+
+def summarize(records, fields=("class",)):
+    """Aggregates records into bins
+
+    Parameters
+    ----------
+    records : list of dicts
+        The telemetry records
+    fields : tuple of str
+        The record fields whose values make up the bin of a record
+
+    Returns
+    -------
+    summary : list of tuples
+        (bin, number of pairs, seconds, evaluations, mean depth, max depth)
+        for every bin, longest total time first
+    """
+    bins = {}
+    for record in records:
+        bins.setdefault(tuple(record[x] for x in fields), []).append(record)
+    summary = []
+    for key, members in bins.items():
+        depths = np.array([x["depth"] for x in members])
+        summary.append((key, len(members),
+                        sum([x["seconds"] for x in members]),
+                        sum([x["evals"] for x in members]),
+                        np.mean(depths), np.max(depths)))
+    summary.sort(key=lambda x: -x[2])
+    return summary
+
+
+def format_report(records, num_hotspots=NUM_HOTSPOTS):
+    """Makes the report of where the integration time of records goes, per
+    source class and for the most expensive source class and distance band
+    bins
+
+    Parameters
+    ----------
+    records : list of dicts
+        The telemetry records
+    num_hotspots : int
+        The number of (source class, distance band) bins to list
+
+    Returns
+    -------
+    lines : list of str
+        The lines of the report
+    """
+    total = sum([x["seconds"] for x in records])
+    scale = 100.0/total if total > 0.0 else 0.0
+    lines = ["Backend telemetry: {0:d} pairs, {1:.3f} s".format(len(records),
+                                                                 total)]
+    heading = "{0:>24s} {1:>8s} {2:>10s} {3:>6s} {4:>11s} {5:>11s} {6:>7s} "\
+        "{7:>5s}"
+    row = "{0:>24s} {1:8d} {2:10.3f} {3:6.1f} {4:11.4g} {5:11.4g} {6:7.2f} "\
+        "{7:5.0f}"
+    for title, fields, limit in [("Per source class", ("class",), None),
+                                 ("Hotspots (class, distance band)",
+                                  ("class", "band"), num_hotspots)]:
+        lines.append(title)
+        lines.append(heading.format("Bin", "Pairs", "Seconds", "%Time",
+                                    "Evals", "Evals/Pair", "Depth", "Max"))
+        for key, num, secs, evals, depth, max_depth in summarize(
+                records, fields)[:limit]:
+            lines.append(row.format("|".join([str(x) for x in key]), num,
+                                    secs, secs*scale, evals,
+                                    evals/float(num), depth, max_depth))
+    return lines
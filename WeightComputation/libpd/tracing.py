@@ -0,0 +1,220 @@
+"""This file contains the timeline tracing of the weight calculation. Every
+process keeps the spans (a name, the thread, and the start and stop times) it
+records in a buffer that is appended to a part file of its own now and then
+and when the process exits, at the end of the run the part files are merged
+into one file of Chrome trace events that chrome://tracing or the Perfetto UI
+show as a timeline, one row per worker process or thread"""
+
+import os
+import json
+import threading
+import multiprocessing
+
+# the number of spans a buffer holds before they are appended to its part
+# file
+FLUSH_SPANS = 4096
+# the extension of the part files, a part file is the trace file name, the
+# process id, and this extension
+PART_EXT = ".part"
+# the category of the trace events
+TRACE_CATEGORY = "weight_calc"
+
+
+class TraceBuffer(object):
+    """This class collects the spans of the threads of one process and
+    appends them to the part file of the process"""
+    def __init__(self, path):
+        """Starts an empty buffer, nothing is written until the first flush
+
+        Parameters
+        ----------
+        path : str
+            The path to the trace file the part files are merged into
+        """
+        self.path = path
+        self.pid = os.getpid()
+        self.process = multiprocessing.current_process().name
+        self.part_path = "{0:s}.{1:d}{2:s}".format(path, self.pid, PART_EXT)
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def span(self, name, start, stop, args=None):
+        """Records a span of the calling thread
+
+        Parameters
+        ----------
+        name : str
+            What happened in the span
+        start : float
+            The time (from time.time) the span started
+        stop : float
+            The time the span ended
+        args : dict
+            If not None, details of the span shown with it in the timeline
+        """
+        # under the lock so a span is not appended to the list a flush of
+        # another thread is taking
+        with self.lock:
+            self.spans.append((name, threading.current_thread().name, start,
+                               stop, args))
+            full = len(self.spans) >= FLUSH_SPANS
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Appends the buffered spans to the part file and empties the
+        buffer"""
+        with self.lock:
+            spans, self.spans = self.spans, []
+            if len(spans) == 0:
+                return
+            with open(self.part_path, "a") as out_file:
+                for name, thread, start, stop, args in spans:
+                    out_file.write(json.dumps({"name": name, "pid": self.pid,
+                                               "process": self.process,
+                                               "thread": thread,
+                                               "start": start, "stop": stop,
+                                               "args": args}) + "\n")
+
+
+def part_paths(path):
+    """Returns the part files of a trace file
+
+    Parameters
+    ----------
+    path : str
+        The path to the trace file
+
+    Returns
+    -------
+    paths : list of str
+        The paths of the part files that exist
+    """
+    dir_name, base = os.path.split(os.path.abspath(path))
+    return sorted([os.path.join(dir_name, x) for x in os.listdir(dir_name)
+                   if x.startswith(base + ".") and x.endswith(PART_EXT)])
+
+
+def remove_parts(path):
+    """Removes the part files of a trace file, such as those left by an
+    interrupted run
+
+    Parameters
+    ----------
+    path : str
+        The path to the trace file
+    """
+    for part in part_paths(path):
+        os.remove(part)
+
+
+def read_parts(path):
+    """Reads the spans of the part files of a trace file
+
+    Parameters
+    ----------
+    path : str
+        The path to the trace file
+
+    Returns
+    -------
+    spans : list of dicts
+        The spans of every process, those of a process in the order they
+        were recorded
+    """
+    spans = []
+    for part in part_paths(path):
+        with open(part) as in_file:
+            for line in in_file:
+                # a line without a newline was cut off when a worker died
+                if not line.endswith("\n"):
+                    break
+                spans.append(json.loads(line))
+    return spans
+
+
+def make_trace_events(spans):
+    """Converts spans to Chrome trace events, times are in microseconds from
+    the earliest span and every (process, thread) gets its own row
+
+    Parameters
+    ----------
+    spans : list of dicts
+        The spans, see read_parts
+
+    Returns
+    -------
+    events : list of dicts
+        The metadata events naming the rows followed by a complete ("X")
+        event per span
+    """
+    if len(spans) == 0:
+        return []
+    origin = min([x["start"] for x in spans])
+    tids = {}
+    events = []
+    for span in spans:
+        key = (span["pid"], span["thread"])
+        if key in tids:
+            continue
+        if span["pid"] not in [x[0] for x in tids]:
+            events.append({"name": "process_name", "ph": "M",
+                           "pid": span["pid"],
+                           "args": {"name": span["process"]}})
+        tids[key] = len(tids) + 1
+        events.append({"name": "thread_name", "ph": "M",
+                       "pid": span["pid"], "tid": tids[key],
+                       "args": {"name": span["thread"]}})
+    for span in spans:
+        event = {"name": span["name"], "cat": TRACE_CATEGORY, "ph": "X",
+                 "ts": 1.0e6*(span["start"] - origin),
+                 "dur": 1.0e6*(span["stop"] - span["start"]),
+                 "pid": span["pid"],
+                 "tid": tids[(span["pid"], span["thread"])]}
+        if span["args"] is not None:
+            event["args"] = span["args"]
+        events.append(event)
+    return events
+
+
+def summarize_spans(spans):
+    """Totals the time of the spans of every name
+
+    Parameters
+    ----------
+    spans : list of dicts
+        The spans, see read_parts
+
+    Returns
+    -------
+    summary : list of tuples
+        (name, number of spans, total seconds) for every name, longest total
+        first
+    """
+    totals = {}
+    for span in spans:
+        count, secs = totals.get(span["name"], (0, 0.0))
+        totals[span["name"]] = (count + 1, secs + span["stop"] - span["start"])
+    return sorted([(x, y[0], y[1]) for x, y in totals.items()],
+                  key=lambda x: -x[2])
+
+
+def merge_trace(path):
+    """Merges the part files of a trace file into it and removes them
+
+    Parameters
+    ----------
+    path : str
+        The path to the trace file
+
+    Returns
+    -------
+    spans : list of dicts
+        The spans that were merged
+    """
+    spans = read_parts(path)
+    with open(path, "w") as out_file:
+        json.dump({"traceEvents": make_trace_events(spans),
+                   "displayTimeUnit": "ms"}, out_file)
+    remove_parts(path)
+    return spans
@@ -0,0 +1,232 @@
+"""This file contains the on-disk cache of calculated weights. Entries are
+keyed by a hash of the geometry of a detecting surface source pair relative to
+the surface center and of the integrator settings, so reruns only need to
+integrate pairs that are new or have changed"""
+
+import os
+import hashlib
+import sqlite3
+import numpy as np
+
+# the number of decimal places (in cm) that relative positions and vectors are
+# rounded to before hashing, this absorbs floating point noise from building
+# the same geometry in different ways
+KEY_DECIMALS = 6
+# the number of inserts buffered by a process before they are written
+DEFAULT_FLUSH_SIZE = 1000
+# the number of keys per lookup query (below the sqlite parameter limit)
+LOOKUP_CHUNK = 500
+# how long (in seconds) a process waits for another to release the database
+LOCK_TIMEOUT = 600.0
+
+
+def relative_geometry(surface, source):
+    """Returns the canonical relative geometry of a surface source pair, the
+    source batch parameters with the surface center subtracted from the
+    source center, followed by the surface vectors and normal, rounded to
+    KEY_DECIMALS
+
+    Parameters
+    ----------
+    surface : libpd.detector.DetectingSurface
+        The detector's detection surface
+    source : libpd.geom_base.Shape
+        The source geometry
+
+    Returns
+    -------
+    geom : numpy array
+        7x3 array of the rounded relative geometry
+    """
+    surf_params = surface.get_batch_params()[1]
+    src_params = np.array(source.get_batch_params()[1], dtype=np.float64)
+    src_params[0] -= surf_params[0]
+    geom = np.concatenate((src_params, surf_params[1:]))
+    # adding zero turns negative zeros into positive ones
+    return np.round(geom, KEY_DECIMALS) + 0.0
+
+
+def pair_key(surface, source, settings=""):
+    """Returns the cache key of a surface source pair
+
+    Parameters
+    ----------
+    surface : libpd.detector.DetectingSurface
+        The detector's detection surface
+    source : libpd.geom_base.Shape
+        The source geometry
+    settings : str
+        The description of the integrator and its settings
+
+    Returns
+    -------
+    key : str
+        The binary digest identifying the integral
+    """
+    hasher = hashlib.sha1()
+    hasher.update(settings)
+    hasher.update(source.get_class_name())
+    hasher.update(relative_geometry(surface, source).tobytes())
+    return hasher.digest()
+
+
+class WeightCache(object):
+    """This class is the interface to the on-disk weight store, an sqlite
+    database with one (key, weight) row per integral. Each process opens its
+    own connection so the cache can be shared by the workers of a pool"""
+    def __init__(self, path, settings, flush_size=DEFAULT_FLUSH_SIZE):
+        """Creates the cache object (and the database if needed)
+
+        Parameters
+        ----------
+        path : str
+            The path to the database file
+        settings : str
+            The description of the integrator and its settings, included in
+            every key so results of different integrators never mix
+        flush_size : int
+            The number of inserts to buffer before writing them
+        """
+        self.path = path
+        self.settings = settings
+        self.flush_size = flush_size
+        self.pending = []
+        self.conn = None
+        self.pid = None
+        self.hits = 0
+        self.misses = 0
+        conn = self.get_connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS weights "
+                     "(key BLOB PRIMARY KEY, weight REAL)")
+        conn.commit()
+
+    def get_connection(self):
+        """Returns the database connection of the current process, opening a
+        new one after a fork
+
+        Returns
+        -------
+        conn : sqlite3.Connection
+            The connection to the database
+        """
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.pid = os.getpid()
+        return self.conn
+
+    def key(self, surface, source):
+        """Returns the cache key of a surface source pair
+
+        Parameters
+        ----------
+        surface : libpd.detector.DetectingSurface
+            The detector's detection surface
+        source : libpd.geom_base.Shape
+            The source geometry
+
+        Returns
+        -------
+        key : str
+            The binary digest identifying the integral
+        """
+        return pair_key(surface, source, self.settings)
+
+    def lookup(self, keys):
+        """Finds the cached weights for a list of keys
+
+        Parameters
+        ----------
+        keys : list of str
+            The keys to look up
+
+        Returns
+        -------
+        found : dict
+            Maps the keys that are in the cache to their weights
+        """
+        conn = self.get_connection()
+        found = {}
+        unique = list(set(keys))
+        for i in range(0, len(unique), LOOKUP_CHUNK):
+            chunk = unique[i:i+LOOKUP_CHUNK]
+            query = "SELECT key, weight FROM weights WHERE key IN ({0:s})"
+            query = query.format(",".join(["?"]*len(chunk)))
+            for key, weight in conn.execute(query, [sqlite3.Binary(x) for x
+                                                    in chunk]):
+                found[str(key)] = weight
+        return found
+
+    def split_input(self, input_list):
+        """Splits the list of surface source pairs into the ones that are
+        already cached and the ones that still need to be integrated
+
+        Parameters
+        ----------
+        input_list : list of tuples
+            The list of detecting surface source pairs and their associated
+            data
+
+        Returns
+        -------
+        todo_list : list of tuples
+            The entries of input_list that are not in the cache
+        weight_list : list of tuples
+            (pos_info, weight) for the entries that are in the cache
+        """
+        keys = [self.key(x[1], x[2]) for x in input_list]
+        found = self.lookup(keys)
+        todo_list = []
+        weight_list = []
+        for key, data in zip(keys, input_list):
+            if key in found:
+                weight_list.append((data[0], found[key]))
+            else:
+                todo_list.append(data)
+        self.hits += len(weight_list)
+        self.misses += len(todo_list)
+        return (todo_list, weight_list)
+
+    def add(self, surface, source, weight):
+        """Buffers the weight of a surface source pair for insertion
+
+        Parameters
+        ----------
+        surface : libpd.detector.DetectingSurface
+            The detector's detection surface
+        source : libpd.geom_base.Shape
+            The source geometry
+        weight : float
+            The calculated weight
+        """
+        self.pending.append((sqlite3.Binary(self.key(surface, source)),
+                             float(weight)))
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered inserts to the database in one transaction"""
+        if len(self.pending) == 0:
+            return
+        conn = self.get_connection()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO weights VALUES (?, ?)",
+                             self.pending)
+        self.pending = []
+
+    def print_stats(self):
+        """Prints the hit and miss statistics of the lookups so far"""
+        total = self.hits + self.misses
+        rate = (100.0*self.hits/total) if total > 0 else 0.0
+        temp = "Weight cache: {0:d} hits, {1:d} misses ({2:5.1f}% hit rate)"
+        print temp.format(self.hits, self.misses, rate)
+
+    def close(self):
+        """Writes any buffered inserts and closes the connection of this
+        process"""
+        if self.conn is not None and self.pid == os.getpid():
+            self.flush()
+            self.conn.close()
+        self.conn = None
+        self.pending = []
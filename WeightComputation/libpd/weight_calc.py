@@ -3,23 +3,99 @@ source, detector pair"""
 
 
 import copy as cp
+import cPickle
+import hashlib
+import json
+import os
 import multiprocessing
+import multiprocessing.util as mpu
+import multiprocessing.pool as mpp
+import threading
+import time
 import ctypes as ct
 import numpy as np
 from scipy import integrate as spi
 # from scipy import LowLevelCallable
 from libpd.detector import SimpleDetectingSurface
 import libpd.backend_interface as bi
+import libpd.cubature as cub
+import libpd.error_budget as eb
+import libpd.geom_base as gb
+import libpd.monte_carlo as mc
+import libpd.quasi_monte_carlo as qmc
+import libpd.analytic as ana
+import libpd.multipole as mpole
+import libpd.checkpoint as ckpt
+import libpd.scheduler as sched
+import libpd.source_table as st
+import libpd.shared_geometry as sg
+import libpd.telemetry as tel
+import libpd.tracing as trc
+import libpd.weight_cache as wcache
 
 # relocated to the bottom so the functions can be found
 # INT_FUNC = [integrand2d, integrand3d, integrand4d, integrand5d]
 INV_FOUR_PI = (1.0/(4.0*np.pi))
 NUM_BACKEND_OUT_PARAMS = 5
+# the number of backend statistics of a pair (see backend_result) and the
+# index of the integrand evaluation count among them
+NUM_STATS = len(tel.STAT_FIELDS)
+EVALS_STAT = tel.STAT_FIELDS.index("evals")
 FMT_STR = "{0:d}, {1:d}, {2:d}, {3:s}, {4:e}, {5:d}, {6:d}, {7:d}, {8:d}"
 HEADINGS = "Det, Run, Side, Source Name, Weight, Recursion Depth, Single Axis"\
     "Recursions, All Axis Recursions, Integrand Evaluations"
+# the integration engines that calculate_weights can use
+INTEGRATORS = ["backend", "cubature", "montecarlo", "qmc-sobol",
+               "qmc-halton"]
+# the integrators that sample points and estimate their standard errors, and
+# the low discrepancy sequence each uses (None for pseudo-random points)
+SAMPLING_INTEGRATORS = {"montecarlo": None, "qmc-sobol": "sobol",
+                        "qmc-halton": "halton"}
+# how the backend integrations are spread across cores, "process" uses a
+# worker process pool and "thread" a thread pool in this process (the backend
+# calls release the GIL)
+EXECUTION_MODES = ["process", "thread"]
+# the number of pairs handed to a worker at a time by the cubature engine
+CUBATURE_BLOCK_SIZE = 2048
+# the number of pairs handed to a worker at a time by the (quasi-)Monte Carlo
+# engines
+MONTE_CARLO_BLOCK_SIZE = 2048
+# appended to the integrator settings to make the cache settings of the
+# standard errors of the Monte Carlo weights
+ERROR_SETTINGS_SUFFIX = "-stderr"
+# the number of pairs per batched backend call of the single threaded path
+BACKEND_BLOCK_SIZE = 2048
+# a tag describing the compiled in settings of the backend, change it when the
+# backend's convergence parameters change so cached weights are not reused
+BACKEND_SETTINGS = "backend-v1"
+# the low discrepancy sequence that the pairs an error budget gives a looser
+# tolerance than the backend's are sampled with
+BUDGET_SEQUENCE = "sobol"
+# the visibility of a source from a detecting surface, see plane_visibility
+VIS_HIDDEN = 0
+VIS_PARTIAL = 1
+VIS_FULL = 2
+# the backend session of this process, see init_backend_session
+SESSION = None
+# the weight cache of this process, see init_weight_cache
+CACHE = None
+# the shared geometry of this worker process, see init_shared_worker
+GEOMETRY = None
+# the backend sessions of the threads of a thread pool, see init_thread_worker
+THREAD_STATE = threading.local()
+# the timeline trace buffer of this process, see init_trace
+TRACE = None
+# the process id and the exit functions registered for that process, see
+# register_exit_function (a forked worker inherits these but not the
+# registrations, which is why the process id is kept)
+EXIT_FUNCTIONS = (None, set())
 
-def calculate_weights(detectors, sources, num_cores):
+def calculate_weights(detectors, sources, num_cores, integrator="backend",
+                      cache_path=None, far_tol=None, checkpoint_path=None,
+                      resume=False, cost_model_path=None, as_tensor=False,
+                      execution="process", pair_range=None, mc_rtol=None,
+                      errors=False, error_budget=None, telemetry_path=None,
+                      trace_path=None, provenance=None):
     """This function calculates the weights for each source and detector
     surface pair in the detectors and sources arrays passed to it. If num_cores
     is greater than 1 it will also utilize the multiprocessing module to
@@ -30,34 +106,679 @@ def calculate_weights(detectors, sources, num_cores):
     detectors : list of libpd.detector.Detector classes
         List of detectors for weights to be calculated at
     sources : list of source classes derived from libpd.Shape
-        List of sources for weights at each detector to be calculated for
+        List of sources for weights at each detector to be calculated for, a
+        libpd.source_table.SourceTable or a list of tables can be passed
+        instead
     num_cores : int
         Number of cores to spread the computation across
+    integrator : str
+        Which integration engine to use, one of INTEGRATORS, "backend" uses
+        the C/C++ backend one pair at a time, "cubature" uses the batched
+        numpy engine in libpd.cubature and does not need the backend,
+        "montecarlo" uses the sampling engine in libpd.monte_carlo, and
+        "qmc-sobol" and "qmc-halton" the randomized quasi-Monte Carlo engine
+        in libpd.quasi_monte_carlo
+    cache_path : str
+        If not None, the path to the on-disk weight cache, pairs found there
+        are not integrated and newly integrated pairs are added to it
+    far_tol : float
+        If not None, fully visible pairs whose far field approximation (see
+        libpd.multipole) has an error bound below this relative tolerance use
+        that approximation instead of being integrated, except for the
+        sources of error_budget.needs_backend
+    checkpoint_path : str
+        If not None, weights are appended to this file as they are finished
+        and the returned weights are assembled from it
+    resume : bool
+        If True, pairs already in the checkpoint file are not calculated again
+    cost_model_path : str
+        If not None, the file the backend cost model (see libpd.scheduler) is
+        loaded from and saved to
+    as_tensor : bool
+        If True, return the weights as a dense tensor and its index maps
+        instead of a list of tuples
+    execution : str
+        One of EXECUTION_MODES, how the backend integrations are spread
+        across num_cores, ignored by the cubature integrator
+    pair_range : tuple of ints
+        If not None, (start, stop) of the pairs to calculate, the pairs are
+        numbered every source of the first detecting surface of the first
+        detector, then of its second surface, and so on (see libpd.sharding),
+        the weights of the other pairs are left out
+    mc_rtol : float
+        The relative standard error at which the sampling integrators stop
+        sampling a pair, monte_carlo.DEFAULT_RTOL if None
+    errors : bool
+        If True, also return the standard error of every weight, the errors of
+        the sampled weights are combined in quadrature over the detecting
+        surfaces, the weights of the other paths count as exact, it cannot
+        be used with a checkpoint
+    error_budget : float
+        If not None, the relative error allowed in the total weight of every
+        (detector, run), a cheap first pass estimates the weight of every
+        pair and the budget of each (detector, run) is split across its pairs
+        (see libpd.error_budget), the pairs that need the tolerance of the
+        backend are integrated by it and the rest are sampled by the
+        quasi-Monte Carlo engine to their tolerance, only used with the
+        backend integrator
+    telemetry_path : str
+        If not None, the backend statistics and wall time of every pair the
+        backend integrates are written to this file (appended to it when
+        resuming, see libpd.telemetry) and a report of where the integration
+        time went is printed
+    trace_path : str
+        If not None, the timeline of the backend integrations (the chunks and
+        batched backend calls of every worker, and for worker pools the time
+        chunks wait in the task queue and their results take to pickle) is
+        written to this file as Chrome trace events (see libpd.tracing)
+    provenance : dict
+        If not None, the integrators and settings the weights were made with
+        (see integrator_provenance) are put in this dict, for the metadata of
+        the weight file
 
     Returns
     -------
-    weights_matrix : list of lists of floats
-        The "Response Matrix" each sub list is the weights for a given source
-        at every detector position
+    weights_matrix : list of tuples
+        The "Response Matrix", (det num, run num, source name, weight) sorted
+        by det num, run num, and source name, returned if as_tensor is False
+    weight_tensor : numpy array
+        (num dets, num runs, num sources) array of the weights, NaN for
+        combinations that were not calculated, returned (with
+        det_nums, run_nums, and src_names) if as_tensor is True
+    det_nums : list of ints
+        The det number of each index of the first axis of weight_tensor
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis, in the order of
+        sources
+    error_tensor : numpy array
+        The standard errors of weight_tensor, returned last if as_tensor and
+        errors are True, if only errors is True the standard error is the
+        fifth element of each tuple of weights_matrix instead
     """
+    if integrator not in INTEGRATORS:
+        raise ValueError("Unknown integrator: {0:s}".format(integrator))
+    if execution not in EXECUTION_MODES:
+        raise ValueError("Unknown execution mode: {0:s}".format(execution))
+    if errors and checkpoint_path is not None:
+        raise ValueError("Standard errors are not kept in checkpoint files")
+    if error_budget is not None and integrator != "backend":
+        raise ValueError("An error budget needs the backend integrator")
+    if mc_rtol is None:
+        mc_rtol = mc.DEFAULT_RTOL
+    if trace_path is not None:
+        trc.remove_parts(trace_path)
+    init_trace(trace_path)
     # first generate the list of detecting surface and source pairs
     # (because for each NaI detector there are 6 surfaces, whereas for each
     # AD1 'detector' there is only one surface)
+    # sources entirely behind a surface are given a weight of zero here
+    # instead of being integrated, the rest carry their visibility as the
+    # fourth element of the tuple
     input_list = []
+    hidden_list = []
+    tables = st.as_tables(sources)
+    num_src = sum([len(x) for x in tables])
+    surf_num = 0
     for det in detectors:
         rdat = det.get_run_data()
         print "Making det surface - source pairs for:", rdat
         for i, det_surf in enumerate(det.get_detecting_surfaces()):
-            temp = [((rdat[0], rdat[1], i, src.name), det_surf, src)
-                    for src in sources]
-            input_list.extend(temp)
-    if num_cores == 1:
-        return calculate_weights_single(input_list)
+            keep = np.ones(num_src, dtype=bool)
+            if pair_range is not None:
+                pair_nums = surf_num*num_src + np.arange(num_src)
+                keep = np.logical_and(pair_nums >= pair_range[0],
+                                      pair_nums < pair_range[1])
+            surf_num += 1
+            if not np.any(keep):
+                continue
+            offset = 0
+            for table in tables:
+                vis = plane_visibility(det_surf, table.bounding_boxes())
+                in_range = keep[offset:offset+len(table)]
+                offset += len(table)
+                for j in np.flatnonzero(np.logical_and(vis == VIS_HIDDEN,
+                                                       in_range)):
+                    hidden_list.append(((rdat[0], rdat[1], i, table.names[j]),
+                                        0.0))
+                for j in np.flatnonzero(np.logical_and(vis != VIS_HIDDEN,
+                                                       in_range)):
+                    input_list.append(((rdat[0], rdat[1], i, table.names[j]),
+                                       det_surf, table.row(j), vis[j]))
+    check = None
+    pair_infos = None
+    if checkpoint_path is not None:
+        pair_infos = set([x[0] for x in input_list + hidden_list])
+        header = checkpoint_header(detectors, tables, integrator, mc_rtol,
+                                   far_tol, pair_range, error_budget)
+        check = ckpt.Checkpoint(checkpoint_path, resume, header)
+        if resume:
+            print "Resuming:", len(check.done), "pairs already in the checkpoint"
+        input_list = [x for x in input_list if x[0] not in check.done]
+        hidden_list = [x for x in hidden_list if x[0] not in check.done]
+        check.write(hidden_list)
+    num_partial = sum([1 for x in input_list if x[3] == VIS_PARTIAL])
+    temp = "Visibility culling: {0:d} hidden, {1:d} partially visible, "\
+        "{2:d} fully visible pairs"
+    print temp.format(len(hidden_list), num_partial,
+                      len(input_list) - num_partial)
+    # integrate each distinct relative geometry only once
+    input_list, groups = dedup_input(input_list)
+    # pairs with an analytic kernel need neither the cache nor an integrator
+    analytic_list, input_list = ana.split_analytic(input_list)
+    weight_list = ana.calc_weights_analytic(analytic_list)
+    far_list = []
+    if far_tol is not None:
+        # like the error budget, never mix the far field approximation into
+        # the sources the backend disagrees with the other engines on
+        far_list, near_list = mpole.split_far_field(
+            [x for x in input_list if x[3] == VIS_FULL and
+             not eb.needs_backend(x[2])], far_tol)
+        input_list = ([x for x in input_list if x[3] != VIS_FULL or
+                       eb.needs_backend(x[2])] + near_list)
+        weight_list.extend(far_list)
+    settings = integrator_settings(integrator, mc_rtol)
+    cached_list = []
+    error_list = []
+    if cache_path is not None:
+        input_list, cached_list, error_list = split_cached(
+            input_list, cache_path, settings,
+            integrator in SAMPLING_INTEGRATORS)
+        weight_list.extend(cached_list)
+    temp = "Pairs per path: {0:d} culled, {1:d} analytic, {2:d} far field, "\
+        "{3:d} cached, {4:d} integrated"
+    print temp.format(len(hidden_list), len(analytic_list), len(far_list),
+                      len(cached_list), len(input_list))
+    # split the error budget of every row before the weights of the other
+    # paths are written to the checkpoint
+    tol_classes = None
+    if error_budget is not None and len(input_list) != 0:
+        tol_classes = plan_error_budget(input_list, weight_list, groups,
+                                        error_budget)
+    if provenance is not None:
+        provenance.update(integrator_provenance(integrator, mc_rtol,
+                                                tol_classes))
+    # with a checkpoint, results are written (for every pair sharing their
+    # geometry) as soon as they are available instead of being kept
+    sink = None
+    log = None
+    if telemetry_path is not None:
+        # keep the records of the interrupted run only if its pairs are kept
+        log = tel.TelemetryLog(telemetry_path,
+                               check is not None and len(check.done) != 0)
+    if check is not None:
+        check.write(fan_out(weight_list, groups))
+        weight_list = []
+        sink = lambda results: check.write(fan_out(results, groups))
+    if len(input_list) == 0:
+        print "Every integral was culled, analytic, or found in the cache"
+    elif integrator == "cubature":
+        weight_list.extend(calculate_weights_cubature(input_list, num_cores,
+                                                      cache_path, sink))
+    elif integrator in SAMPLING_INTEGRATORS:
+        mc_weights, mc_errors, _ = calculate_weights_montecarlo(
+            input_list, num_cores, cache_path, sink, mc_rtol,
+            SAMPLING_INTEGRATORS[integrator])
+        weight_list.extend(mc_weights)
+        error_list.extend(mc_errors)
+    elif tol_classes is not None:
+        budget_weights, budget_errors = calculate_weights_budget(
+            input_list, tol_classes, num_cores, cache_path, sink,
+            cost_model_path, execution, log)
+        weight_list.extend(budget_weights)
+        error_list.extend(budget_errors)
+    elif num_cores == 1:
+        weight_list.extend(calculate_weights_single(input_list, cache_path,
+                                                    sink, cost_model_path,
+                                                    telemetry=log))
+    else:
+        weight_list.extend(calculate_weights_multi(input_list, num_cores,
+                                                   cache_path, sink,
+                                                   cost_model_path,
+                                                   execution, telemetry=log))
+    if log is not None:
+        log.close()
+        for line in tel.format_report(log.records):
+            print line
+    if TRACE is not None:
+        finish_trace()
+    if check is not None:
+        check.close()
+        # the checkpoint of an interrupted run can hold pairs that were
+        # since dropped from the job
+        weight_list = [x for x in
+                       ckpt.read_checkpoint(checkpoint_path).items()
+                       if x[0] in pair_infos]
+    else:
+        # give every pair the weight of its representative
+        weight_list = fan_out(weight_list, groups)
+        weight_list.extend(hidden_list)
+    if tol_classes is not None:
+        backend_infos = tol_classes.get(eb.TOLERANCE_LADDER[0], [])
+        report_error_budget(weight_list, fan_out(error_list, groups),
+                            fan_out([(x, 0.0) for x in backend_infos], groups))
+    # sum the faces of each detector into the weight tensor
+    det_nums = sorted(set([x.get_run_data()[0] for x in detectors]))
+    run_nums = sorted(set([x.get_run_data()[1] for x in detectors]))
+    src_names = [x for table in tables for x in table.names]
+    tensor = accumulate_weights(weight_list, det_nums, run_nums, src_names)
+    if not errors:
+        if as_tensor:
+            return (tensor, det_nums, run_nums, src_names)
+        return tensor_to_list(tensor, det_nums, run_nums, src_names)
+    err_tensor = accumulate_errors(fan_out(error_list, groups), tensor,
+                                   det_nums, run_nums, src_names)
+    if as_tensor:
+        return (tensor, det_nums, run_nums, src_names, err_tensor)
+    err_list = tensor_to_list(err_tensor, det_nums, run_nums, src_names)
+    return [x + (y[3],) for x, y in
+            zip(tensor_to_list(tensor, det_nums, run_nums, src_names),
+                err_list)]
+
+
+def checkpoint_header(detectors, tables, integrator, mc_rtol, far_tol,
+                      pair_range, error_budget):
+    """Describes a job for the header of its checkpoint, the digest covers the
+    detector surfaces, the sources, and every setting that changes the
+    weights
+
+    Parameters
+    ----------
+    detectors : list of libpd.detector.Detector classes
+        The detectors of the job
+    tables : list of libpd.source_table.SourceTable
+        The sources of the job
+    integrator : str
+        The integrator, one of INTEGRATORS
+    mc_rtol : float
+        The stopping tolerance of the sampling integrators
+    far_tol : float
+        The far field tolerance, or None
+    pair_range : tuple of ints
+        The range of pairs of the job, or None
+    error_budget : float
+        The error budget, or None
+
+    Returns
+    -------
+    header : dict
+        The "digest" of the job and the settings it covers
+    """
+    settings = {"integrator": integrator,
+                "settings": integrator_settings(integrator, mc_rtol),
+                "far_tol": far_tol,
+                "pair_range": (None if pair_range is None else
+                               [int(x) for x in pair_range]),
+                "error_budget": error_budget}
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True))
+    for det in detectors:
+        digest.update(repr(det.get_run_data()))
+        for surface in det.get_detecting_surfaces():
+            digest.update(np.ascontiguousarray(
+                surface.get_batch_params()[1], dtype=np.float64).tostring())
+    for table in tables:
+        digest.update(repr((table.kind, table.names)))
+        digest.update(table.params.tostring())
+    settings["digest"] = digest.hexdigest()
+    settings["num_detectors"] = len(detectors)
+    settings["num_sources"] = sum([len(x) for x in tables])
+    return settings
+
+
+def plane_visibility(surface, boxes):
+    """Classifies sources by where their bounding boxes lie relative to the
+    plane of a detecting surface, only points in front of the plane can be
+    seen by the surface
+
+    Parameters
+    ----------
+    surface : libpd.detector.DetectingSurface
+        The detector's detection surface
+    boxes : numpy array
+        (N, 2, 3) array of the lower and upper corners of the source bounding
+        boxes
+
+    Returns
+    -------
+    vis : numpy array
+        (N,) array of VIS_HIDDEN, VIS_PARTIAL, or VIS_FULL for each source
+    """
+    mid = 0.5*(boxes[:, 0, :] + boxes[:, 1, :]) - surface.center
+    half = 0.5*(boxes[:, 1, :] - boxes[:, 0, :])
+    dist = mid.dot(surface.norm)
+    reach = half.dot(np.abs(surface.norm))
+    vis = np.full(boxes.shape[0], VIS_PARTIAL, dtype=np.int32)
+    vis[dist + reach <= 0.0] = VIS_HIDDEN
+    vis[dist - reach > 0.0] = VIS_FULL
+    return vis
+
+
+def dedup_input(input_list):
+    """Groups the surface source pairs by their relative geometry (the source
+    relative to the surface center, the surface vectors and the source class)
+    pairs in the same group are the same integral up to a translation so only
+    the first pair of each group needs to be integrated
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+
+    Returns
+    -------
+    unique_list : list of tuples
+        The first entry of input_list for every distinct relative geometry
+    groups : dict
+        Maps the pos_info of each entry of unique_list to the pos_info of
+        every entry of input_list that shares its geometry
+    """
+    unique_list = []
+    groups = {}
+    rep_info = {}
+    for data in input_list:
+        key = wcache.pair_key(data[1], data[2])
+        if key not in rep_info:
+            rep_info[key] = data[0]
+            groups[data[0]] = []
+            unique_list.append(data)
+        groups[rep_info[key]].append(data[0])
+    ratio = (float(len(input_list)) / len(unique_list)) if unique_list else 1.0
+    temp = "Deduplication: {0:d} pairs, {1:d} unique integrals (ratio {2:.2f})"
+    print temp.format(len(input_list), len(unique_list), ratio)
+    return (unique_list, groups)
+
+
+def fan_out(weight_list, groups):
+    """Copies the weight of every integrated representative pair to all the
+    pairs that share its relative geometry
+
+    Parameters
+    ----------
+    weight_list : list of tuples
+        (pos_info, weight) for every representative pair
+    groups : dict
+        The groups returned by dedup_input
+
+    Returns
+    -------
+    out_list : list of tuples
+        (pos_info, weight) for every pair of the original input list
+    """
+    out_list = []
+    for pos_info, weight in weight_list:
+        out_list.extend([(x, weight) for x in groups[pos_info]])
+    return out_list
+
+
+def integrator_settings(integrator, mc_rtol=None):
+    """Returns the description of an integrator and its settings that is used
+    to tell cached weights of different integrators apart
+
+    Parameters
+    ----------
+    integrator : str
+        One of INTEGRATORS
+    mc_rtol : float
+        The stopping tolerance of the sampling integrators,
+        monte_carlo.DEFAULT_RTOL if None
+
+    Returns
+    -------
+    settings : str
+        The description of the integrator settings
+    """
+    if integrator == "cubature":
+        temp = "cubature-{0:d}-{1:e}-{2:d}"
+        return temp.format(cub.DEFAULT_ORDER, cub.DEFAULT_RTOL,
+                           cub.DEFAULT_MAX_LEVEL)
+    if integrator == "montecarlo":
+        temp = "montecarlo-{0:e}-{1:d}-{2:d}-{3:d}"
+        return temp.format((mc.DEFAULT_RTOL if mc_rtol is None else mc_rtol),
+                           mc.DEFAULT_MIN_SAMPLES, mc.DEFAULT_MAX_SAMPLES,
+                           mc.DEFAULT_SEED)
+    if integrator in SAMPLING_INTEGRATORS:
+        temp = "{0:s}-{1:e}-{2:d}-{3:d}-{4:d}-{5:d}"
+        return temp.format(integrator,
+                           (mc.DEFAULT_RTOL if mc_rtol is None else mc_rtol),
+                           qmc.DEFAULT_REPLICAS, qmc.DEFAULT_MIN_POINTS,
+                           qmc.DEFAULT_MAX_POINTS, mc.DEFAULT_SEED)
+    return BACKEND_SETTINGS
+
+
+def integrator_provenance(integrator, mc_rtol=None, classes=None):
+    """Returns the integrators and settings that made the weights of a run,
+    for the metadata of its weight file
+
+    Parameters
+    ----------
+    integrator : str
+        One of INTEGRATORS
+    mc_rtol : float
+        The stopping tolerance of the sampling integrators
+    classes : dict
+        If not None, the tolerance classes of the error budget of the run
+        (see plan_error_budget), whose pairs were integrated by the backend
+        or sampled to their tolerance instead of using integrator
+
+    Returns
+    -------
+    provenance : dict
+        "integrator" and its "settings" (see integrator_settings), or with an
+        error budget "integrator" is "budget" and "engines" lists the
+        integrator, tolerance, settings, and number of integrals of every
+        tolerance class
+    """
+    if classes is None:
+        return {"integrator": integrator,
+                "settings": integrator_settings(integrator, mc_rtol)}
+    engines = []
+    for tol in sorted(classes):
+        name = ("backend" if tol == eb.TOLERANCE_LADDER[0] else
+                "qmc-" + BUDGET_SEQUENCE)
+        engines.append({"integrator": name, "tolerance": tol,
+                        "settings": integrator_settings(name, tol),
+                        "integrals": len(classes[tol])})
+    return {"integrator": "budget", "engines": engines}
+
+
+def split_cached(input_list, cache_path, settings, sampled=False):
+    """Splits the pairs into those that need to be integrated and those whose
+    weights are in the weight cache
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    cache_path : str
+        The path to the weight cache
+    settings : str
+        The description of the integrator settings, see integrator_settings
+    sampled : bool
+        If True, the integrator is a sampling one and a cached weight is only
+        used together with its cached standard error
+
+    Returns
+    -------
+    input_list : list of tuples
+        The pairs that need to be integrated
+    cached_list : list of tuples
+        (pos_info, weight) of the pairs found in the cache
+    error_list : list of tuples
+        (pos_info, standard error) of the pairs found in the cache, empty if
+        sampled is False
+    """
+    cache = wcache.WeightCache(cache_path, settings)
+    by_info = dict((x[0], x) for x in input_list)
+    input_list, cached_list = cache.split_input(input_list)
+    error_list = []
+    if sampled:
+        err_cache = wcache.WeightCache(cache_path,
+                                       settings + ERROR_SETTINGS_SUFFIX)
+        redo_list, error_list = err_cache.split_input(
+            [by_info[x[0]] for x in cached_list])
+        err_cache.close()
+        redo_infos = set([x[0] for x in redo_list])
+        cached_list = [x for x in cached_list if x[0] not in redo_infos]
+        input_list.extend(redo_list)
+    cache.print_stats()
+    cache.close()
+    return (input_list, cached_list, error_list)
+
+
+def plan_error_budget(input_list, weight_list, groups, budget):
+    """Estimates the weights of the pairs to integrate and splits the error
+    budget of every (detector, run) row across them
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The representative pairs that will be integrated
+    weight_list : list of tuples
+        (pos_info, weight) of the representative pairs of the other paths
+    groups : dict
+        The groups returned by dedup_input
+    budget : float
+        The relative error allowed in the total of every row
+
+    Returns
+    -------
+    classes : dict
+        Maps each tolerance of error_budget.TOLERANCE_LADDER to the pos_info
+        of the representative pairs that are integrated to it
+    """
+    print "Estimating the magnitude of", len(input_list), "integrals"
+    estimates = eb.estimate_magnitudes(input_list)
+    tolerances = eb.allocate_tolerances(fan_out(estimates + weight_list,
+                                                groups), budget)
+    pinned = set([x[0] for x in input_list if eb.needs_backend(x[2])])
+    classes = eb.group_tolerances(tolerances, dict((x[0], groups[x[0]]) for
+                                                   x in input_list),
+                                  pinned=pinned)
+    temp = "Error budget {0:.1e}: {1:d} integrals to a tolerance of {2:.0e}"
+    for tol in sorted(classes):
+        print temp.format(budget, len(classes[tol]), tol)
+    if len(pinned) != 0:
+        print "Kept", len(pinned), "integrals of line and rotated cylinder "\
+            "sources on the backend"
+    return classes
+
+
+def calculate_weights_budget(input_list, classes, num_cores, cache_path=None,
+                             sink=None, cost_model_path=None,
+                             execution="process", telemetry=None):
+    """Integrates the pairs of an error budget, the pairs that need the
+    tolerance of the backend with the backend and the rest with the
+    quasi-Monte Carlo engine at the tolerance of their class, then prints the
+    integrand evaluations saved over integrating every pair with the backend
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    classes : dict
+        Maps each tolerance to the pos_info of the pairs integrated to it, see
+        plan_error_budget
+    num_cores : int
+        Number of cores to spread the computation across
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+    cost_model_path : str
+        If not None, the file the cost model is loaded from and saved to
+    execution : str
+        One of EXECUTION_MODES
+    telemetry : libpd.telemetry.TelemetryLog
+        If not None, the statistics of the backend pairs are added to it
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of input_list
+    error_list : list of tuples
+        (pos_info, standard error) for every sampled entry of input_list
+    """
+    by_info = dict((x[0], x) for x in input_list)
+    model = sched.CostModel(cost_model_path)
+    keys = pair_cost_keys(input_list).values()
+    uniform = np.sum(model.predict(keys))
+    unknown = sum([1 for x in keys if x not in model.stats])
+    weight_list = []
+    error_list = []
+    evals = 0.0
+    for tol in sorted(classes):
+        class_list = [by_info[x] for x in classes[tol]]
+        if tol == eb.TOLERANCE_LADDER[0]:
+            if num_cores == 1:
+                weight_list.extend(calculate_weights_single(
+                    class_list, cache_path, sink, model=model,
+                    telemetry=telemetry))
+            else:
+                weight_list.extend(calculate_weights_multi(
+                    class_list, num_cores, cache_path, sink,
+                    execution=execution, model=model, telemetry=telemetry))
+            continue
+        integrator = "qmc-" + BUDGET_SEQUENCE
+        if cache_path is not None:
+            class_list, cached_list, cached_errors = split_cached(
+                class_list, cache_path, integrator_settings(integrator, tol),
+                True)
+            weight_list.extend(collect_block(cached_list, sink))
+            error_list.extend(cached_errors)
+        if len(class_list) == 0:
+            continue
+        print "Sampling to a relative standard error of {0:.0e}".format(tol)
+        qmc_weights, qmc_errors, qmc_evals = calculate_weights_montecarlo(
+            class_list, num_cores, cache_path, sink, tol, BUDGET_SEQUENCE)
+        weight_list.extend(qmc_weights)
+        error_list.extend(qmc_errors)
+        evals += qmc_evals
+    model.save()
+    evals += model.evals
+    print "Error budget: {0:.4g} integrand evaluations".format(evals)
+    if unknown == 0:
+        temp = "{0:.4g} evaluations predicted for the backend alone, "\
+            "{1:.4g} saved ({2:.1f}%)"
+        print temp.format(uniform, uniform - evals,
+                          100.0*(uniform - evals)/uniform)
     else:
-        return calculate_weights_multi(input_list, num_cores)
+        temp = "The cost model has no history for {0:d} of {1:d} integrals, "\
+            "the evaluations saved cannot be predicted"
+        print temp.format(unknown, len(keys))
+    return (weight_list, error_list)
+
 
+def report_error_budget(weight_list, error_list, backend_list):
+    """Prints the achieved error bounds of the (detector, run) rows of an
+    error budget run, the error of a sampled pair is its standard error and
+    that of a backend pair the first tolerance of the ladder times its weight
 
-def calculate_weights_single(detectors, sources):
+    Parameters
+    ----------
+    weight_list : list of tuples
+        (pos_info, weight) of every pair
+    error_list : list of tuples
+        (pos_info, standard error) of every sampled pair
+    backend_list : list of tuples
+        (pos_info, anything) of every pair integrated by the backend
+    """
+    weights = dict(weight_list)
+    abs_errors = dict(error_list)
+    for pos_info, _ in backend_list:
+        abs_errors[pos_info] = eb.TOLERANCE_LADDER[0]*abs(weights[pos_info])
+    bounds = np.array(eb.row_error_bounds(weight_list, abs_errors).values())
+    if bounds.size == 0:
+        return
+    temp = "Achieved row error bounds: largest {0:.3e}, median {1:.3e} over "\
+        "{2:d} rows"
+    print temp.format(np.max(bounds), np.median(bounds), bounds.size)
+
+
+def calculate_weights_single(input_list, cache_path=None, sink=None,
+                             cost_model_path=None, model=None,
+                             telemetry=None):
     """This function calculates the weights for each source and detector
     surface pair in the detectors and sources arrays passed to it in a single
     threaded fashion, using the standard map function for easy debugging
@@ -66,23 +787,108 @@ def calculate_weights_single(detectors, sources):
     ----------
     input_list : list of tuples
         The list of detecting surface source pairs and their associated data
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+    cost_model_path : str
+        If not None, the file the cost model is loaded from and saved to
+    model : libpd.scheduler.CostModel
+        If not None, the cost model to update instead of the one at
+        cost_model_path, it is not saved
+    telemetry : libpd.telemetry.TelemetryLog
+        If not None, the statistics of the backend pairs are added to it
 
     Returns
     -------
-    weights_matrix : list of lists of floats
-        The "Response Matrix" each sub list is the weights for a given source
-        at every detector position
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of input_list
     """
     print "Commencing Single Threaded Integration!"
     print "There are", len(input_list), "integrals to calculate"
     print HEADINGS
     # now calculate the weight at every position using a single core
-    weight_list = [calc_weight_opt(x) for x in input_list]
-    # return the sorted and summed weights
-    return sort_and_sum(weight_list)
+    save_model = model is None
+    if save_model:
+        model = sched.CostModel(cost_model_path)
+    keys = pair_cost_keys(input_list)
+    blocks = [input_list[i:i+BACKEND_BLOCK_SIZE] for i in
+              range(0, len(input_list), BACKEND_BLOCK_SIZE)]
+    init_backend_worker(cache_path, BACKEND_SETTINGS)
+    try:
+        weight_list = collect_counted((calc_chunk_counted(x) for x in
+                                       blocks), keys, model, sink, telemetry)
+    finally:
+        close_backend_session()
+        close_weight_cache()
+    if save_model:
+        model.save()
+    return weight_list
+
+
+def pair_cost_keys(input_list):
+    """Returns the cost model bin of every pair
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+
+    Returns
+    -------
+    keys : dict
+        Maps the pos_info of every pair to its bin key
+    """
+    return dict((x[0], sched.pair_features(x[1], x[2], (x[3] if len(x) > 3
+                                                        else VIS_PARTIAL)))
+                for x in input_list)
 
 
-def calculate_weights_multi(input_list, num_cores):
+def collect_counted(results, keys, model, sink=None, telemetry=None):
+    """Gathers the results of an iterator of lists of (pos_info, weight,
+    backend statistics) as they are finished, the evaluation counts update
+    the cost model and the weights are either put in a list or passed on to
+    the sink
+
+    Parameters
+    ----------
+    results : iterator
+        The (pos_info, weight, backend statistics) results, or lists of them,
+        see backend_result
+    keys : dict
+        The cost model bin of every pos_info
+    model : libpd.scheduler.CostModel
+        The cost model to update
+    sink : function
+        If not None, called with the list of (pos_info, weight) of each
+        result
+    telemetry : libpd.telemetry.TelemetryLog
+        If not None, the statistics of the pairs the backend integrated are
+        added to it
+
+    Returns
+    -------
+    weight_list : list of tuples
+        The (pos_info, weight) results if sink is None, otherwise an empty
+        list
+    """
+    weight_list = []
+    for result in results:
+        if not isinstance(result, list):
+            result = [result]
+        for pos_info, _, stats in result:
+            if stats[EVALS_STAT] > 0.0:
+                model.update(keys[pos_info], stats[EVALS_STAT])
+                if telemetry is not None:
+                    telemetry.add(pos_info, keys[pos_info], stats)
+        weight_list.extend(collect_block([x[:2] for x in result], sink))
+    return weight_list
+
+
+def calculate_weights_multi(input_list, num_cores, cache_path=None,
+                            sink=None, cost_model_path=None,
+                            execution="process", model=None, telemetry=None):
     """This function calculates the weights for each source and detector
     surface pair in the detectors and sources arrays passed to it in a single
     threaded fashion, using the standard map function for easy debugging
@@ -93,12 +899,26 @@ def calculate_weights_multi(input_list, num_cores):
         The list of detecting surface source pairs and their associated data
     num_cores : int
         Number of cores to spread the computation across
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+    cost_model_path : str
+        If not None, the file the cost model is loaded from and saved to
+    execution : str
+        "process" to use a worker process pool, "thread" to use a thread pool
+        in this process, see calculate_chunks_threaded
+    model : libpd.scheduler.CostModel
+        If not None, the cost model to use instead of the one at
+        cost_model_path, it is not saved
+    telemetry : libpd.telemetry.TelemetryLog
+        If not None, the statistics of the backend pairs are added to it
 
     Returns
     -------
-    weights_matrix : list of lists of floats
-        The "Response Matrix" each sub list is the weights for a given source
-        at every detector position
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of input_list
     """
     # now calculate the weight at every position using multiple cores
     # first restrict the number of cores to whatever is available
@@ -109,12 +929,514 @@ def calculate_weights_multi(input_list, num_cores):
     print "Commencing Multi Threaded Integration!"
     print "There are", len(input_list), "integrals to calculate"
     print HEADINGS
-    # set up the thread pool for the multiprocessing
-    mp_pool = multiprocessing.Pool(processes=num_cores)
-    # process the input list with that pool
-    weight_list = mp_pool.map(calc_weight_opt, input_list)
-    # return the sorted and summed weights
-    return sort_and_sum(weight_list)
+    # order the pairs longest first by their predicted cost and group them
+    # into chunks that shrink as the remaining work does
+    start = time.time()
+    save_model = model is None
+    if save_model:
+        model = sched.CostModel(cost_model_path)
+    keys = pair_cost_keys(input_list)
+    chunks = sched.make_chunks(model.predict([keys[x[0]] for x in
+                                              input_list]), num_cores)
+    print "Scheduled", len(input_list), "integrals in", len(chunks), "chunks"
+    if execution == "thread":
+        chunks = [[input_list[i] for i in chunk] for chunk in chunks]
+        if TRACE is not None:
+            TRACE.span("schedule", start, time.time(),
+                       {"pairs": len(input_list), "chunks": len(chunks)})
+        weight_list = calculate_chunks_threaded(chunks, num_cores, cache_path,
+                                                keys, model, sink, telemetry)
+        if save_model:
+            model.save()
+        return weight_list
+    # place the geometry in shared memory once, the workers inherit it when
+    # they are forked and the tasks are only the indices of the pairs
+    geometry = sg.SharedGeometry(input_list)
+    chunks = [np.array(chunk, dtype=np.int32) for chunk in chunks]
+    if TRACE is not None:
+        TRACE.span("schedule", start, time.time(),
+                   {"pairs": len(input_list), "chunks": len(chunks)})
+    # set up the thread pool for the multiprocessing, each worker opens its
+    # own backend session (and cache connection) when it starts and closes it
+    # when it exits
+    mp_pool = multiprocessing.Pool(processes=num_cores,
+                                   initializer=init_shared_worker,
+                                   initargs=(cache_path, BACKEND_SETTINGS,
+                                             geometry,
+                                             (None if TRACE is None else
+                                              TRACE.path)))
+    # process the chunks with that pool, taking the results in the order
+    # they finish
+    if TRACE is None:
+        results = mp_pool.imap_unordered(calc_shared_chunk, chunks)
+    else:
+        results = (unpickle_traced(x) for x in
+                   mp_pool.imap_unordered(calc_shared_chunk_traced,
+                                          stamp_tasks(chunks)))
+    weight_list = collect_counted(([(input_list[i][0], row[0], row[1:]) for
+                                    i, row in zip(inds, out)]
+                                   for inds, out in results),
+                                  keys, model, sink, telemetry)
+    mp_pool.close()
+    mp_pool.join()
+    if save_model:
+        model.save()
+    return weight_list
+
+
+def init_shared_worker(cache_path, settings, geometry, trace_path=None):
+    """Initializer of the shared geometry worker pool, opens the backend
+    session and the weight cache of the worker and attaches to the geometry,
+    and starts the trace buffer of the worker if the run is traced
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the weight cache, if None caching is disabled
+    settings : str
+        The description of the integrator settings
+    geometry : libpd.shared_geometry.SharedGeometry
+        The shared geometry of the pairs
+    trace_path : str
+        If not None, the path to the trace file of the run
+    """
+    global GEOMETRY
+    init_backend_worker(cache_path, settings)
+    GEOMETRY = geometry
+    GEOMETRY.attach()
+    init_trace(trace_path)
+    if trace_path is not None:
+        register_exit_function(flush_trace)
+
+
+def calc_shared_chunk(inds):
+    """Calculates the weights of a chunk of pairs of the shared geometry
+
+    Parameters
+    ----------
+    inds : numpy array
+        The indices of the pairs
+
+    Returns
+    -------
+    inds : numpy array
+        The indices that were passed in
+    out : numpy array
+        (N, 1 + NUM_STATS) array of the weight and backend statistics of
+        every pair
+    """
+    results = calc_chunk_counted(GEOMETRY.get_pairs(inds))
+    return (inds, np.array([np.append(x[1], x[2]) for x in results],
+                           dtype=np.float64))
+
+
+def calculate_chunks_threaded(chunks, num_cores, cache_path, keys, model,
+                              sink=None, telemetry=None):
+    """Calculates chunks of surface source pairs on a pool of threads that
+    share this process's copy of the geometry and one loaded backend library,
+    the backend calls release the GIL so the threads integrate in parallel.
+    Each thread has its own backend session (backend detector objects are
+    not thread safe) and the weight cache is written by the calling thread
+
+    Parameters
+    ----------
+    chunks : list of lists of tuples
+        The chunks of data tuples, in the order they should be handed out
+    num_cores : int
+        The number of threads
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    keys : dict
+        The cost model bin of every pos_info
+    model : libpd.scheduler.CostModel
+        The cost model to update
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+    telemetry : libpd.telemetry.TelemetryLog
+        If not None, the statistics of the backend pairs are added to it
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every pair in the chunks
+    """
+    lib = bi.initialize_interface()
+    sessions = []
+    cache = None
+    if cache_path is not None:
+        cache = wcache.WeightCache(cache_path, BACKEND_SETTINGS)
+    th_pool = mpp.ThreadPool(processes=num_cores,
+                             initializer=init_thread_worker,
+                             initargs=(lib, sessions))
+    weight_list = []
+    if TRACE is None:
+        results = th_pool.imap_unordered(calc_chunk_tagged, chunks)
+    else:
+        results = th_pool.imap_unordered(calc_chunk_tagged_traced,
+                                         stamp_tasks(chunks))
+    try:
+        for chunk, result in results:
+            if cache is not None:
+                for data, (_, weight, _) in zip(chunk, result):
+                    cache.add(data[1], data[2], weight)
+            weight_list.extend(collect_counted([result], keys, model, sink,
+                                               telemetry))
+    finally:
+        th_pool.close()
+        th_pool.join()
+        for session in sessions:
+            session.close()
+        if cache is not None:
+            cache.close()
+    return weight_list
+
+
+def init_thread_worker(lib, sessions):
+    """Initializer of the backend thread pool, gives the thread its own
+    backend session on the shared library
+
+    Parameters
+    ----------
+    lib : ctypes.cdll
+        The loaded backend library
+    sessions : list
+        The session is appended to this list so it can be closed after the
+        pool is done
+    """
+    THREAD_STATE.session = BackendSession(lib)
+    sessions.append(THREAD_STATE.session)
+
+
+def calc_chunk_tagged(chunk):
+    """Calculates a chunk of pairs and returns it with its results, so the
+    results can be matched to the pairs when they finish out of order
+
+    Parameters
+    ----------
+    chunk : list of tuples
+        The data tuples of the pairs, see calc_weight_opt
+
+    Returns
+    -------
+    chunk : list of tuples
+        The chunk that was passed in
+    results : list of tuples
+        (pos_info, weight, backend statistics) for every pair in the chunk
+    """
+    return (chunk, calc_chunk_counted(chunk))
+
+
+def stamp_tasks(chunks):
+    """Yields the chunks of a traced run with the time each is taken by the
+    task handler of the pool, so the workers can tell how long it waited in
+    the task queue
+
+    Parameters
+    ----------
+    chunks : list
+        The tasks of the pool
+
+    Returns
+    -------
+    tasks : generator of tuples
+        (chunk, time it was queued) for every chunk
+    """
+    for chunk in chunks:
+        yield (chunk, time.time())
+
+
+def run_traced(func, task, pickle):
+    """Runs a task of a traced run, recording the time it waited in the task
+    queue and, for worker processes, the time its result takes to pickle
+
+    Parameters
+    ----------
+    func : function
+        The task function
+    task : tuple
+        (chunk, time it was queued), see stamp_tasks
+    pickle : bool
+        If True, the result is returned pickled so the pickling can be timed
+
+    Returns
+    -------
+    result : object
+        What func returned, or its pickle if pickle is True
+    """
+    chunk, queued = task
+    start = time.time()
+    TRACE.span("queue wait", queued, start, {"pairs": len(chunk)})
+    result = func(chunk)
+    if not pickle:
+        return result
+    start = time.time()
+    result = cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+    TRACE.span("pickle", start, time.time(), {"bytes": len(result)})
+    return result
+
+
+def calc_shared_chunk_traced(task):
+    """Traced version of calc_shared_chunk, see run_traced
+
+    Parameters
+    ----------
+    task : tuple
+        (indices of the pairs, time it was queued)
+
+    Returns
+    -------
+    result : str
+        The pickle of what calc_shared_chunk returned
+    """
+    return run_traced(calc_shared_chunk, task, True)
+
+
+def calc_chunk_tagged_traced(task):
+    """Traced version of calc_chunk_tagged, see run_traced
+
+    Parameters
+    ----------
+    task : tuple
+        (data tuples of the pairs, time it was queued)
+
+    Returns
+    -------
+    chunk : list of tuples
+        The chunk that was passed in
+    results : list of tuples
+        (pos_info, weight, backend statistics) for every pair in the chunk
+    """
+    return run_traced(calc_chunk_tagged, task, False)
+
+
+def unpickle_traced(result):
+    """Unpickles the result of a traced worker process task, recording the
+    time it takes
+
+    Parameters
+    ----------
+    result : str
+        The pickled result, see run_traced
+
+    Returns
+    -------
+    result : object
+        The result
+    """
+    start = time.time()
+    out = cPickle.loads(result)
+    TRACE.span("unpickle", start, time.time(), {"bytes": len(result)})
+    return out
+
+
+def calculate_weights_cubature(input_list, num_cores, cache_path=None,
+                               sink=None):
+    """This function calculates the weights for each source and detector
+    surface pair using the batched numpy engine, the pairs are split into
+    blocks that are each integrated as a batch, in parallel if num_cores is
+    greater than 1
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    num_cores : int
+        Number of cores to spread the computation across
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of input_list
+    """
+    print "Commencing Batched Cubature Integration!"
+    print "There are", len(input_list), "integrals to calculate"
+    blocks = [input_list[i:i+CUBATURE_BLOCK_SIZE] for i in
+              range(0, len(input_list), CUBATURE_BLOCK_SIZE)]
+    num_cores = min(num_cores, multiprocessing.cpu_count())
+    settings = integrator_settings("cubature")
+    weight_list = []
+    if num_cores == 1:
+        init_weight_cache(cache_path, settings)
+        try:
+            for block in blocks:
+                weight_list.extend(collect_block(calc_block_cubature(block),
+                                                 sink))
+        finally:
+            close_weight_cache()
+    else:
+        mp_pool = multiprocessing.Pool(processes=num_cores,
+                                       initializer=init_weight_cache,
+                                       initargs=(cache_path, settings))
+        for result in mp_pool.imap_unordered(calc_block_cubature, blocks):
+            weight_list.extend(collect_block(result, sink))
+        mp_pool.close()
+        mp_pool.join()
+    return weight_list
+
+
+def collect_block(block_result, sink=None):
+    """Passes the results of a block on to the sink, if there is one
+
+    Parameters
+    ----------
+    block_result : list of tuples
+        The (pos_info, weight) results of the block
+    sink : function
+        If not None, called with the block's results
+
+    Returns
+    -------
+    weight_list : list of tuples
+        The results if sink is None, otherwise an empty list
+    """
+    if sink is None:
+        return block_result
+    sink(block_result)
+    return []
+
+
+def calc_block_cubature(block):
+    """This function integrates a block of surface source pairs with the
+    batched cubature engine and adds the results to the weight cache of this
+    process, if there is one
+
+    Parameters
+    ----------
+    block : list of tuples
+        The detecting surface source pairs and their associated data
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of block
+    """
+    weight_list = cub.calc_weights_batched(block)
+    if CACHE is not None:
+        for data, weight in zip(block, weight_list):
+            CACHE.add(data[1], data[2], weight[1])
+        CACHE.flush()
+    return weight_list
+
+
+def calculate_weights_montecarlo(input_list, num_cores, cache_path=None,
+                                 sink=None, rtol=mc.DEFAULT_RTOL,
+                                 sequence=None):
+    """This function calculates the weights and their standard errors for each
+    source and detector surface pair using the Monte Carlo engine (or the
+    quasi-Monte Carlo engine if a sequence is given), the pairs
+    are split into blocks that are each sampled as a batch, in parallel if
+    num_cores is greater than 1, each block has its own random stream so the
+    results do not depend on num_cores
+
+    Parameters
+    ----------
+    input_list : list of tuples
+        The list of detecting surface source pairs and their associated data
+    num_cores : int
+        Number of cores to spread the computation across
+    cache_path : str
+        If not None, the path to the weight cache to add the results to
+    sink : function
+        If not None, called with a list of (pos_info, weight) as the results
+        are finished, they are then not returned
+    rtol : float
+        The relative standard error at which a pair stops being sampled
+    sequence : str
+        If not None, one of quasi_monte_carlo.SEQUENCES, the low discrepancy
+        sequence to sample with
+
+    Returns
+    -------
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of input_list
+    error_list : list of tuples
+        (pos_info, standard error) for every entry of input_list, returned
+        even if there is a sink
+    evals : float
+        The total number of integrand evaluations
+    """
+    if sequence is None:
+        print "Commencing Monte Carlo Integration!"
+        integrator = "montecarlo"
+    else:
+        print "Commencing Quasi-Monte Carlo Integration!"
+        integrator = "qmc-" + sequence
+    print "There are", len(input_list), "integrals to calculate"
+    tasks = [(i, input_list[i:i+MONTE_CARLO_BLOCK_SIZE], rtol, sequence) for
+             i in range(0, len(input_list), MONTE_CARLO_BLOCK_SIZE)]
+    num_cores = min(num_cores, multiprocessing.cpu_count())
+    cache = None
+    err_cache = None
+    if cache_path is not None:
+        settings = integrator_settings(integrator, rtol)
+        cache = wcache.WeightCache(cache_path, settings)
+        err_cache = wcache.WeightCache(cache_path,
+                                       settings + ERROR_SETTINGS_SUFFIX)
+    weight_list = []
+    error_list = []
+    evals = 0.0
+    mp_pool = None
+    if num_cores == 1:
+        results = (calc_block_montecarlo(x) for x in tasks)
+    else:
+        mp_pool = multiprocessing.Pool(processes=num_cores)
+        results = mp_pool.imap_unordered(calc_block_montecarlo, tasks)
+    for start, block_weights, block_errors, block_counts in results:
+        # the cache is written by this process only
+        if cache is not None:
+            block = input_list[start:start+MONTE_CARLO_BLOCK_SIZE]
+            for data, weight, error in zip(block, block_weights,
+                                           block_errors):
+                cache.add(data[1], data[2], weight[1])
+                err_cache.add(data[1], data[2], error[1])
+        weight_list.extend(collect_block(block_weights, sink))
+        error_list.extend(block_errors)
+        evals += sum([x[1] for x in block_counts])
+    if mp_pool is not None:
+        mp_pool.close()
+        mp_pool.join()
+    if cache is not None:
+        cache.close()
+        err_cache.close()
+    return (weight_list, error_list, evals)
+
+
+def calc_block_montecarlo(task):
+    """This function samples a block of surface source pairs with the
+    (quasi-)Monte Carlo engine, the random stream is seeded with the position
+    of the block
+
+    Parameters
+    ----------
+    task : tuple
+        (start, block, rtol, sequence), the index of the first pair of the
+        block in the input list, the detecting surface source pairs and their
+        associated data, the stopping tolerance, and the low discrepancy
+        sequence or None
+
+    Returns
+    -------
+    start : int
+        The index of the first pair of the block
+    weight_list : list of tuples
+        (pos_info, weight) for every entry of block
+    error_list : list of tuples
+        (pos_info, standard error) for every entry of block
+    count_list : list of tuples
+        (pos_info, number of points) for every entry of block
+    """
+    start, block, rtol, sequence = task
+    if sequence is None:
+        return (start,) + mc.calc_weights_mc(block, rtol,
+                                             seed=[mc.DEFAULT_SEED, start])
+    return (start,) + qmc.calc_weights_qmc(block, sequence, rtol,
+                                           seed=[mc.DEFAULT_SEED, start])
 
 
 def sort_and_sum(weight_list):
@@ -133,22 +1455,107 @@ def sort_and_sum(weight_list):
         The list of weights after summing the seperate faces of a detector into
         the total contribution of that source to that position
     """
-    weight_list.sort(key=lambda x: (x[0][0], x[0][1], x[0][3], x[0][2]))
-    out_list = []
-    curr_weight = weight_list[0][1]
-    prev_info = (weight_list[0][0][0], weight_list[0][0][1],
-                 weight_list[0][0][3])
-    for weight in weight_list[1:]:
-        curr_info = (weight[0][0], weight[0][1], weight[0][3])
-        if (prev_info[0] == curr_info[0] and prev_info[1] == curr_info[1] and
-                prev_info[2] == curr_info[2]):
-            curr_weight += weight[1]
-        else:
-            out_list.append((prev_info[0], prev_info[1], prev_info[2], curr_weight))
-            prev_info = curr_info
-            curr_weight = weight[1]
-    out_list.append((prev_info[0], prev_info[1], prev_info[2], curr_weight))
-    return out_list
+    det_nums = sorted(set([x[0][0] for x in weight_list]))
+    run_nums = sorted(set([x[0][1] for x in weight_list]))
+    src_names = sorted(set([x[0][3] for x in weight_list]))
+    tensor = accumulate_weights(weight_list, det_nums, run_nums, src_names)
+    return tensor_to_list(tensor, det_nums, run_nums, src_names)
+
+
+def accumulate_weights(weight_list, det_nums, run_nums, src_names):
+    """Sums the weights of every detecting surface of a detector into a dense
+    (det, run, source) tensor
+
+    Parameters
+    ----------
+    weight_list : list of tuples
+        (pos_info, weight) for every detecting surface source pair
+    det_nums : list of ints
+        The det number of each index of the first axis
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis
+
+    Returns
+    -------
+    tensor : numpy array
+        (len(det_nums), len(run_nums), len(src_names)) array of the summed
+        weights, NaN where a det, run, and source combination has no weights
+    """
+    det_ind = dict((x, i) for i, x in enumerate(det_nums))
+    run_ind = dict((x, i) for i, x in enumerate(run_nums))
+    src_ind = dict((x, i) for i, x in enumerate(src_names))
+    num = len(weight_list)
+    dets = np.fromiter((det_ind[x[0][0]] for x in weight_list), np.intp, num)
+    runs = np.fromiter((run_ind[x[0][1]] for x in weight_list), np.intp, num)
+    srcs = np.fromiter((src_ind[x[0][3]] for x in weight_list), np.intp, num)
+    wts = np.fromiter((x[1] for x in weight_list), np.float64, num)
+    shape = (len(det_nums), len(run_nums), len(src_names))
+    tensor = np.zeros(shape, dtype=np.float64)
+    np.add.at(tensor, (dets, runs, srcs), wts)
+    present = np.zeros(shape, dtype=bool)
+    present[dets, runs, srcs] = True
+    tensor[np.logical_not(present)] = np.nan
+    return tensor
+
+
+def accumulate_errors(error_list, tensor, det_nums, run_nums, src_names):
+    """Combines the standard errors of the detecting surfaces of each detector
+    in quadrature into a tensor matching a weight tensor
+
+    Parameters
+    ----------
+    error_list : list of tuples
+        (pos_info, standard error) for the pairs with an error estimate
+    tensor : numpy array
+        The weight tensor, see accumulate_weights
+    det_nums : list of ints
+        The det number of each index of the first axis
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis
+
+    Returns
+    -------
+    err_tensor : numpy array
+        The standard errors of the weights, zero where no pair of a
+        combination had an error estimate and NaN where tensor is NaN
+    """
+    err_tensor = accumulate_weights([(x[0], x[1]**2) for x in error_list],
+                                    det_nums, run_nums, src_names)
+    err_tensor[np.isnan(err_tensor)] = 0.0
+    err_tensor = np.sqrt(err_tensor)
+    err_tensor[np.isnan(tensor)] = np.nan
+    return err_tensor
+
+
+def tensor_to_list(tensor, det_nums, run_nums, src_names):
+    """Converts a weight tensor into the list of (det num, run num, source
+    name, weight) tuples sorted by det num, run num, and source name
+
+    Parameters
+    ----------
+    tensor : numpy array
+        The weight tensor, see accumulate_weights
+    det_nums : list of ints
+        The det number of each index of the first axis
+    run_nums : list of ints
+        The run number of each index of the second axis
+    src_names : list of str
+        The source name of each index of the third axis
+
+    Returns
+    -------
+    out_list : list of tuples
+        The weights of every calculated combination
+    """
+    order = sorted(range(len(src_names)), key=lambda x: src_names[x])
+    dets, runs, srcs = np.nonzero(np.logical_not(np.isnan(tensor[:, :,
+                                                                 order])))
+    return [(det_nums[i], run_nums[j], src_names[order[k]],
+             tensor[i, j, order[k]]) for i, j, k in zip(dets, runs, srcs)]
 
 
 def calc_weight_opt(data_tuple):
@@ -162,7 +1569,8 @@ def calc_weight_opt(data_tuple):
     data_tuple : tuple of information
         The first element is a tuple containing the det num, run number, and
         surface num the second element contains the detecting surface, the
-        third element contains the source object
+        third element contains the source object, the optional fourth element
+        is the visibility of the source (see plane_visibility)
 
     Returns
     -------
@@ -171,65 +1579,392 @@ def calc_weight_opt(data_tuple):
     weight : float
         The weight calculated for that surface source pair
     """
+    return calc_weight_counted(data_tuple)[:2]
+
+
+def calc_chunk_counted(chunk):
+    """Calculates the weights of a chunk of surface source pairs, the pairs
+    that need the backend are integrated with one batched backend call per
+    kind of source
+
+    Parameters
+    ----------
+    chunk : list of tuples
+        The data tuples of the pairs, see calc_weight_opt
+
+    Returns
+    -------
+    results : list of tuples
+        (pos_info, weight, backend statistics) for every pair in the chunk,
+        see backend_result, the wall time of a batched call is split across
+        its pairs by their evaluation counts
+    """
+    chunk_start = time.time()
+    results = [calc_weight_shortcut(x) for x in chunk]
+    groups = {}
+    for i, data in enumerate(chunk):
+        if results[i] is None:
+            groups.setdefault(data[2].get_batch_params()[0], []).append(i)
+    for kind, inds in groups.items():
+        start = time.time()
+        out_params = get_backend_session().calc_integral_batch(
+            [chunk[i][1] for i in inds], kind, [chunk[i][2] for i in inds])
+        elapsed = time.time() - start
+        if TRACE is not None:
+            TRACE.span("backend", start, start + elapsed,
+                       {"kind": gb.KIND_NAMES[kind], "pairs": len(inds)})
+        batched = np.logical_not(np.isnan(out_params[:, 0]))
+        total = np.sum(out_params[batched, 4])
+        for i, params in zip(inds, out_params):
+            # sources the batch call has no shape for go one at a time
+            if np.isnan(params[0]):
+                results[i] = calc_weight_counted(chunk[i])
+            else:
+                share = (params[4]/total if total > 0.0 else
+                         1.0/np.count_nonzero(batched))
+                results[i] = backend_result(chunk[i], params, elapsed*share)
+    if TRACE is not None:
+        TRACE.span("chunk", chunk_start, time.time(), {"pairs": len(chunk)})
+    return results
+
+
+def calc_weight_counted(data_tuple):
+    """This function performs the weight calculation of calc_weight_opt and
+    also returns the statistics of the backend integration
+
+    Parameters
+    ----------
+    data_tuple : tuple of information
+        The first element is a tuple containing the det num, run number, and
+        surface num the second element contains the detecting surface, the
+        third element contains the source object, the optional fourth element
+        is the visibility of the source (see plane_visibility)
+
+    Returns
+    -------
+    pos_info : tuple
+        just a copy of the first element of the data tuple
+    weight : float
+        The weight calculated for that surface source pair
+    stats : numpy array
+        The backend statistics of the pair, see backend_result, zeros if the
+        backend was not needed
+    """
+    result = calc_weight_shortcut(data_tuple)
+    if result is not None:
+        return result
+    # call the numerical integration in the backend
+    # weight = spi.nquad(scp_call, ranges, args=(surface, source), opts=options)
+    print "Starting", data_tuple[0]
+    start = time.time()
+    weight = get_backend_session().calc_integral(data_tuple[1], data_tuple[2])
+    stop = time.time()
+    if TRACE is not None:
+        TRACE.span("backend", start, stop, {"source": data_tuple[0][3]})
+    return backend_result(data_tuple, weight, stop - start)
+
+
+def calc_weight_shortcut(data_tuple):
+    """Returns the result of a surface source pair that does not need the
+    backend, point sources that the surface cannot see (the pairs with an
+    analytic kernel are split off by calculate_weights before any
+    integrator, so every pair that gets here goes to the backend)
+
+    Parameters
+    ----------
+    data_tuple : tuple of information
+        The data tuple of the pair, see calc_weight_counted
+
+    Returns
+    -------
+    result : tuple
+        (pos_info, weight, backend statistics) or None if the pair needs the
+        backend, the statistics are zeros
+    """
     pos_info = data_tuple[0]
     surface = data_tuple[1]
     source = data_tuple[2]
-    # make a list of the ranges, for the parameters in the surface and then
-    # source
-    ranges = surface.get_integral_bounds()
-    if source.get_num_integral_params() != 0: #make sure the src is not a point
-        ranges.extend(source.get_integral_bounds())
-    else:
+    if source.get_num_integral_params() == 0:
         # if the source params count is 0 then it is a point, perform the check
         # to see if it is in view of the surface early to avoid unnecessary
         # integrations
         test = surface.norm.dot(source.center - data_tuple[1].center)
         if not test > 0.0:
-            return (pos_info, 0.0)
-    # get the library and build the low-level call
-    (lib, calc) = build_low_level_call(surface, source)
-    # call the numerical integration
-    # weight = spi.nquad(scp_call, ranges, args=(surface, source), opts=options)
-    print "Starting", pos_info
-    weight = np.array(range(NUM_BACKEND_OUT_PARAMS), dtype=np.float64)
-    lib.calcIntegral(ct.cast(calc, ct.c_void_p),
-                     weight.ctypes.data_as(ct.POINTER(ct.c_double)))
+            if CACHE is not None:
+                CACHE.add(surface, source, 0.0)
+            return (pos_info, 0.0, np.zeros(NUM_STATS))
+    return None
+
+
+def backend_result(data_tuple, weight, seconds):
+    """Prints the backend outputs of a surface source pair and adds its weight
+    to the weight cache of this process, if there is one
+
+    Parameters
+    ----------
+    data_tuple : tuple of information
+        The data tuple of the pair, see calc_weight_counted
+    weight : numpy array
+        The NUM_BACKEND_OUT_PARAMS outputs of the backend
+    seconds : float
+        The wall time of the integration
+
+    Returns
+    -------
+    result : tuple
+        (pos_info, weight, backend statistics), the statistics are the
+        values of telemetry.STAT_FIELDS, the recursion depth, single axis
+        recursions, all axis recursions, integrand evaluations, and seconds
+    """
+    pos_info = data_tuple[0]
     temp = (pos_info[0], pos_info[1], pos_info[2], pos_info[3], weight[0],
             int(weight[1]), int(weight[2]), int(weight[3]), int(weight[4]))
     print FMT_STR.format(*temp)
-    # free the calculator objection before returning
-    lib.freeCalculator(ct.cast(calc, ct.c_void_p))
-    return (pos_info, weight[0])
+    if CACHE is not None:
+        CACHE.add(data_tuple[1], data_tuple[2], weight[0])
+    return (pos_info, weight[0], np.append(weight[1:], seconds))
+
+
+class BackendSession(object):
+    """This class holds the configured backend library and the backend
+    detector objects for the lifetime of a process, so the library is only
+    loaded once and the detector objects are reused for every source"""
+    def __init__(self, lib=None):
+        """Loads the backend library and sets up the empty detector cache
 
+        Parameters
+        ----------
+        lib : ctypes.cdll
+            An already loaded backend library to use, if None it is loaded
+        """
+        self.lib = lib if lib is not None else bi.initialize_interface()
+        self.detectors = {}
 
-def build_low_level_call(surface, source):
-    """This function builds the scipy lowlevel call around the backend
+    def get_detector(self, surface):
+        """Returns the backend detector object for a detecting surface,
+        creating it on first use. Backend detectors do not store the surface
+        center (sources are passed relative to it) so surfaces with the same
+        vectors and normal share one object
+
+        Parameters
+        ----------
+        surface : libpd.detector.DetectingSurface
+            The detector's detection surface
+
+        Returns
+        -------
+        det : ctypes.c_void_p
+            The pointer to the backend detector object
+        """
+        key = (surface.vec1.tobytes() + surface.vec2.tobytes() +
+               surface.norm.tobytes())
+        if key not in self.detectors:
+            self.detectors[key] = surface.make_backend_object(self.lib,
+                                                              surface.center)
+        return self.detectors[key]
+
+    def calc_integral(self, surface, source):
+        """Performs the backend integration for a surface source pair
+
+        Parameters
+        ----------
+        surface : libpd.detector.DetectingSurface
+            The detector's detection surface
+        source : libpd.geom_base.Shape
+            The source geometry
+
+        Returns
+        -------
+        out_params : numpy array
+            The NUM_BACKEND_OUT_PARAMS outputs of the backend, the weight,
+            recursion depth, single axis recursions, all axis recursions, and
+            integrand evaluations
+        """
+        det = self.get_detector(surface)
+        src = source.make_backend_object(self.lib, surface.center)
+        # the calculator takes ownership of the source but not the detector
+        calc = self.lib.makeSharedDetCalculator(ct.cast(det, ct.c_void_p),
+                                                ct.cast(src, ct.c_void_p))
+        out_params = np.zeros(NUM_BACKEND_OUT_PARAMS, dtype=np.float64)
+        self.lib.calcIntegral(ct.cast(calc, ct.c_void_p),
+                              out_params.ctypes.data_as(ct.POINTER(ct.c_double)))
+        self.lib.freeCalculator(ct.cast(calc, ct.c_void_p))
+        return out_params
+
+    def calc_integral_batch(self, surfaces, kind, sources):
+        """Performs the backend integrations for a batch of surface source
+        pairs whose sources share a kind, in a single backend call
+
+        Parameters
+        ----------
+        surfaces : list of libpd.detector.DetectingSurface
+            The detection surface of every pair
+        kind : int
+            The kind of parameterization of the sources
+        sources : list of libpd.geom_base.Shape
+            The source of every pair
+
+        Returns
+        -------
+        out_params : numpy array
+            (N, NUM_BACKEND_OUT_PARAMS) array of the outputs of the backend
+            for every pair (see calc_integral), NaN for pairs whose source
+            the backend has no batch shape for
+        """
+        surf_params = np.array([x.get_batch_params()[1] for x in surfaces])
+        src_params = np.array([x.get_batch_params()[1] for x in sources])
+        # the backend works relative to the center of the surface
+        src_params[:, 0, :] -= surf_params[:, 0, :]
+        det_arr = np.ascontiguousarray(surf_params[:, 1:, :])
+        src_arr = np.ascontiguousarray(src_params)
+        out_params = np.zeros((len(sources), NUM_BACKEND_OUT_PARAMS),
+                              dtype=np.float64)
+        dptr = ct.POINTER(ct.c_double)
+        self.lib.calcIntegralBatch(len(sources), det_arr.ctypes.data_as(dptr),
+                                   kind, src_arr.ctypes.data_as(dptr),
+                                   out_params.ctypes.data_as(dptr))
+        return out_params
+
+    def close(self):
+        """Frees every backend detector object held by the session"""
+        for det in self.detectors.values():
+            self.lib.freeDetector(ct.cast(det, ct.c_void_p))
+        self.detectors = {}
+
+    def __enter__(self):
+        """Allows the session to be used in a with statement"""
+        return self
+
+    def __exit__(self, *args):
+        """Closes the session at the end of a with statement"""
+        self.close()
+
+
+def register_exit_function(func):
+    """Registers a function to be called when this process exits, a function
+    is registered only once per process however often it is asked for
 
     Parameters
     ----------
-    surface : libpd.detector.DetectingSurface
-        The detector's detection surface
-    source : libpd.geom_base.Shape
-        The source geometry
-
-    Return
-    ------
-    lib : ctypes cdll
-        The initialized library
-    calc : ctypes.c_void_p
-        The calculator void pointer
-    scp_call : scipy.LowLevelCallable
-        A low level callable wrapped around the backend library interface
-    """
-    # first get the library interface
-    lib = bi.initialize_interface()
-    # then make the detector object pointer
-    det = surface.make_backend_object(lib, surface.center)
-    # now make the source objection
-    src = source.make_backend_object(lib, surface.center)
-    # now make the calculation object
-    calc = lib.makeCalculator(ct.cast(det, ct.c_void_p), ct.cast(src, ct.c_void_p))
-    return (lib, calc)
+    func : function
+        The function to call, without arguments
+    """
+    global EXIT_FUNCTIONS
+    if EXIT_FUNCTIONS[0] != os.getpid():
+        EXIT_FUNCTIONS = (os.getpid(), set())
+    if func not in EXIT_FUNCTIONS[1]:
+        EXIT_FUNCTIONS[1].add(func)
+        mpu.Finalize(None, func, exitpriority=10)
+
+
+def init_backend_session():
+    """Creates the backend session for this process, used as the initializer
+    of the worker pool, the session is closed when the worker exits"""
+    global SESSION
+    close_backend_session()
+    SESSION = BackendSession()
+    register_exit_function(close_backend_session)
+
+
+def get_backend_session():
+    """Returns the backend session of this thread of a thread pool, or else
+    of this process, creating it if needed
+
+    Returns
+    -------
+    session : BackendSession
+        The backend session
+    """
+    session = getattr(THREAD_STATE, "session", None)
+    if session is not None:
+        return session
+    if SESSION is None:
+        init_backend_session()
+    return SESSION
+
+
+def close_backend_session():
+    """Closes the backend session of this process, if there is one"""
+    global SESSION
+    if SESSION is not None:
+        SESSION.close()
+        SESSION = None
+
+
+def init_weight_cache(cache_path, settings):
+    """Opens the weight cache for this process, used as the initializer of
+    the worker pool, buffered inserts are written when the worker exits
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the weight cache, if None caching is disabled
+    settings : str
+        The description of the integrator settings
+    """
+    global CACHE
+    close_weight_cache()
+    if cache_path is None:
+        return
+    CACHE = wcache.WeightCache(cache_path, settings)
+    register_exit_function(close_weight_cache)
+
+
+def close_weight_cache():
+    """Closes the weight cache of this process, if there is one"""
+    global CACHE
+    if CACHE is not None:
+        CACHE.close()
+        CACHE = None
+
+
+def init_trace(trace_path):
+    """Starts the trace buffer of this process, or stops tracing
+
+    Parameters
+    ----------
+    trace_path : str
+        The path to the trace file of the run, if None nothing is traced
+    """
+    global TRACE
+    TRACE = None
+    if trace_path is not None:
+        TRACE = trc.TraceBuffer(trace_path)
+
+
+def flush_trace():
+    """Appends the spans in the trace buffer of this process to its part
+    file"""
+    if TRACE is not None:
+        TRACE.flush()
+
+
+def finish_trace():
+    """Merges the spans of every process into the trace file, prints how much
+    time went to each kind of span, and stops tracing"""
+    global TRACE
+    flush_trace()
+    spans = trc.merge_trace(TRACE.path)
+    print "Wrote {0:d} spans to the timeline {1:s}".format(len(spans),
+                                                          TRACE.path)
+    for name, count, secs in trc.summarize_spans(spans):
+        print "    {0:s}: {1:d} spans, {2:.3f} s".format(name, count, secs)
+    TRACE = None
+
+
+def init_backend_worker(cache_path, settings):
+    """Initializer of the backend worker pool, opens the backend session and
+    the weight cache of the worker
+
+    Parameters
+    ----------
+    cache_path : str
+        The path to the weight cache, if None caching is disabled
+    settings : str
+        The description of the integrator settings
+    """
+    init_backend_session()
+    init_weight_cache(cache_path, settings)
 
 
 def calc_weight(data_tuple):
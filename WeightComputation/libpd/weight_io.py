@@ -0,0 +1,148 @@
+"""This file contains the binary response matrix file. It is an uncompressed
+.npz holding the (det, run, source) weight tensor, the det numbers, run
+numbers, and source names of its axes, and a JSON string of metadata about the
+calculation. Because the members of the archive are stored uncompressed, the
+weight tensor can be memory mapped straight out of the file with no parsing"""
+
+import json
+import zipfile
+import numpy as np
+import libpd.weight_calc as wc
+
+# the extension numpy gives .npz files
+NPZ_EXT = ".npz"
+# the version of the layout of the file, stored in the metadata
+FORMAT_VERSION = 1
+# the size of the fixed part of a zip local file header
+ZIP_HEADER_SIZE = 30
+
+
+def write_weights(out_name, weights, metadata=None):
+    """Writes a list of weights to a binary response matrix file
+
+    Parameters
+    ----------
+    out_name : str
+        The name of the output file, NPZ_EXT is appended if it is missing
+    weights : list of tuples
+        (det num, run num, source name, weight) as returned by
+        weight_calc.calculate_weights
+    metadata : dict
+        Anything JSON serializable to store with the weights, e.g. the
+        integrator settings
+
+    Returns
+    -------
+    path : str
+        The name of the file that was written
+    """
+    det_nums = sorted(set([x[0] for x in weights]))
+    run_nums = sorted(set([x[1] for x in weights]))
+    src_names = sorted(set([x[2] for x in weights]))
+    pos_list = [((x[0], x[1], 0, x[2]), x[3]) for x in weights]
+    tensor = wc.accumulate_weights(pos_list, det_nums, run_nums, src_names)
+    meta = dict(metadata if metadata is not None else {})
+    meta["format_version"] = FORMAT_VERSION
+    path = out_name if out_name.endswith(NPZ_EXT) else out_name + NPZ_EXT
+    np.savez(path, weights=tensor,
+             det_nums=np.array(det_nums, dtype=np.int64),
+             run_nums=np.array(run_nums, dtype=np.int64),
+             src_names=np.array(src_names, dtype=np.str_),
+             metadata=np.array(json.dumps(meta, sort_keys=True)))
+    temp = "Wrote a {0:d}x{1:d}x{2:d} weight tensor to {3:s}"
+    print temp.format(tensor.shape[0], tensor.shape[1], tensor.shape[2], path)
+    return path
+
+
+def mmap_member(path, member):
+    """Memory maps an array stored in an uncompressed .npz file
+
+    Parameters
+    ----------
+    path : str
+        The path to the .npz file
+    member : str
+        The name of the array
+
+    Returns
+    -------
+    array : numpy memmap
+        The read only array
+    """
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(member + ".npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        raise ValueError("{0:s} is compressed in {1:s}".format(member, path))
+    with open(path, "rb") as in_file:
+        # the name and extra field lengths are the last 4 bytes of the fixed
+        # part of the local header, they can differ from the central directory
+        in_file.seek(info.header_offset + ZIP_HEADER_SIZE - 4)
+        name_len, extra_len = np.frombuffer(in_file.read(4), dtype="<u2")
+        in_file.seek(info.header_offset + ZIP_HEADER_SIZE + name_len +
+                     extra_len)
+        version = np.lib.format.read_magic(in_file)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(
+                in_file)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(
+                in_file)
+        offset = in_file.tell()
+    return np.memmap(path, dtype=dtype, mode="r", shape=shape, offset=offset,
+                     order=("F" if fortran else "C"))
+
+
+def read_weights(path, mmap=True):
+    """Reads a binary response matrix file
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+    mmap : bool
+        If True, the weight tensor is memory mapped instead of read
+
+    Returns
+    -------
+    tensor : numpy array
+        (num dets, num runs, num sources) array of the weights, NaN for
+        combinations that were not calculated
+    det_nums : numpy array
+        The det number of each index of the first axis
+    run_nums : numpy array
+        The run number of each index of the second axis
+    src_names : numpy array
+        The source name of each index of the third axis
+    metadata : dict
+        The metadata stored with the weights
+    """
+    with np.load(path) as data:
+        det_nums = data["det_nums"]
+        run_nums = data["run_nums"]
+        src_names = data["src_names"]
+        metadata = json.loads(str(data["metadata"]))
+        tensor = None if mmap else data["weights"]
+    if mmap:
+        tensor = mmap_member(path, "weights")
+    return (tensor, det_nums, run_nums, src_names, metadata)
+
+
+def read_weight_list(path):
+    """Reads a binary response matrix file into the weight list format of
+    weight_calc.calculate_weights
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    weights : list of tuples
+        (det num, run num, source name, weight) sorted by det num, run num,
+        and source name
+    """
+    tensor, det_nums, run_nums, src_names, _ = read_weights(path)
+    return wc.tensor_to_list(tensor, [int(x) for x in det_nums],
+                             [int(x) for x in run_nums],
+                             [str(x) for x in src_names])
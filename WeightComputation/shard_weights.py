@@ -0,0 +1,83 @@
+#!/usr/bin/python
+"""This file contains the command line interface of the sharded weight
+calculation, for spreading one calculation across many hosts that share a
+directory (see libpd.sharding)"""
+
+import sys
+from libpd import detector as dt
+from libpd import source_construction as sc
+import libpd.weight_calc as wc
+import libpd.weight_io as wio
+import libpd.sharding as shard
+
+
+def plan(nai_pos_path, shard_dir, num_shards):
+    """Splits the weight calculation of a position file into shards
+
+    Parameters
+    ----------
+    nai_pos_path : str
+        path to the list of AD1 patches, normals, and sizes
+    shard_dir : str
+        the shared directory of the calculation
+    num_shards : int
+        the number of shards to split the calculation into
+    """
+    detectors = dt.make_nai_list(dt.read_positions(nai_pos_path))
+    sources = sc.set_up_source_tables()
+    print "There are {0:d} sources in this run".format(sum([len(x) for x in
+                                                            sources]))
+    shard.plan_shards(shard_dir, detectors, sources, num_shards,
+                      settings={"integrator": "backend"})
+
+
+def merge(shard_dir, out_name):
+    """Merges the finished shards into a binary response matrix file
+
+    Parameters
+    ----------
+    shard_dir : str
+        the shared directory of the calculation
+    out_name : str
+        name of the output file
+    """
+    tensor, det_nums, run_nums, src_names = shard.merge_shards(shard_dir)
+    metadata = {"integrator": "backend",
+                "settings": wc.integrator_settings("backend"),
+                "wall_divs": sc.WALL_DIVS,
+                "multi_res_bases": None,
+                "num_sources": len(src_names),
+                "shard_dir": shard_dir}
+    wio.write_weights(out_name, wc.tensor_to_list(tensor, det_nums, run_nums,
+                                                  src_names), metadata)
+
+
+USAGE = """Usage:
+    {0:s} plan <Path To NaI Center Points File> <Shard Directory> <Number of Shards>
+    {0:s} work <Shard Directory> <Number of Cores> [Weight Cache File]
+    {0:s} requeue <Shard Directory> <Claim Age In Seconds>
+    {0:s} merge <Shard Directory> <Output File Name>
+Commands:
+    plan      Write the shards of the calculation to the shard directory
+    work      Calculate unclaimed shards until there are none left, run any
+              number of these on any hosts that see the shard directory
+    requeue   Put shards whose claims were not refreshed for longer than
+              the age (running workers refresh them every minute, so their
+              workers died) back in the queue
+    merge     Write the weights of the finished shards to a .npz file
+"""
+
+if __name__ == "__main__":
+    ARGS = sys.argv[1:]
+    if len(ARGS) == 4 and ARGS[0] == "plan":
+        plan(ARGS[1], ARGS[2], int(ARGS[3]))
+    elif len(ARGS) in [3, 4] and ARGS[0] == "work":
+        shard.run_worker(ARGS[1], int(ARGS[2]),
+                         (ARGS[3] if len(ARGS) == 4 else None))
+    elif len(ARGS) == 3 and ARGS[0] == "requeue":
+        shard.release_stale_claims(ARGS[1], float(ARGS[2]))
+    elif len(ARGS) == 3 and ARGS[0] == "merge":
+        merge(ARGS[1], ARGS[2])
+    else:
+        print USAGE.format(sys.argv[0])
+        sys.exit()
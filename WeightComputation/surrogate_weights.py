@@ -0,0 +1,135 @@
+#!/usr/bin/python
+"""This file contains the surrogate mode of the weight calculation, building
+the interpolation grid of the weights over the volume of a scan (see
+libpd.surrogate) and interpolating the weights of detector positions from
+it"""
+
+import sys
+import time
+from libpd import detector as dt
+from libpd import source_construction as sc
+import libpd.surrogate as sur
+import libpd.weight_calc as wc
+import libpd.weight_io as wio
+
+
+def build(nai_pos_path, core_count, surrogate_path, cache_path=None,
+          rtol=sur.DEFAULT_RTOL, max_level=sur.MAX_LEVEL,
+          cost_model_path=None):
+    """Integrates the weights on a grid over the volume of the detector
+    positions of a file and writes the surrogate
+
+    Parameters
+    ----------
+    nai_pos_path : str
+        path to the list of AD1 patches, normals, and sizes
+    core_count : int
+        number of cores to use for the calculation
+    surrogate_path : str
+        name of the surrogate file
+    cache_path : str
+        path to the weight cache file, or None to not use a cache
+    rtol : float
+        the relative tolerance of the interpolation
+    max_level : int
+        the number of times a cell of the coarsest grid can be split
+    cost_model_path : str
+        if not None, the file the backend cost model (see libpd.scheduler) is
+        loaded from and saved to between runs
+    """
+    positions = dt.read_positions(nai_pos_path)
+    low, high = sur.scan_volume([x[2] for x in positions])
+    sources = sc.set_up_source_tables()
+    print "Building the surrogate of {0:d} sources".format(
+        sum([len(x) for x in sources]))
+    surrogate, max_error, unresolved = sur.build_surrogate(
+        low, high, sources, core_count, rtol=rtol, max_level=max_level,
+        cache_path=cache_path, cost_model_path=cost_model_path)
+    temp = "The surrogate has {0:d} nodes and {1:d} cells, largest error "\
+        "found at a cell center: {2:.2e}"
+    print temp.format(len(surrogate.node_keys), len(surrogate.leaves),
+                      max_error)
+    if unresolved != 0:
+        temp = "{0:d} cells reached the deepest level without meeting the "\
+            "tolerance, raise --max-level to refine them"
+        print temp.format(unresolved)
+    sur.write_surrogate(surrogate_path, surrogate,
+                        {"integrator": "backend",
+                         "settings": wc.integrator_settings("backend"),
+                         "wall_divs": sc.WALL_DIVS, "rtol": rtol,
+                         "max_error": max_error,
+                         "unresolved_cells": unresolved})
+
+
+def query(surrogate_path, nai_pos_path, out_name, text=False):
+    """Interpolates the weights of the detector positions of a file from a
+    surrogate and writes them like calc_pd_weights.py does
+
+    Parameters
+    ----------
+    surrogate_path : str
+        path to the surrogate file
+    nai_pos_path : str
+        path to the list of AD1 patches, normals, and sizes
+    out_name : str
+        name of the output file
+    text : bool
+        if True, write the weights as lines of text instead of a binary
+        response matrix file (see libpd.weight_io)
+    """
+    surrogate, metadata = sur.read_surrogate(surrogate_path)
+    positions = dt.read_positions(nai_pos_path)
+    start = time.time()
+    weights, inside = surrogate.predict_weights(positions)
+    temp = "Interpolated the weights of {0:d} detector positions in "\
+        "{1:.1f} ms"
+    print temp.format(len(positions), 1000.0*(time.time() - start))
+    if not all(inside):
+        temp = "{0:d} positions are outside the surrogate's volume and got "\
+            "the weights of its nearest point"
+        print temp.format(len(inside) - sum(inside))
+    if not text:
+        metadata["surrogate"] = surrogate_path
+        metadata["num_sources"] = len(surrogate.src_names)
+        wio.write_weights(out_name, weights, metadata)
+        return
+    out_file = open(out_name, 'w')
+    fmt_str = "{0:d}, {1:d}, {2:s}, {3:10.8e}\n"
+    for elem in weights:
+        out_file.write(fmt_str.format(*elem))
+    out_file.close()
+
+
+USAGE = """Usage:
+    {0:s} build <Path To NaI Center Points File> <Number of Cores> <Surrogate File> [Weight Cache File] [Options]
+    {0:s} query <Surrogate File> <Path To NaI Center Points File> <Ouput File Name> [--text]
+Options:
+    --rtol=R          Split cells whose interpolation misses by more than a
+                      relative error of R (default {1:.0e})
+    --max-level=L     Split the coarsest cells at most L times (default {2:d})
+    --cost-model=FILE Keep the backend cost model, which orders the
+                      integrals longest first, in FILE between runs
+"""
+
+if __name__ == "__main__":
+    ARGS = [x for x in sys.argv[1:] if not x.startswith("--")]
+    FLAGS = dict([(x.split("=", 1) + [None])[:2] for x in sys.argv[1:]
+                  if x.startswith("--")])
+    if (len(ARGS) < 1 or
+            (ARGS[0] == "build" and (len(ARGS) not in [4, 5] or
+                                     any([x not in ["--rtol", "--max-level",
+                                                    "--cost-model"]
+                                          for x in FLAGS]))) or
+            (ARGS[0] == "query" and (len(ARGS) != 4 or
+                                     any([x != "--text" for x in FLAGS]))) or
+            ARGS[0] not in ["build", "query"]):
+        print USAGE.format(sys.argv[0], sur.DEFAULT_RTOL, sur.MAX_LEVEL)
+        sys.exit()
+    if ARGS[0] == "build":
+        build(ARGS[1], int(ARGS[2]), ARGS[3],
+              (ARGS[4] if len(ARGS) == 5 else None),
+              rtol=float(FLAGS.get("--rtol") or sur.DEFAULT_RTOL),
+              max_level=int(FLAGS.get("--max-level") or sur.MAX_LEVEL),
+              cost_model_path=FLAGS.get("--cost-model"))
+    else:
+        query(ARGS[1], ARGS[2], ARGS[3], text=("--text" in FLAGS))
@@ -0,0 +1,40 @@
+#!/usr/bin/python
+"""This file prints the report of where the backend integration time went
+from one or more telemetry files (see libpd.telemetry)"""
+
+import sys
+import libpd.telemetry as tel
+
+
+def main(paths, num_hotspots):
+    """Reads the telemetry files and prints the report of their records
+
+    Parameters
+    ----------
+    paths : list of str
+        The paths to the telemetry files
+    num_hotspots : int
+        The number of (source class, distance band) bins to list
+    """
+    records = []
+    for path in paths:
+        records.extend(tel.read_telemetry(path))
+    for line in tel.format_report(records, num_hotspots):
+        print line
+
+
+USAGE = """Usage:
+    {0:s} <Telemetry File> [More Telemetry Files] [--hotspots=N]
+"""
+
+if __name__ == "__main__":
+    ARGS = [x for x in sys.argv[1:] if not x.startswith("--")]
+    FLAGS = [x for x in sys.argv[1:] if x.startswith("--")]
+    if (len(ARGS) == 0 or
+            any([not x.startswith("--hotspots=") for x in FLAGS])):
+        print USAGE.format(sys.argv[0])
+        sys.exit()
+    HOTSPOTS = tel.NUM_HOTSPOTS
+    for FLAG in FLAGS:
+        HOTSPOTS = int(FLAG.split("=", 1)[1])
+    main(ARGS, HOTSPOTS)
@@ -5,6 +5,7 @@ from the output of calc_pd_weights and calc_ss_weights"""
 import sys
 import numpy as np
 import ROOT as rt
+import libpd.weight_io as wio
 
 # TODO: write proper doc strings for this code
 NUM_POS = 52
@@ -47,10 +48,13 @@ def write_resp_func(outfile_name, raw_data, name_list):
 
 
 def read_input_file(infile_name):
-    infile = open(infile_name)
+    if infile_name.endswith(wio.NPZ_EXT):
+        lines = wio.read_weight_list(infile_name)
+    else:
+        lines = [[x.strip() for x in line.strip().split(',')] for line in
+                 open(infile_name)]
     out_list = []
-    for line in infile:
-        elems = [x.strip() for x in line.strip().split(',')]
+    for elems in lines:
         temp = []
         dnum = int(elems[0])
         rnum = int(elems[1])